@@ -1,9 +1,13 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Product, Reservation, Order, OrderItem, AuditLog
+from .models import Product, Reservation, Order, OrderItem, AuditLog, StockBucket, DailySalesRollup, ProductSalesRollup, UserSalesRollup
 admin.site.register(Product)
 admin.site.register(Reservation)
 admin.site.register(Order)
 admin.site.register(OrderItem)
 admin.site.register(AuditLog)
+admin.site.register(StockBucket)
+admin.site.register(DailySalesRollup)
+admin.site.register(ProductSalesRollup)
+admin.site.register(UserSalesRollup)
@@ -7,4 +7,7 @@ class BaseConfig(AppConfig):
 
     def ready(self):
         import base.signals
+        from base.services import telemetry
+
+        telemetry.install()
         
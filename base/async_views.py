@@ -0,0 +1,137 @@
+"""
+Native async versions of the read-heavy endpoints (served under /api/async/).
+
+They use the async ORM (afirst, async for) and the fast path mappers, so
+under ASGI one worker keeps thousands of slow clients in flight without a
+thread per request. Responses, ETags and pagination are the same as the
+sync endpoints; writes stay on the sync DRF views.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.filters import OrderingFilter
+from rest_framework.request import Request
+
+from .conditional import detail_etag, etag_matches, make_etag, page_etag
+from .fastpath import FieldMapper, json_response
+from .models import AuditLog, Order, Reservation
+from .pagination import AuditLogKeysetPagination, OrderKeysetPagination
+from .serializers import AuditLogFilter, OrderFilter
+from .services import catalog_cache
+from .services.telemetry import timed
+from .views import AUDIT_LOG_FAST_FIELDS, ORDER_FAST_FIELDS, RESERVATION_FAST_FIELDS, OrderListView
+
+
+def not_modified(etag):
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    return response
+
+
+def not_found(request, model):
+    return json_response(request, {'detail': f'No {model._meta.object_name} matches the given query.'}, status=404)
+
+
+class AsyncDetailView(View):
+    model = None
+    mapper = None
+
+    async def get(self, request, pk):
+        row = await self.model.objects.filter(pk=pk).values(*self.mapper.values).afirst()
+        if row is None:
+            return not_found(request, self.model)
+
+        etag = detail_etag(self.model, pk, row['updated_at'])
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        with timed('serialize'):
+            data = self.mapper(row)
+
+        response = json_response(request, data)
+        response['ETag'] = etag
+        return response
+
+
+class AsyncOrderDetailView(AsyncDetailView):
+    model = Order
+    mapper = FieldMapper(Order, ORDER_FAST_FIELDS, ['updated_at'])
+
+
+class AsyncReservationDetailView(AsyncDetailView):
+    model = Reservation
+    mapper = FieldMapper(Reservation, RESERVATION_FAST_FIELDS, ['updated_at'])
+
+
+class AsyncKeysetListView(View):
+    model = None
+    mapper = None
+    filterset_class = None
+    pagination_class = None
+    filter_backends = []
+    etag_version_field = None
+
+    async def get(self, request, **kwargs):
+        request = Request(request)
+        filterset = self.filterset_class(request.query_params, queryset=self.get_queryset())
+        if not filterset.is_valid():
+            # plain lists, the ErrorList values would serialize as []
+            return json_response(request, {field: list(errors) for field, errors in filterset.errors.items()}, status=400)
+
+        paginator = self.pagination_class()
+        try:
+            rows = await paginator.apaginate_queryset(filterset.qs.values(*self.mapper.values), request, view=self)
+        except APIException as e:
+            return json_response(request, {'detail': str(e.detail)}, status=e.status_code)
+
+        etag = None
+        if self.etag_version_field:
+            etag = page_etag(self.model, rows, paginator.get_next_link(), self.etag_version_field)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+        with timed('serialize'):
+            data = [self.mapper(row) for row in rows]
+
+        response = json_response(request, paginator.get_paginated_response(data).data)
+        if etag:
+            response['ETag'] = etag
+        return response
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+
+class AsyncOrderListView(AsyncKeysetListView):
+    model = Order
+    filterset_class = OrderFilter
+    pagination_class = OrderKeysetPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = OrderListView.ordering_fields
+    ordering = OrderListView.ordering
+    etag_version_field = 'updated_at'
+    mapper = FieldMapper(Order, ORDER_FAST_FIELDS, ['id', 'created_at', 'total_price', 'updated_at'])
+
+
+class AsyncAuditLogView(AsyncKeysetListView):
+    model = AuditLog
+    filterset_class = AuditLogFilter
+    pagination_class = AuditLogKeysetPagination
+    mapper = FieldMapper(AuditLog, AUDIT_LOG_FAST_FIELDS, ['timestamp', 'id'])
+
+
+class AsyncProductListView(View):
+    # the catalog cache talks to Redis / the database synchronously
+    async def get(self, request):
+        versions = await sync_to_async(catalog_cache.get_versions)()
+        if versions is None:
+            return json_response(request, await sync_to_async(catalog_cache.get_catalog)())
+
+        etag = make_etag('catalog', *versions)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = json_response(request, await sync_to_async(catalog_cache.get_catalog)(versions))
+        response['ETag'] = etag
+        return response
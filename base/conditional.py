@@ -0,0 +1,104 @@
+import hashlib
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from base.services.telemetry import timed
+
+
+def make_etag(*parts):
+    """Strong ETag over the given values (the version of what is rendered)."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in (tag.strip().removeprefix('W/') for tag in header.split(','))
+
+
+def row_value(row, name):
+    # model instances or .values() dicts (fast path)
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def detail_etag(model, pk, version):
+    return make_etag(model._meta.label, str(pk), version.isoformat())
+
+
+def page_etag(model, rows, next_link, version_field='updated_at'):
+    """ETag of a list page: its (pk, version) pairs and its next link."""
+    pk = model._meta.pk.attname
+    return make_etag(
+        model._meta.label,
+        [(row_value(row, pk), row_value(row, version_field).isoformat()) for row in rows],
+        next_link,
+    )
+
+
+def not_modified(etag):
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+
+class ConditionalRetrieveMixin:
+    """
+    ETag / If-None-Match for retrieve().
+
+    The version column (`etag_version_field`) is read with a primary key
+    lookup first; when it matches the client's ETag a 304 is returned
+    without loading the row or building the serializer.
+    """
+
+    etag_version_field = 'updated_at'
+
+    def get_etag(self, pk, version):
+        return detail_etag(self.get_queryset().model, pk, version)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        version = self.get_queryset().filter(**lookup).values_list(self.etag_version_field, flat=True).first()
+
+        if version is not None:
+            etag = self.get_etag(lookup[self.lookup_field], version)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+        instance = self.get_object()
+        with timed('serialize'):
+            data = self.get_serializer(instance).data
+        response = Response(data)
+        response['ETag'] = self.get_etag(instance.pk, getattr(instance, self.etag_version_field))
+        return response
+
+
+class ConditionalListMixin:
+    """
+    ETag / If-None-Match for paginated list(): the ETag covers the
+    (pk, version) pairs of the page and its next link, so an unchanged
+    page is answered with 304 without running the serializer.
+    """
+
+    etag_version_field = 'updated_at'
+
+    def page_etag(self, model, rows, paginated):
+        next_link = self.paginator.get_next_link() if paginated else None
+        return page_etag(model, rows, next_link, self.etag_version_field)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+
+        etag = self.page_etag(queryset.model, rows, page is not None)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        with timed('serialize'):
+            data = self.get_serializer(rows, many=True).data
+        response = self.get_paginated_response(data) if page is not None else Response(data)
+        response['ETag'] = etag
+        return response
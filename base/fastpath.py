@@ -0,0 +1,206 @@
+"""
+Serializer-free read path for hot, read-only endpoints.
+
+A view opts in by listing its output in `fast_fields`; rows are then read
+with .values() on that fixed projection, turned into dicts by a mapper
+compiled once per view class and encoded with orjson when it is
+installed (stdlib json otherwise). The bytes are the ones the
+ModelSerializer + RequestIDJSONRenderer path produces:
+- DecimalField -> "12.50" (COERCE_DECIMAL_TO_STRING)
+- DateTimeField -> ISO 8601 in the current time zone, "+00:00" as "Z"
+- foreign keys -> the related id
+- dict responses get "request_id" appended
+
+Requests for other renderers (browsable API) and settings.FAST_READ_PATH
+= False fall back to the serializer path.
+"""
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+
+from base.conditional import etag_matches, not_modified
+from base.services.telemetry import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+
+def _decimal(decimal_places):
+    exponent = Decimal(1).scaleb(-decimal_places)
+
+    def convert(value):
+        return format(value.quantize(exponent), 'f')
+    return convert
+
+
+def _datetime(value):
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def converter_for(field):
+    if isinstance(field, models.DecimalField):
+        return _decimal(field.decimal_places)
+    if isinstance(field, models.DateTimeField):
+        return _datetime
+    if isinstance(field, (models.DateField, models.TimeField)):
+        return _isoformat
+    if isinstance(field, models.UUIDField):
+        return str
+    return None
+
+
+class FieldMapper:
+    """
+    Compiled projection for one endpoint.
+
+    `fields` lists the output keys in serializer order: a model field name,
+    or (output name, model field name, converter) for computed values such
+    as ('get_total_price', 'total_price', float).
+    """
+
+    def __init__(self, model, fields, extra=()):
+        self.keys = []
+        self.columns = []
+        converters = []
+
+        for spec in fields:
+            if isinstance(spec, tuple):
+                key, name, convert = spec
+            else:
+                key, name, convert = spec, spec, None
+            field = model._meta.get_field(name)
+            self.keys.append(key)
+            self.columns.append(field.attname)
+            converters.append(convert or converter_for(field))
+
+        self.converted = [(i, convert) for i, convert in enumerate(converters) if convert is not None]
+
+        # extra columns (ordering / version keys) are read but not rendered
+        self.values = list(dict.fromkeys([*self.columns, *extra]))
+        self._index = [self.values.index(column) for column in self.columns]
+
+    def __call__(self, row):
+        values = [row[self.values[i]] for i in self._index]
+        for i, convert in self.converted:
+            if values[i] is not None:
+                values[i] = convert(values[i])
+        return dict(zip(self.keys, values))
+
+
+def dumps(data):
+    """Bytes equal to what DRF's JSONRenderer writes (compact, UTF-8)."""
+    if orjson is not None:
+        try:
+            content = orjson.dumps(data)
+        except (TypeError, orjson.JSONEncodeError):
+            content = None
+        if content is not None:
+            return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+    content = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return content.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+def json_response(request, data, status=200):
+    if isinstance(data, dict):
+        data['request_id'] = getattr(request, 'request_id', None)
+    with timed('render'):
+        content = dumps(data)
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+def is_enabled(request):
+    renderer = getattr(request, 'accepted_renderer', None)
+    return getattr(settings, 'FAST_READ_PATH', True) and renderer is not None and renderer.format == 'json'
+
+
+class FastReadMixin:
+    """
+    Opt-in fast path for list() and retrieve() of generic views.
+
+    Works with KeysetPagination (rows are dicts) and the conditional GET
+    mixins (the version column is read in the same query).
+    """
+
+    fast_fields = None
+    _mappers = {}
+
+    def get_fast_mapper(self):
+        cls = type(self)
+        mapper = FastReadMixin._mappers.get(cls)
+        if mapper is None:
+            extra = []
+            paginator = self.paginator
+            if paginator is not None and hasattr(paginator, 'unique_field'):
+                extra.append(paginator.unique_field)
+                extra.extend(field.lstrip('-') for field in getattr(cls, 'ordering_fields', None) or ())
+                extra.extend(field.lstrip('-') for field in paginator.ordering)
+            if getattr(self, 'etag_version_field', None):
+                extra.append(self.etag_version_field)
+            model = self.get_queryset().model
+            extra.append(model._meta.pk.attname)
+            mapper = FastReadMixin._mappers[cls] = FieldMapper(model, self.fast_fields, extra)
+        return mapper
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_fields or not is_enabled(request):
+            return super().list(request, *args, **kwargs)
+
+        mapper = self.get_fast_mapper()
+        queryset = self.filter_queryset(self.get_queryset()).values(*mapper.values)
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+
+        etag = None
+        if hasattr(self, 'page_etag'):
+            etag = self.page_etag(queryset.model, rows, page is not None)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+        with timed('serialize'):
+            data = [mapper(row) for row in rows]
+        if page is not None:
+            data = self.get_paginated_response(data).data
+
+        response = json_response(request, data)
+        if etag:
+            response['ETag'] = etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.fast_fields or not is_enabled(request):
+            return super().retrieve(request, *args, **kwargs)
+
+        mapper = self.get_fast_mapper()
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        row = self.filter_queryset(self.get_queryset()).filter(**lookup).values(*mapper.values).first()
+        if row is None:
+            raise Http404(f"No {self.get_queryset().model._meta.object_name} matches the given query.")
+
+        etag = None
+        if hasattr(self, 'get_etag'):
+            pk = row[self.get_queryset().model._meta.pk.attname]
+            etag = self.get_etag(pk, row[self.etag_version_field])
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+        with timed('serialize'):
+            data = mapper(row)
+
+        response = json_response(request, data)
+        if etag:
+            response['ETag'] = etag
+        return response
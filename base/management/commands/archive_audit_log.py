@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from base.services import audit_archive
+
+
+class Command(BaseCommand):
+    help = "Export audit log months older than the retention period to NDJSON segments and drop them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-months", type=int, default=None)
+        parser.add_argument("--dir", default=None, help="Segment directory (default AUDIT_LOG_RETENTION['ARCHIVE_DIR'])")
+        parser.add_argument("--dry-run", action="store_true", help="Only list the months that would be archived")
+
+    def handle(self, *args, **options):
+        created = audit_archive.ensure_partitions()
+        if created:
+            self.stdout.write(f"Partitions present: {', '.join(created)}")
+
+        archived = audit_archive.archive_old_months(
+            retention_months=options["retention_months"],
+            directory=options["dir"],
+            dry_run=options["dry_run"],
+        )
+
+        if not archived:
+            self.stdout.write("Nothing to archive")
+        for year, month, path, rows in archived:
+            if rows is None:
+                self.stdout.write(f"{year:04d}-{month:02d} would be archived to {path}")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{year:04d}-{month:02d}: {rows} rows archived to {path}"))
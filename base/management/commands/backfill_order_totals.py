@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from base.models import Order, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = "Snapshot missing OrderItem.unit_price values and recompute Order.total_price"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        priced = OrderItem.objects.filter(unit_price__isnull=True).update(
+            unit_price=Subquery(Product.objects.filter(id=OuterRef("product_id")).values("price")[:1])
+        )
+        self.stdout.write(f"Snapshotted price on {priced} order items")
+
+        line_total = ExpressionWrapper(
+            F("quantity") * F("unit_price"),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        item_totals = (
+            OrderItem.objects
+            .filter(order=OuterRef("pk"))
+            .values("order")
+            .annotate(total=Sum(line_total))
+            .values("total")
+        )
+        total_price = Coalesce(
+            Subquery(item_totals, output_field=DecimalField(max_digits=12, decimal_places=2)),
+            Value(0, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+        updated = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Order.objects.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                # updated_at is the order's ETag: cached copies must see the new total
+                updated += Order.objects.filter(id__in=ids).update(total_price=total_price, updated_at=timezone.now())
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Recomputed total_price on {updated} orders"))
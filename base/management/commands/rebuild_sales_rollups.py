@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from base.models import DailySalesRollup, ProductSalesRollup, UserSalesRollup
+from base.services import rollup_service
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily, product and user sales rollups from orders and order items"
+
+    def handle(self, *args, **options):
+        rollup_service.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {DailySalesRollup.objects.count()} daily, "
+            f"{ProductSalesRollup.objects.count()} product and "
+            f"{UserSalesRollup.objects.count()} user rollup rows"
+        ))
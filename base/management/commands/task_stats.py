@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base.services import metrics, task_telemetry  # noqa: F401 (declares the task metrics)
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+class Command(BaseCommand):
+    help = "Live summary of the Celery task telemetry (queue lag, runtime, retries, lock wait, expiry lag)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between refreshes")
+        parser.add_argument("--once", action="store_true", help="Print one summary and exit")
+
+    def handle(self, *args, **options):
+        if not metrics.is_multiprocess():
+            self.stderr.write("TELEMETRY MODE is not \"multiprocess\": set METRICS_MULTIPROC_DIR to the workers' directory")
+        while True:
+            summary = self.summary()
+            if options["once"]:
+                self.stdout.write(summary)
+                return
+            # clear the terminal, then redraw
+            self.stdout.write("\033[2J\033[H" + summary)
+            time.sleep(options["interval"])
+
+    def summary(self):
+        samples = metrics.collect()
+
+        def histogram(name, *labels):
+            return samples.get((name, labels))
+
+        def q(name, sample, quantile):
+            return metrics.quantile(name, sample, quantile) if sample else None
+
+        tasks = sorted({labels[0] for name, labels in samples if name.startswith("celery_task")})
+        lines = [
+            f"{'task':<40} {'done':>7} {'failed':>7} {'retries':>7} "
+            f"{'lag p50/p95 s':>14} {'run p50/p95 ms':>15} {'lock p95 ms':>11}",
+        ]
+        for task in tasks:
+            states = {labels[1]: value for (name, labels), value in samples.items() if name == "celery_tasks_total" and labels[0] == task}
+            runtime = None
+            for (name, labels), sample in samples.items():
+                if name == "celery_task_runtime_seconds" and labels[0] == task:
+                    runtime = sample if runtime is None else [a + b for a, b in zip(runtime, sample)]
+            lag = histogram("celery_task_queue_lag_seconds", task)
+            lock = histogram("celery_task_lock_wait_seconds", task)
+
+            lines.append(
+                f"{task:<40} {sum(states.values()):>7} {states.get('FAILURE', 0):>7} "
+                f"{samples.get(('celery_task_retries_total', (task,)), 0):>7} "
+                f"{_seconds(q('celery_task_queue_lag_seconds', lag, 0.5)) + '/' + _seconds(q('celery_task_queue_lag_seconds', lag, 0.95)):>14} "
+                f"{_ms(q('celery_task_runtime_seconds', runtime, 0.5)) + '/' + _ms(q('celery_task_runtime_seconds', runtime, 0.95)):>15} "
+                f"{_ms(q('celery_task_lock_wait_seconds', lock, 0.95)):>11}"
+            )
+        if not tasks:
+            lines.append("(no tasks recorded yet)")
+
+        lines.append("")
+        for source in ("task", "sweeper"):
+            lag = histogram("reservation_release_lag_seconds", source)
+            if lag:
+                lines.append(
+                    f"Reservation release lag ({source}): {lag[-1]} released, "
+                    f"p50 {_seconds(q('reservation_release_lag_seconds', lag, 0.5))} s, "
+                    f"p95 {_seconds(q('reservation_release_lag_seconds', lag, 0.95))} s"
+                )
+
+        queues = metrics.read_gauge("celery_queue_length")
+        if queues:
+            lines.append("Queued: " + ", ".join(f"{queue} {length}" for (queue,), length in sorted(queues.items())))
+        else:
+            lines.append("Queued: broker unreachable")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,84 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpResponse
+
+from base.fastpath import json_response
+from base.services import idempotency
+
+
+class IdempotencyMiddleware:
+    """
+    Runs POSTs to settings.IDEMPOTENCY["PATHS"] at most once per
+    `Idempotency-Key` header (see base.services.idempotency).
+
+    Must come after RequestIDMiddleware: a replayed response carries the
+    request id of the request that produced it, in the body and in
+    X-Request-ID.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not idempotency.applies_to(request):
+            return self.get_response(request)
+
+        key = request.headers[idempotency.HEADER]
+        if len(key) > 255:
+            return self.invalid_key(request)
+
+        outcome, record = idempotency.begin(key, idempotency.fingerprint(request), request.request_id)
+        if outcome != idempotency.RUN:
+            return self.reject(request, outcome, record)
+
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            idempotency.finish(key, request.request_id, response)
+        return response
+
+    async def __acall__(self, request):
+        if not idempotency.applies_to(request):
+            return await self.get_response(request)
+
+        key = request.headers[idempotency.HEADER]
+        if len(key) > 255:
+            return self.invalid_key(request)
+
+        outcome, record = await sync_to_async(idempotency.begin)(key, idempotency.fingerprint(request), request.request_id)
+        if outcome != idempotency.RUN:
+            return self.reject(request, outcome, record)
+
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(idempotency.finish)(key, request.request_id, response)
+        return response
+
+    @staticmethod
+    def invalid_key(request):
+        return json_response(request, {"detail": "Idempotency-Key must be at most 255 characters."}, status=400)
+
+    @staticmethod
+    def reject(request, outcome, record):
+        if outcome == idempotency.MISMATCH:
+            return json_response(request, {"detail": "Idempotency-Key was already used for a different request."}, status=422)
+
+        if outcome == idempotency.BUSY:
+            response = json_response(request, {"detail": "A request with this Idempotency-Key is still in progress."}, status=409)
+            response["Retry-After"] = "1"
+            return response
+
+        # replay: keep the original request id (RequestIDMiddleware sets the header from it)
+        request.request_id = record.request_id
+        response = HttpResponse(bytes(record.response_body), status=record.response_status, content_type=record.content_type)
+        response["Idempotent-Replayed"] = "true"
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 09:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_auditlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sharded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='StockBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('available_stock', models.IntegerField(default=0)),
+                ('reserved_stock', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='base.product')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='bucket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='base.stockbucket'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockbucket',
+            constraint=models.UniqueConstraint(fields=('product', 'index'), name='unique_product_bucket'),
+        ),
+    ]
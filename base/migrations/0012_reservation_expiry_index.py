@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_stock_buckets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['is_active', 'expires_at'], name='base_reserv_is_acti_d2c152_idx'),
+        ),
+    ]
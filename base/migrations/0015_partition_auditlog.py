@@ -0,0 +1,135 @@
+# Generated by Django 6.0 on 2026-10-18 09:20
+
+from django.db import migrations
+
+
+# Indexes of AuditLog.Meta (0014), recreated on the partitioned parent so
+# every monthly partition gets them.
+INDEXES = [
+    ('base_auditl_timesta_e3007f_idx', '"timestamp", "id"'),
+    ('base_auditl_object__bbc991_idx', '"object_type", "object_id", "timestamp", "id"'),
+    ('base_auditl_actor_cfc9e0_idx', '"actor", "timestamp", "id"'),
+    ('base_auditl_action_24396c_idx', '"action", "timestamp", "id"'),
+]
+
+MONTHS_AHEAD = 3
+
+
+def _months(first, last):
+    year, month = first
+    while (year, month) <= last:
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def partition_auditlog(apps, schema_editor):
+    """
+    Turn base_auditlog into a table range-partitioned by month on
+    "timestamp" (Postgres only, SQLite keeps the plain table).
+
+    Postgres requires the partition key in the primary key, so the table
+    key becomes (id, timestamp); id keeps coming from a sequence and stays
+    unique, Django still sees "id" as the primary key.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT min(timestamp AT TIME ZONE 'UTC'), max(id), now() AT TIME ZONE 'UTC' FROM base_auditlog"
+        )
+        oldest, max_id, now = cursor.fetchone()
+
+    first = (oldest.year, oldest.month) if oldest else (now.year, now.month)
+    last_month = now.month + MONTHS_AHEAD
+    last = (now.year + (last_month - 1) // 12, (last_month - 1) % 12 + 1)
+
+    execute = schema_editor.execute
+    execute('ALTER TABLE base_auditlog RENAME TO base_auditlog_unpartitioned')
+    for name, _ in INDEXES:
+        execute(f'DROP INDEX IF EXISTS "{name}"')
+
+    execute('CREATE SEQUENCE base_auditlog_pk_seq')
+    execute(
+        'CREATE TABLE base_auditlog ('
+        " id bigint NOT NULL DEFAULT nextval('base_auditlog_pk_seq'),"
+        ' actor varchar(50) NOT NULL,'
+        ' action varchar(50) NOT NULL,'
+        ' object_type varchar(50) NOT NULL,'
+        ' object_id varchar(50) NOT NULL,'
+        ' old_value jsonb NULL,'
+        ' new_value jsonb NULL,'
+        ' "timestamp" timestamp with time zone NOT NULL,'
+        ' PRIMARY KEY (id, "timestamp")'
+        ') PARTITION BY RANGE ("timestamp")'
+    )
+    execute('ALTER SEQUENCE base_auditlog_pk_seq OWNED BY base_auditlog.id')
+    execute('CREATE TABLE base_auditlog_default PARTITION OF base_auditlog DEFAULT')
+
+    for year, month in _months(first, last):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        execute(
+            f'CREATE TABLE base_auditlog_p{year:04d}_{month:02d} PARTITION OF base_auditlog '
+            f"FOR VALUES FROM ('{year:04d}-{month:02d}-01 00:00:00+00') "
+            f"TO ('{next_year:04d}-{next_month:02d}-01 00:00:00+00')"
+        )
+
+    execute(
+        'INSERT INTO base_auditlog (id, actor, action, object_type, object_id, old_value, new_value, "timestamp") '
+        'SELECT id, actor, action, object_type, object_id, old_value, new_value, "timestamp" '
+        'FROM base_auditlog_unpartitioned'
+    )
+    execute(f"SELECT setval('base_auditlog_pk_seq', {(max_id or 0) + 1}, false)")
+    execute('DROP TABLE base_auditlog_unpartitioned')
+
+    for name, columns in INDEXES:
+        execute(f'CREATE INDEX "{name}" ON base_auditlog ({columns})')
+
+
+def unpartition_auditlog(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    execute = schema_editor.execute
+    execute('ALTER TABLE base_auditlog RENAME TO base_auditlog_partitioned')
+    for name, _ in INDEXES:
+        execute(f'DROP INDEX IF EXISTS "{name}"')
+
+    execute(
+        'CREATE TABLE base_auditlog ('
+        ' id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,'
+        ' actor varchar(50) NOT NULL,'
+        ' action varchar(50) NOT NULL,'
+        ' object_type varchar(50) NOT NULL,'
+        ' object_id varchar(50) NOT NULL,'
+        ' old_value jsonb NULL,'
+        ' new_value jsonb NULL,'
+        ' "timestamp" timestamp with time zone NOT NULL'
+        ')'
+    )
+    execute(
+        'INSERT INTO base_auditlog (id, actor, action, object_type, object_id, old_value, new_value, "timestamp") '
+        'SELECT id, actor, action, object_type, object_id, old_value, new_value, "timestamp" '
+        'FROM base_auditlog_partitioned'
+    )
+    execute(
+        "SELECT setval(pg_get_serial_sequence('base_auditlog', 'id'), "
+        "COALESCE((SELECT max(id) FROM base_auditlog), 0) + 1, false)"
+    )
+    execute('DROP TABLE base_auditlog_partitioned CASCADE')
+
+    for name, columns in INDEXES:
+        execute(f'CREATE INDEX "{name}" ON base_auditlog ({columns})')
+
+
+class Migration(migrations.Migration):
+
+    atomic = True
+
+    dependencies = [
+        ('base', '0014_auditlog_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_auditlog, unpartition_auditlog),
+    ]
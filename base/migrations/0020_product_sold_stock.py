@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0019_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sold_stock',
+            field=models.IntegerField(default=0),
+        ),
+    ]
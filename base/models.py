@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.core.serializers.json import DjangoJSONEncoder
 
 # Create your models here.
 from django.utils import timezone
@@ -10,32 +12,189 @@ class Product(models.Model):
     total_stock = models.IntegerField()
     available_stock = models.IntegerField()
     reserved_stock = models.IntegerField()
+    # units of confirmed orders and purchases: they stay part of total_stock
+    sold_stock = models.IntegerField(default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2,default=0)
+    # When True the live counters live in StockBucket rows and
+    # available_stock / reserved_stock above are an aggregate kept in sync
+    # by the rebalancer.
+    sharded = models.BooleanField(default=False)
+
+    def stock_levels(self):
+        """(available, reserved) - summed over the buckets for sharded products."""
+        if not self.sharded:
+            return self.available_stock, self.reserved_stock
+        buckets = self.buckets.all()
+        return (
+            sum(bucket.available_stock for bucket in buckets),
+            sum(bucket.reserved_stock for bucket in buckets),
+        )
 
     def clean(self):
-        assert self.available_stock + self.reserved_stock == self.total_stock
+        available, reserved = self.stock_levels()
+        assert available + reserved + self.sold_stock == self.total_stock
+        assert min(available, reserved, self.sold_stock) >= 0
+
+
+class StockBucket(models.Model):
+    product = models.ForeignKey(Product, related_name='buckets', on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    available_stock = models.IntegerField(default=0)
+    reserved_stock = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'index'], name='unique_product_bucket'),
+        ]
 
 class Reservation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    bucket = models.ForeignKey(StockBucket, null=True, blank=True, on_delete=models.SET_NULL)
     quantity = models.IntegerField()
     expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # bumped on every write (ETag of the reservation detail)
+    updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'expires_at']),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey('Order', related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField()
-    
+    # product price at the time the item was added
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
     def get_price(self):
-        return self.product.price * self.quantity
-    
+        unit_price = self.unit_price if self.unit_price is not None else self.product.price
+        return unit_price * self.quantity
+
+    def _line(self):
+        # (order, product, quantity, price) as counted in totals and rollups
+        price = self.unit_price * self.quantity if self.unit_price is not None else 0
+        return (self.order_id, self.product_id, self.quantity, price)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_line = instance._line()
+        return instance
 
+    # Order.total_price and the sales rollups are kept up to date with
+    # F() deltas, never recomputed
+    def save(self, *args, **kwargs):
+        from base.services import rollup_service
+
+        if self.unit_price is None:
+            self.unit_price = self.product.price
+
+        old_line = getattr(self, '_loaded_line', None)
+        new_line = self._line()
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            old_order_id, _, _, old_price = old_line or (None, None, 0, 0)
+            if old_order_id is not None and old_order_id != self.order_id:
+                Order.add_to_total(old_order_id, -old_price)
+                old_price = 0
+            Order.add_to_total(self.order_id, new_line[3] - old_price)
+            rollup_service.item_changed(old_line, new_line)
+
+        self._loaded_line = new_line
+
+    def delete(self, *args, **kwargs):
+        from base.services import rollup_service
+
+        line = self._line()
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Order.add_to_total(line[0], -line[3])
+            rollup_service.item_changed(line, None)
+        return result
+
+
+class DailySalesRollup(models.Model):
+    day = models.DateField()
+    status = models.CharField(max_length=100)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='unique_daily_rollup'),
+        ]
+
+
+class ProductSalesRollup(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    status = models.CharField(max_length=100)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # number of order lines for the product
+    order_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
 
-class Order(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'status'], name='unique_product_rollup'),
+        ]
+
+
+class UserSalesRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=100)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'status'], name='unique_user_rollup'),
+        ]
+
+
+class ChangeTrackingMixin:
+    """
+    Remembers the field values a row was loaded with, so the changes made
+    before save() can be computed in memory without re-reading the row.
+    Fields listed in `untracked_fields` are never reported as changes.
+    """
+
+    untracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.reset_tracking()
+        return instance
+
+    def tracked_values(self):
+        return {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and field.name not in self.untracked_fields
+        }
+
+    def reset_tracking(self):
+        self._loaded_values = self.tracked_values()
+
+    def get_changes(self):
+        """{attname: (old, new)} for every loaded field whose value changed."""
+        loaded = getattr(self, '_loaded_values', {})
+        return {
+            name: (loaded.get(name), value)
+            for name, value in self.tracked_values().items()
+            if name not in loaded or loaded[name] != value
+        }
+
+
+class Order(ChangeTrackingMixin, models.Model):
     STATUS = (
         ('PENDING', 'Pending'),
         ('CONFIRMED', 'Confirmed'),
@@ -47,15 +206,42 @@ class Order(models.Model):
     status = models.CharField(max_length=100, choices=STATUS)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # sum of the items' snapshot prices, maintained by OrderItem.save()/delete()
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # bumped on every write, including add_to_total() (ETag of the order)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    untracked_fields = ('updated_at',)
     
     class Meta:
         indexes = [
             models.Index(fields=['user', 'status']),
-            models.Index(fields=['created_at', 'status'])
+            models.Index(fields=['created_at', 'status']),
+            models.Index(fields=['total_price', 'id']),
+            # keyset pagination on (created_at, id)
+            models.Index(fields=['created_at', 'id']),
         ]
 
+    def save(self, *args, **kwargs):
+        # total_price is only ever changed by add_to_total(), a full save of a
+        # stale instance must not overwrite it
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'total_price'
+            ]
+        # auto_now is only written when listed, partial saves must bump it too
+        elif kwargs.get('update_fields') is not None and 'updated_at' not in kwargs['update_fields']:
+            kwargs['update_fields'] = [*kwargs['update_fields'], 'updated_at']
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def add_to_total(order_id, amount):
+        if amount:
+            Order.objects.filter(id=order_id).update(total_price=F('total_price') + amount, updated_at=timezone.now())
+
     def get_total_price(self):
-        return sum(item.get_price() for item in self.items.all())    
+        return self.total_price
 
     def __str__(self):
         return f"{self.user} - {self.status}"
@@ -67,6 +253,32 @@ class AuditLog(models.Model):
     action = models.CharField(max_length=50)
     object_type = models.CharField(max_length=50)
     object_id = models.CharField(max_length=50)
-    old_value = models.JSONField(null=True)
-    new_value = models.JSONField(null=True)
+    old_value = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    new_value = models.JSONField(null=True, encoder=DjangoJSONEncoder)
     timestamp = models.DateTimeField(auto_now_add=True)
+
+    # every index ends with (timestamp, id) so filtered keyset pages are range scans
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id']),
+            models.Index(fields=['object_type', 'object_id', 'timestamp', 'id']),
+            models.Index(fields=['actor', 'timestamp', 'id']),
+            models.Index(fields=['action', 'timestamp', 'id']),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    First response to a POST sent with an `Idempotency-Key` header.
+
+    `response_status` is null while the first request is still running.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    # method, path and body hash: a reused key with another request is rejected
+    fingerprint = models.CharField(max_length=64)
+    request_id = models.CharField(max_length=36)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.BinaryField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
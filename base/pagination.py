@@ -0,0 +1,230 @@
+import base64
+import json
+from urllib import parse
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination on a unique, compound ordering.
+
+    The cursor holds the sort key of the first or last row of the page,
+    the neighbouring page is read with a WHERE on that key instead of an
+    OFFSET, so every page costs one index range scan no matter how deep
+    it is.
+
+    The ordering is the view's OrderingFilter choice (ordering_fields)
+    when it has one, else `ordering`. `unique_field` is appended as a
+    tie-breaker, so ('-total_price',) pages on (total_price, id). Fields
+    may sort in different directions but must not be nullable. Cursors
+    carry their ordering and are rejected when the ordering changes.
+
+    Clients can pick `page_size` up to `max_page_size`. With
+    ?count=estimate (or `estimate_count = True`) the response also
+    carries the planner's row estimate for the filtered queryset instead
+    of a COUNT(*) (Postgres only, null elsewhere).
+    """
+
+    ordering = ('-id',)
+    unique_field = 'id'
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    estimate_count = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.seek(queryset, request, view)
+        if self.include_count:
+            self.count_estimate = self.estimate_queryset_count(queryset)
+        return self.set_page(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views (async ORM iteration)."""
+        queryset = self.seek(queryset, request, view)
+        if self.include_count:
+            self.count_estimate = await sync_to_async(self.estimate_queryset_count)(queryset)
+        return self.set_page([row async for row in queryset[:self.page_size + 1]])
+
+    def seek(self, queryset, request, view):
+        """Order and filter `queryset` for the requested page (no query yet)."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.count_estimate = None
+        self.include_count = self.estimate_count or request.query_params.get(self.count_query_param) == 'estimate'
+
+        self.position, self.reverse = self.decode_cursor(request)
+
+        # going backwards: read the inverted ordering and flip the page
+        ordering = [self.invert(field) for field in self.ordering] if self.reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.seek_filter(self.position, ordering))
+        return queryset
+
+    def set_page(self, page):
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+
+        if self.reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        self.page = page
+
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = list(ordering or self.ordering)
+
+        if self.unique_field not in [field.lstrip('-') for field in ordering]:
+            direction = '-' if ordering[-1].startswith('-') else ''
+            ordering.append(direction + self.unique_field)
+        return tuple(ordering)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def seek_filter(position, ordering):
+        # (a, b, c) after (x, y, z) expanded to OR-ed prefixes, with the
+        # comparison of every field following its own direction
+        fields = [field.lstrip('-') for field in ordering]
+
+        condition = Q()
+        for i, field in enumerate(fields):
+            lookup = 'lt' if ordering[i].startswith('-') else 'gt'
+            prefix = {fields[j]: position[j] for j in range(i)}
+            condition |= Q(**prefix, **{f'{field}__{lookup}': position[i]})
+        return condition
+
+    def position_of(self, row):
+        values = []
+        for field in self.ordering:
+            # model instances, or dicts from .values() querysets
+            name = field.lstrip('-')
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            elif not isinstance(value, (int, float, str, bool)):
+                value = str(value)
+            values.append(value)
+        return values
+
+    def encode_cursor(self, position, reverse=False):
+        payload = {'o': list(self.ordering), 'p': position}
+        if reverse:
+            payload['r'] = True
+        token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        """(position, reverse), (None, False) on the first page."""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(parse.unquote(token).encode()))
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+
+        # cursors issued before orderings were selectable: a bare position
+        if isinstance(payload, list):
+            payload = {'o': list(self.ordering), 'p': payload}
+
+        if not isinstance(payload, dict) or payload.get('o') != list(self.ordering):
+            raise NotFound('Invalid cursor')
+        position = payload.get('p')
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        return position, bool(payload.get('r'))
+
+    def estimate_queryset_count(self, queryset):
+        """Row estimate from the Postgres planner, None on other databases."""
+        if connection.vendor != 'postgresql':
+            return None
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position_of(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position_of(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        body = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+        if self.include_count:
+            body['count_estimate'] = self.count_estimate
+        body['results'] = data
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count_estimate': {'type': 'integer', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class AuditLogKeysetPagination(KeysetPagination):
+    ordering = ('-timestamp', '-id')
+
+
+class OrderKeysetPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 2
+
+
+class DailySalesKeysetPagination(KeysetPagination):
+    ordering = ('day', 'status')
+
+
+class ProductSalesKeysetPagination(KeysetPagination):
+    ordering = ('-revenue', 'product_id')
+
+
+class UserSalesKeysetPagination(KeysetPagination):
+    ordering = ('-revenue', 'user_id')
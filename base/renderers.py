@@ -1,5 +1,7 @@
 from rest_framework.renderers import JSONRenderer
 
+from base.services.telemetry import timed
+
 class RequestIDJSONRenderer(JSONRenderer):
     def render(self, data, accepted_media_type=None, renderer_context=None):
         request = renderer_context.get("request")
@@ -7,8 +9,10 @@ class RequestIDJSONRenderer(JSONRenderer):
 
         # If DRF already returned non-dict data (e.g. list)
         if not isinstance(data, dict):
-            return super().render(data, accepted_media_type, renderer_context)
+            with timed("render"):
+                return super().render(data, accepted_media_type, renderer_context)
 
         data["request_id"] = getattr(request, "request_id", None)
 
-        return super().render(data, accepted_media_type, renderer_context)
+        with timed("render"):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -1,20 +1,30 @@
 from rest_framework import serializers
 from .models import Product, Reservation, Order, AuditLog, OrderItem
 from django.db import transaction
-from datetime import timedelta
-from django.utils import timezone
 
-from .tasks import update_reservation, audit_log
+from .tasks import audit_log
+from .services.reservation_service import reserve_stock, reserve_stock_batch
+from .services.order_service import create_orders_bulk
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
+        # maintained by enable_sharding() and the order settlement, never set by clients
+        read_only_fields = ['sharded', 'sold_stock']
+
+    # sharded products report the live sum of their buckets
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.sharded:
+            data['available_stock'], data['reserved_stock'] = instance.stock_levels()
+        return data
 
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = '__all__'
+        read_only_fields = ['unit_price']
 
 class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,23 +36,17 @@ class ReservationSerializer(serializers.ModelSerializer):
             'created_at': {'read_only': True},
             'is_active': {'read_only': True},
             'expires_at': {'read_only': True},
+            'bucket': {'read_only': True},
         }
     
 
-    #  Reserve stock using DB lock (select_for_update) + transaction.atomic
+    #  Reserve stock through the configured engine (row lock or guarded UPDATE) + transaction.atomic
     def create(self, validated_data):
         with transaction.atomic():
-            product = Product.objects.select_for_update().get(id=validated_data['product'].id)
-            quantity = validated_data['quantity']
-
-            if product.available_stock < quantity:
-                raise serializers.ValidationError("Not enough stock available")
-
-            product.available_stock -= quantity
-            product.reserved_stock += quantity
-            product.save()
-
-            reservation = Reservation.objects.create(**validated_data)
+            try:
+                reservation = reserve_stock(validated_data['product'].id, validated_data['quantity'])
+            except ValueError as e:
+                raise serializers.ValidationError(str(e))
 
             serialized_data = ReservationSerializer(reservation).data
 
@@ -50,12 +54,30 @@ class ReservationSerializer(serializers.ModelSerializer):
 
             audit_log(actor="System", action="Reservation Created", obj_id=reservation.id, obj_type=object_type, old=None, new=serialized_data)
 
-            reservation.expires_at = timezone.now() + timedelta(minutes=10)
-            reservation.save()
+            # expiry is handled by the reservation_cleanup sweeper, no per-reservation ETA task
+            return reservation  
 
-            update_reservation.apply_async(args=[reservation.id], countdown=20)
 
-            return reservation  
+class ReservationLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationBatchSerializer(serializers.Serializer):
+    items = ReservationLineSerializer(many=True, allow_empty=False)
+
+    #  Reserve every line in one transaction, products locked in pk order
+    def create(self, validated_data):
+        with transaction.atomic():
+            reservations = reserve_stock_batch(validated_data['items'])
+
+            for reservation in reservations:
+                audit_log(actor="System", action="Reservation Created", obj_id=reservation.id, obj_type="Reservation", old=None, new=ReservationSerializer(reservation).data)
+
+            return reservations
+
+    def to_representation(self, instance):
+        return {"reservations": ReservationSerializer(instance, many=True).data}
 
 from django.contrib.auth.models import User
 class UserSerializer(serializers.ModelSerializer):
@@ -63,17 +85,53 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email']
 
-from django_filters.rest_framework import FilterSet
 class OrderSerializer(serializers.ModelSerializer):
     # user = UserSerializer()
     class Meta:
         model = Order
-        fields = ['id', 'status', 'created_at', 'user', 'get_total_price']
+        fields = ['id', 'status', 'created_at', 'user', 'get_total_price', 'total_price']
+        read_only_fields = ['total_price']
+
+
+
+class BulkOrderItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BulkOrderLineSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.STATUS, default="PENDING")
+    user = serializers.IntegerField(required=False, allow_null=True, default=None)
+    items = BulkOrderItemSerializer(many=True, allow_empty=False)
+
+
+class OrderBulkCreateSerializer(serializers.Serializer):
+    orders = BulkOrderLineSerializer(many=True, allow_empty=False)
+
+    #  One IN query per product/user set, bulk_create in chunks, audits and rollups in bulk
+    def create(self, validated_data):
+        return create_orders_bulk(validated_data['orders'])
+
+    def to_representation(self, instance):
+        return {
+            "created": len(instance),
+            "orders": [{"id": order.id, "total_price": f"{order.total_price:.2f}"} for order in instance],
+        }
 
 
+class OrderBulkStatusSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.STATUS)
+    # either explicit ids or OrderFilter parameters (status, start_date, end_date, min_total, max_total)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    filter = serializers.DictField(required=False)
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Give either ids or filter")
+        return attrs
+
 
 from django_filters import rest_framework as filters
-from django.db.models import Sum, F
 from .models import Order
 
 class OrderFilter(filters.FilterSet):
@@ -81,25 +139,55 @@ class OrderFilter(filters.FilterSet):
     end_date = filters.DateTimeFilter(field_name="created_at", lookup_expr='lte')
     status = filters.ChoiceFilter(choices=Order.STATUS)
 
-    min_total = filters.NumberFilter( method='filter_min_total')
-    max_total = filters.NumberFilter(method='filter_max_total')
+    # plain range scans on the stored, indexed Order.total_price
+    min_total = filters.NumberFilter(field_name="total_price", lookup_expr='gte')
+    max_total = filters.NumberFilter(field_name="total_price", lookup_expr='lte')
 
     class Meta:
         model = Order
         fields = ['status', 'start_date', 'end_date']
 
-    def filter_min_total(self, queryset, name, value):
-        return queryset.annotate(
-            total=Sum(F('items__quantity') * F('items__product__price'))
-        ).filter(total__gte=value)
-
-    def filter_max_total(self, queryset, name, value):
-        return queryset.annotate(
-            total=Sum(F('items__quantity') * F('items__product__price'))
-        ).filter(total__lte=value)
-
 
 class AuditLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = AuditLog
         fields = '__all__'
+
+
+class AuditLogFilter(filters.FilterSet):
+    start = filters.DateTimeFilter(field_name="timestamp", lookup_expr='gte')
+    end = filters.DateTimeFilter(field_name="timestamp", lookup_expr='lte')
+
+    class Meta:
+        model = AuditLog
+        fields = ['object_type', 'object_id', 'action', 'actor', 'start', 'end']
+
+
+from .models import DailySalesRollup, ProductSalesRollup, UserSalesRollup
+
+class DailySalesRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySalesRollup
+        fields = ['day', 'status', 'revenue', 'order_count', 'units']
+
+
+class ProductSalesRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductSalesRollup
+        fields = ['product', 'status', 'revenue', 'order_count', 'units']
+
+
+class UserSalesRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserSalesRollup
+        fields = ['user', 'status', 'revenue', 'order_count', 'units']
+
+
+class DailySalesRollupFilter(filters.FilterSet):
+    start = filters.DateFilter(field_name="day", lookup_expr='gte')
+    end = filters.DateFilter(field_name="day", lookup_expr='lte')
+    status = filters.ChoiceFilter(choices=Order.STATUS)
+
+    class Meta:
+        model = DailySalesRollup
+        fields = ['status', 'start', 'end']
@@ -0,0 +1,186 @@
+"""
+Admission control in front of the stock tables.
+
+Every product has a token count (normally equal to its available stock)
+held in Redis. A reservation first takes `quantity` tokens with an atomic
+Lua script; when there are not enough tokens the request is rejected
+without touching the database. Tokens are given back on expiry and
+cancellation, and reconcile_tokens() periodically resets them from the
+Product rows to correct any drift.
+
+The database stays the source of truth: a product without a token count,
+or an unreachable Redis, simply admits the request.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "stock:tokens:"
+
+# seconds Redis is skipped (requests admitted) after a connection error
+REDIS_BACKOFF = 5.0
+
+# Returns the remaining tokens, -1 when the request is rejected and -2
+# when the product has no token count yet.
+TAKE_TOKENS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -2
+end
+local left = redis.call('DECRBY', KEYS[1], ARGV[1])
+if left < 0 then
+    redis.call('INCRBY', KEYS[1], ARGV[1])
+    return -1
+end
+return left
+"""
+
+REFUND_TOKENS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return -2
+"""
+
+
+class StoreUnavailable(Exception):
+    """Raised while the store backs off after a connection error."""
+
+
+class RedisTokenStore:
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._take = self.client.register_script(TAKE_TOKENS_SCRIPT)
+        self._refund = self.client.register_script(REFUND_TOKENS_SCRIPT)
+        self._down_until = 0.0
+
+    def _call(self, script, product_id, quantity):
+        # during an outage only one request per REDIS_BACKOFF pays the socket timeout
+        if time.monotonic() < self._down_until:
+            raise StoreUnavailable()
+        try:
+            return script(keys=[KEY_PREFIX + str(product_id)], args=[quantity])
+        except Exception:
+            self._down_until = time.monotonic() + REDIS_BACKOFF
+            raise
+
+    def take(self, product_id, quantity):
+        return self._call(self._take, product_id, quantity)
+
+    def refund(self, product_id, quantity):
+        self._call(self._refund, product_id, quantity)
+
+    def set(self, counts):
+        pipe = self.client.pipeline(transaction=False)
+        for product_id, count in counts.items():
+            pipe.set(KEY_PREFIX + str(product_id), count)
+        pipe.execute()
+
+    def get(self, product_id):
+        value = self.client.get(KEY_PREFIX + str(product_id))
+        return None if value is None else int(value)
+
+
+class LocalTokenStore:
+    """In-process store with the same semantics, for tests and single-process runs."""
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def take(self, product_id, quantity):
+        with self._lock:
+            if product_id not in self._tokens:
+                return -2
+            if self._tokens[product_id] < quantity:
+                return -1
+            self._tokens[product_id] -= quantity
+            return self._tokens[product_id]
+
+    def refund(self, product_id, quantity):
+        with self._lock:
+            if product_id in self._tokens:
+                self._tokens[product_id] += quantity
+
+    def set(self, counts):
+        with self._lock:
+            self._tokens.update(counts)
+
+    def get(self, product_id):
+        return self._tokens.get(product_id)
+
+
+_store = None
+
+
+def _config():
+    return getattr(settings, "STOCK_ADMISSION", {})
+
+
+def is_enabled():
+    return _config().get("ENABLED", False)
+
+
+def get_store():
+    global _store
+    if _store is None:
+        config = _config()
+        if config.get("BACKEND", "redis") == "local":
+            _store = LocalTokenStore()
+        else:
+            _store = RedisTokenStore(config.get("URL", settings.CELERY_BROKER_URL))
+    return _store
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting == "STOCK_ADMISSION":
+        _store = None
+
+
+def admit(product_id, quantity):
+    """Take `quantity` tokens, False means the request must be rejected."""
+    if not is_enabled():
+        return True
+    try:
+        return get_store().take(product_id, quantity) != -1
+    except StoreUnavailable:
+        return True
+    except Exception as e:
+        logger.warning("Stock admission unavailable, admitting request: %s", e)
+        return True
+
+
+def refund(product_id, quantity):
+    if not is_enabled():
+        return
+    try:
+        get_store().refund(product_id, quantity)
+    except StoreUnavailable:
+        return
+    except Exception as e:
+        logger.warning("Stock admission refund lost, reconciliation will fix it: %s", e)
+
+
+def reconcile_tokens():
+    """Reset every product's token count to its available stock."""
+    from django.db.models import Sum
+    from base.models import Product, StockBucket
+
+    counts = dict(Product.objects.filter(sharded=False).values_list("id", "available_stock"))
+    counts.update(
+        StockBucket.objects.values("product_id")
+        .annotate(available=Sum("available_stock"))
+        .values_list("product_id", "available")
+    )
+    get_store().set(counts)
+
+    return len(counts)
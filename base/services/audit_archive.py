@@ -0,0 +1,229 @@
+"""
+Retention and cold storage for AuditLog.
+
+On Postgres base_auditlog is range-partitioned by month (migration 0015):
+ensure_partitions() keeps the next months created ahead of time, and
+archive_old_months() exports every month older than the retention period
+to a gzip'd NDJSON segment, then detaches and drops its partition (or
+deletes its rows from the default partition, where months whose
+partition came too late end up). On SQLite (tests) the same calls work
+on the plain table with a ranged DELETE.
+
+Segments are named auditlog-YYYY-MM.ndjson.gz and hold one AuditLog row
+per line; iter_segment() streams them back.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from base.models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+TABLE = AuditLog._meta.db_table
+FIELDS = ["id", "actor", "action", "object_type", "object_id", "old_value", "new_value", "timestamp"]
+
+
+def get_config():
+    config = {"MONTHS": 12, "MONTHS_AHEAD": 3, "ARCHIVE_DIR": Path(settings.BASE_DIR) / "archive" / "auditlog"}
+    config.update(getattr(settings, "AUDIT_LOG_RETENTION", {}))
+    return config
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _shift_months(year, month, delta):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def month_bounds(year, month):
+    next_year, next_month = _next_month(year, month)
+    return (
+        datetime(year, month, 1, tzinfo=dt_timezone.utc),
+        datetime(next_year, next_month, 1, tzinfo=dt_timezone.utc),
+    )
+
+
+def partition_name(year, month):
+    return f"{TABLE}_p{year:04d}_{month:02d}"
+
+
+def segment_path(year, month, directory=None):
+    return Path(directory or get_config()["ARCHIVE_DIR"]) / f"auditlog-{year:04d}-{month:02d}.ndjson.gz"
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def ensure_partitions(months_ahead=None):
+    """Create the monthly partitions from the current month up to `months_ahead`."""
+    if not is_partitioned():
+        return []
+
+    months_ahead = get_config()["MONTHS_AHEAD"] if months_ahead is None else months_ahead
+    now = timezone.now()
+    created = []
+
+    with connection.cursor() as cursor:
+        for delta in range(months_ahead + 1):
+            year, month = _shift_months(now.year, now.month, delta)
+            start, end = month_bounds(year, month)
+            name = partition_name(year, month)
+            try:
+                with transaction.atomic():
+                    cursor.execute(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    )
+                created.append(name)
+            except Exception as e:
+                # rows for that month already landed in the default partition
+                logger.error("Could not create audit partition %s: %s", name, e)
+
+    return created
+
+
+def default_partition():
+    """Name of the DEFAULT partition (rows of months without their own partition), or None."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT NULLIF(partdefid, 0)::regclass::text FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def months_before(cutoff_year, cutoff_month):
+    """(year, month) pairs strictly older than the cutoff month that hold audit rows."""
+    cutoff, _ = month_bounds(cutoff_year, cutoff_month)
+
+    if is_partitioned():
+        months = set()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = %s::regclass",
+                [TABLE],
+            )
+            for (name,) in cursor.fetchall():
+                suffix = name[len(TABLE) + 2:]
+                if not name.startswith(f"{TABLE}_p") or len(suffix) != 7:
+                    continue
+                year, month = int(suffix[:4]), int(suffix[5:])
+                if (year, month) < (cutoff_year, cutoff_month):
+                    months.add((year, month))
+
+            # rows written before ensure_partitions() created their month live in
+            # the default partition and have to expire as well
+            default = default_partition()
+            if default:
+                cursor.execute(
+                    f"SELECT DISTINCT date_trunc('month', timestamp AT TIME ZONE 'UTC') FROM {default} WHERE timestamp < %s",
+                    [cutoff],
+                )
+                months.update((month.year, month.month) for (month,) in cursor.fetchall())
+        return sorted(months)
+
+    dates = AuditLog.objects.filter(timestamp__lt=cutoff).datetimes("timestamp", "month", tzinfo=dt_timezone.utc)
+    return sorted({(d.year, d.month) for d in dates})
+
+
+def export_month(year, month, directory=None, chunk_size=5000):
+    """Write one month of audit rows to its segment file, returns (path, rows)."""
+    start, end = month_bounds(year, month)
+    path = segment_path(year, month, directory)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+
+    rows = (
+        AuditLog.objects
+        .filter(timestamp__gte=start, timestamp__lt=end)
+        .order_by("timestamp", "id")
+        .values(*FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+    count = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as segment:
+        for row in rows:
+            segment.write(json.dumps(row, cls=DjangoJSONEncoder))
+            segment.write("\n")
+            count += 1
+    os.replace(tmp_path, path)
+
+    return path, count
+
+
+def drop_month(year, month):
+    """
+    Detach and drop a month's partition; a ranged DELETE when the table is
+    not partitioned or the month's rows sit in the default partition.
+    """
+    if is_partitioned():
+        name = partition_name(year, month)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+                cursor.execute(f"DROP TABLE {name}")
+                return
+
+    start, end = month_bounds(year, month)
+    AuditLog.objects.filter(timestamp__gte=start, timestamp__lt=end).delete()
+
+
+def archive_old_months(retention_months=None, directory=None, dry_run=False):
+    """
+    Export and drop every month older than `retention_months`.
+
+    Returns [(year, month, path, rows)]. A month is only dropped after its
+    segment file has been written completely.
+    """
+    retention_months = get_config()["MONTHS"] if retention_months is None else retention_months
+    now = timezone.now()
+    cutoff = _shift_months(now.year, now.month, -retention_months)
+
+    archived = []
+    for year, month in months_before(*cutoff):
+        if dry_run:
+            archived.append((year, month, segment_path(year, month, directory), None))
+            continue
+        path, count = export_month(year, month, directory)
+        drop_month(year, month)
+        archived.append((year, month, path, count))
+
+    return archived
+
+
+def list_segments(directory=None):
+    directory = Path(directory or get_config()["ARCHIVE_DIR"])
+    if not directory.exists():
+        return []
+    return sorted(path.name[len("auditlog-"):-len(".ndjson.gz")] for path in directory.glob("auditlog-*.ndjson.gz"))
+
+
+def iter_segment(year, month, directory=None):
+    """Yield the archived rows of one month as dicts."""
+    with gzip.open(segment_path(year, month, directory), "rt", encoding="utf-8") as segment:
+        for line in segment:
+            yield json.loads(line)
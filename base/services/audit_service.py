@@ -0,0 +1,175 @@
+"""
+Buffered audit-log writer.
+
+audit_log() used to INSERT one AuditLog row inside the caller's
+transaction, often while stock rows were locked. In "buffered" mode the
+entries are handed to this buffer only once the caller's transaction
+commits (nothing is logged for rolled-back work) and a daemon thread
+writes them with bulk_create, at most BATCH_SIZE rows per INSERT and at
+least every FLUSH_INTERVAL seconds.
+
+The queue is bounded by MAX_QUEUE; entries beyond that are dropped and
+counted. stats() exposes the counters.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+
+from base.services import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MODE": "sync",
+    "BATCH_SIZE": 500,
+    "FLUSH_INTERVAL": 1.0,
+    "MAX_QUEUE": 50000,
+}
+
+
+metrics.counter(
+    "audit_log_buffer_entries_total", "Audit entries through the buffer: enqueued, flushed, dropped (queue full), failed (write error).",
+    ("outcome",),
+)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "AUDIT_LOG", {})}
+
+
+def is_buffered():
+    return get_config()["MODE"] == "buffered"
+
+
+class AuditBuffer:
+    def __init__(self, batch_size, flush_interval, max_queue):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put_many(self, entries):
+        with self._lock:
+            room = self.max_queue - len(self._queue)
+            accepted = entries[:max(room, 0)]
+            self._queue.extend(accepted)
+            self.enqueued += len(accepted)
+            dropped = len(entries) - len(accepted)
+            self.dropped += dropped
+            full = len(self._queue) >= self.batch_size
+
+        metrics.inc("audit_log_buffer_entries_total", "enqueued", amount=len(accepted))
+        if dropped:
+            metrics.inc("audit_log_buffer_entries_total", "dropped", amount=dropped)
+            logger.warning("Audit buffer full, dropped %d entries", dropped)
+        if full:
+            self._wakeup.set()
+        self._ensure_flusher()
+
+    def flush(self):
+        """Write everything queued so far, one bulk_create per batch."""
+        from base.models import AuditLog
+
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return
+                try:
+                    AuditLog.objects.bulk_create(batch)
+                    self.flushed += len(batch)
+                    metrics.inc("audit_log_buffer_entries_total", "flushed", amount=len(batch))
+                except Exception as e:
+                    self.failed += len(batch)
+                    metrics.inc("audit_log_buffer_entries_total", "failed", amount=len(batch))
+                    logger.error("Failed to write %d audit entries: %s", len(batch), e)
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._queue),
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def _ensure_flusher(self):
+        # a forked worker (celery prefork) inherits the object but not the thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                config = get_config()
+                _buffer = AuditBuffer(config["BATCH_SIZE"], config["FLUSH_INTERVAL"], config["MAX_QUEUE"])
+    return _buffer
+
+
+@receiver(setting_changed)
+def _reset_buffer(setting, **kwargs):
+    global _buffer
+    if setting == "AUDIT_LOG":
+        _buffer = None
+
+
+def enqueue(entries):
+    """Queue unsaved AuditLog instances, once the current transaction commits."""
+    buffer = get_buffer()
+    transaction.on_commit(lambda: buffer.put_many(entries))
+
+
+def stats():
+    return get_buffer().stats()
+
+
+def _queue_depth():
+    return {(): _buffer.stats()["queue_depth"]} if _buffer is not None else {}
+
+
+metrics.gauge("audit_log_buffer_queue_depth", "Audit entries waiting in this process' buffer.", collect=_queue_depth)
+
+
+@atexit.register
+def _flush_at_exit():
+    if _buffer is not None:
+        _buffer.flush()
@@ -0,0 +1,361 @@
+"""
+Versioned cache for the product catalog (GET /api/create-products/).
+
+The catalog is cached in two parts with their own lifetimes:
+- "static": the serialized product rows (name, price, ...), rebuilt when
+  a product is created, deleted or saved with non-stock fields
+- "stock": total/available/reserved per product (bucket sums for sharded
+  products), rebuilt after every stock write
+
+Each part is stored under a key that contains its version number. Writes
+bump the version once their transaction commits, so readers switch to a
+fresh key and stale entries simply age out. Entries live in an in-process
+LRU (first tier) and in Redis (second tier, shared by all workers); the
+versions themselves live in Redis so every process sees a bump at once.
+With BACKEND "local" everything stays in the process.
+
+Redis failures never fail a request: the cache is bypassed for a few
+seconds and the catalog is read from the database.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Sum
+from django.dispatch import receiver
+
+from base.services import metrics
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "catalog:"
+PARTS = ("static", "stock")
+
+metrics.counter(
+    "catalog_cache_lookups_total", "Catalog cache lookups: local_hit, shared_hit, miss, or bypass (Redis unavailable).",
+    ("result",),
+)
+metrics.counter("catalog_cache_evictions_total", "Entries evicted from the in-process catalog LRU.")
+STOCK_FIELDS = ("total_stock", "available_stock", "reserved_stock", "sold_stock")
+
+DEFAULTS = {
+    "ENABLED": True,
+    "BACKEND": "redis",
+    "URL": "redis://redis:6379/3",
+    "STATIC_TTL": 300,
+    "STOCK_TTL": 5,
+    "LOCAL_MAX_ENTRIES": 64,
+    "WARM_ON_START": True,
+}
+
+# seconds the Redis tier is skipped after a connection error
+REDIS_BACKOFF = 5.0
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CATALOG_CACHE", {})}
+
+
+def is_enabled():
+    return get_config()["ENABLED"]
+
+
+class LocalLRU:
+    """Bounded in-process LRU whose entries expire after their own TTL."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                metrics.inc("catalog_cache_evictions_total")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalVersions:
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        return tuple(self._versions.get(part, 0) for part in PARTS)
+
+    def bump(self, parts):
+        with self._lock:
+            for part in parts:
+                self._versions[part] = self._versions.get(part, 0) + 1
+
+
+class RedisTier:
+    """Shared second tier; also holds the version counters."""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._down_until = 0.0
+
+    def _available(self):
+        return time.monotonic() >= self._down_until
+
+    def _failed(self, e):
+        self._down_until = time.monotonic() + REDIS_BACKOFF
+        logger.warning("Catalog cache Redis unavailable: %s", e)
+
+    def get_versions(self):
+        if not self._available():
+            return None
+        try:
+            values = self.client.mget([KEY_PREFIX + "version:" + part for part in PARTS])
+        except Exception as e:
+            self._failed(e)
+            return None
+        return tuple(int(value or 0) for value in values)
+
+    def bump(self, parts):
+        if not self._available():
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for part in parts:
+                pipe.incr(KEY_PREFIX + "version:" + part)
+            pipe.execute()
+        except Exception as e:
+            self._failed(e)
+
+    def get(self, key):
+        if not self._available():
+            return None
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            self._failed(e)
+            return None
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl):
+        if not self._available():
+            return
+        try:
+            self.client.set(key, json.dumps(value), ex=max(int(ttl), 1))
+        except Exception as e:
+            self._failed(e)
+
+
+class CatalogCache:
+    def __init__(self, config):
+        self.static_ttl = config["STATIC_TTL"]
+        self.stock_ttl = config["STOCK_TTL"]
+        self.local = LocalLRU(config["LOCAL_MAX_ENTRIES"])
+        if config["BACKEND"] == "local":
+            self.shared = None
+            self.versions = LocalVersions()
+        else:
+            self.shared = RedisTier(config["URL"])
+            self.versions = self.shared
+
+        self.hits = {"local": 0, "shared": 0}
+        self.misses = 0
+        self.bypassed = 0
+        self.bumps = {part: 0 for part in PARTS}
+
+    def get_versions(self):
+        """(static, stock) version numbers, None when Redis is unavailable."""
+        return self.versions.get_versions() if self.shared else self.versions.get()
+
+    def get_catalog(self, versions=None):
+        """The serialized product list, as ProductSerializer(many=True) renders it."""
+        versions = versions or self.get_versions()
+        if versions is None:
+            self.bypassed += 1
+            metrics.inc("catalog_cache_lookups_total", "bypass")
+            return self._merge(load_static(), load_stock())
+
+        static_version, stock_version = versions
+        rows = self._get(f"{KEY_PREFIX}static:{static_version}", load_static, self.static_ttl)
+        stock = self._get(f"{KEY_PREFIX}stock:{stock_version}", load_stock, self.stock_ttl)
+        return self._merge(rows, stock)
+
+    def _get(self, key, loader, ttl):
+        value = self.local.get(key)
+        if value is not None:
+            self.hits["local"] += 1
+            metrics.inc("catalog_cache_lookups_total", "local_hit")
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.hits["shared"] += 1
+                metrics.inc("catalog_cache_lookups_total", "shared_hit")
+                self.local.set(key, value, ttl)
+                return value
+
+        self.misses += 1
+        metrics.inc("catalog_cache_lookups_total", "miss")
+        value = loader()
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+        return value
+
+    @staticmethod
+    def _merge(rows, stock):
+        catalog = []
+        for row in rows:
+            row = dict(row)
+            levels = stock.get(str(row["id"]))
+            if levels is not None:
+                row.update(zip(STOCK_FIELDS, levels))
+            catalog.append(row)
+        return catalog
+
+    def bump(self, parts):
+        for part in parts:
+            self.bumps[part] += 1
+        self.versions.bump(parts)
+
+    def stats(self):
+        return {
+            "local_hits": self.hits["local"],
+            "shared_hits": self.hits["shared"],
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.local.evictions,
+            "local_entries": len(self.local),
+            "static_bumps": self.bumps["static"],
+            "stock_bumps": self.bumps["stock"],
+        }
+
+
+def load_static():
+    from base.models import Product
+    from base.serializers import ProductSerializer
+
+    products = Product.objects.prefetch_related("buckets").order_by("id")
+    return [dict(row) for row in ProductSerializer(products, many=True).data]
+
+
+def load_stock():
+    """{str(product id): [total, available, reserved, sold]}, live bucket sums for sharded products."""
+    from base.models import Product, StockBucket
+
+    stock = {
+        str(product_id): [total, available, reserved, sold]
+        for product_id, total, available, reserved, sold in Product.objects.values_list("id", *STOCK_FIELDS)
+    }
+
+    buckets = (
+        StockBucket.objects.filter(product__sharded=True)
+        .values("product_id")
+        .annotate(available=Sum("available_stock"), reserved=Sum("reserved_stock"))
+    )
+    for row in buckets:
+        levels = stock.get(str(row["product_id"]))
+        if levels is not None:
+            levels[1], levels[2] = row["available"], row["reserved"]
+
+    return stock
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CatalogCache(get_config())
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_cache(setting, **kwargs):
+    global _cache
+    if setting == "CATALOG_CACHE":
+        _cache = None
+
+
+def get_versions():
+    if not is_enabled():
+        return None
+    return get_cache().get_versions()
+
+
+def get_catalog(versions=None):
+    if not is_enabled():
+        return CatalogCache._merge(load_static(), load_stock())
+    return get_cache().get_catalog(versions)
+
+
+def _bump_on_commit(parts):
+    if not is_enabled():
+        return
+    cache = get_cache()
+    # after commit, so no reader can cache pre-commit rows under the new version
+    transaction.on_commit(lambda: cache.bump(parts))
+
+
+def catalog_changed():
+    """Product rows were created, deleted or edited: refresh both parts."""
+    _bump_on_commit(PARTS)
+
+
+def stock_changed():
+    """Stock counters (Product or StockBucket) were written."""
+    _bump_on_commit(("stock",))
+
+
+def warm():
+    """Load the current catalog into both tiers (process start)."""
+    if not is_enabled():
+        return
+    try:
+        get_cache().get_catalog()
+    except Exception as e:
+        logger.warning("Catalog cache warm-up failed: %s", e)
+
+
+def warm_on_start():
+    if get_config()["WARM_ON_START"]:
+        warm()
+
+
+def stats():
+    return get_cache().stats()
+
+
+def _local_entries():
+    return {(): len(_cache.local)} if _cache is not None else {}
+
+
+metrics.gauge("catalog_cache_local_entries", "Entries in this process' catalog LRU.", collect=_local_entries)
@@ -0,0 +1,56 @@
+"""
+Streaming order export.
+
+Rows are read with .values_list(...).iterator(chunk_size=...) so Postgres
+serves them from a server-side cursor and only one chunk is in memory at a
+time; each row is encoded as soon as it is fetched. Memory use is flat
+whatever the size of the export.
+"""
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from base.models import OrderItem
+
+ORDER_COLUMNS = ["id", "status", "created_at", "user", "total_price"]
+ORDER_FIELDS = ["id", "status", "created_at", "user_id", "total_price"]
+
+ITEM_COLUMNS = ["order", "product", "product_name", "quantity", "unit_price", "order_status", "order_created_at"]
+ITEM_FIELDS = ["order_id", "product_id", "product__name", "quantity", "unit_price", "order__status", "order__created_at"]
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_rows(orders, kind="orders", chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield (columns, row tuples) for a filtered Order queryset."""
+    if kind == "items":
+        rows = (
+            OrderItem.objects
+            .filter(order__in=orders.values("id"))
+            .order_by("order_id", "id")
+            .values_list(*ITEM_FIELDS)
+        )
+        return ITEM_COLUMNS, rows.iterator(chunk_size=chunk_size)
+
+    rows = orders.order_by("id").values_list(*ORDER_FIELDS)
+    return ORDER_COLUMNS, rows.iterator(chunk_size=chunk_size)
+
+
+def iter_ndjson(columns, rows):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + "\n"
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(
+            [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+        )
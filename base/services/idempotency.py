@@ -0,0 +1,159 @@
+"""
+Idempotency keys for retried POSTs.
+
+The first request carrying a given `Idempotency-Key` claims the key by
+inserting an in-progress IdempotencyKey row (committed straight away, so
+concurrent duplicates see it) and stores its response when done.
+
+Guarantees:
+- a key runs the view at most once while its row lives (TTL seconds);
+  later requests get the stored status, body and request id back
+- duplicates arriving while the first request runs poll the row for up to
+  WAIT_TIMEOUT seconds, then get a 409 (retry later)
+- 5xx responses are not stored: the row is removed and the next retry
+  runs the request again
+- an in-progress row older than LOCK_TIMEOUT (crashed worker) is taken
+  over by the next duplicate
+- a key reused with another method, path or body is rejected (422)
+"""
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from base.models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+RUN = "run"
+REPLAY = "replay"
+MISMATCH = "mismatch"
+BUSY = "busy"
+
+
+def _config():
+    return getattr(settings, "IDEMPOTENCY", {})
+
+
+def is_enabled():
+    return _config().get("ENABLED", True)
+
+
+def applies_to(request):
+    return (
+        request.method == "POST"
+        and request.headers.get(HEADER)
+        and is_enabled()
+        and request.path in _config().get("PATHS", ())
+    )
+
+
+def fingerprint(request):
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(key, request_fingerprint, request_id):
+    """The new in-progress row, or the row already holding `key`."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                key=key,
+                fingerprint=request_fingerprint,
+                request_id=request_id,
+                expires_at=now + timedelta(seconds=_config().get("TTL", 86400)),
+            ), True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(key=key).first(), False
+
+
+def _take_over(record, request_id):
+    # conditional on the row being unchanged, so only one duplicate wins
+    now = timezone.now()
+    return IdempotencyKey.objects.filter(
+        pk=record.pk, response_status__isnull=True, created_at=record.created_at,
+    ).update(request_id=request_id, created_at=now) == 1
+
+
+def _wait(key, timeout):
+    deadline = time.monotonic() + timeout
+    interval = _config().get("POLL_INTERVAL", 0.05)
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        record = IdempotencyKey.objects.filter(key=key).first()
+        if record is None or record.response_status is not None:
+            return record
+    return IdempotencyKey.objects.filter(key=key).first()
+
+
+def begin(key, request_fingerprint, request_id):
+    """
+    (RUN, None): the caller owns the key, run the request and call finish()
+    (REPLAY, record): send the stored response
+    (MISMATCH, record) / (BUSY, record): reject the request
+    """
+    lock_timeout = timedelta(seconds=_config().get("LOCK_TIMEOUT", 60))
+    wait_timeout = _config().get("WAIT_TIMEOUT", 10)
+    waited = False
+
+    while True:
+        record, created = _claim(key, request_fingerprint, request_id)
+        if created:
+            return RUN, None
+        if record is None:
+            # released between the INSERT and the SELECT
+            continue
+
+        if record.expires_at <= timezone.now():
+            IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=timezone.now()).delete()
+            continue
+        if record.fingerprint != request_fingerprint:
+            return MISMATCH, record
+        if record.response_status is not None:
+            return REPLAY, record
+
+        if record.created_at <= timezone.now() - lock_timeout:
+            if _take_over(record, request_id):
+                return RUN, None
+            continue
+        if waited:
+            return BUSY, record
+
+        record = _wait(key, wait_timeout)
+        waited = True
+        if record is not None and record.response_status is not None:
+            return (REPLAY, record) if record.fingerprint == request_fingerprint else (MISMATCH, record)
+
+
+def finish(key, request_id, response):
+    """Store `response` for `key`, or give the key up on a server error."""
+    owned = IdempotencyKey.objects.filter(key=key, request_id=request_id, response_status__isnull=True)
+
+    if response is None or response.status_code >= 500 or response.streaming:
+        owned.delete()
+        return
+
+    owned.update(
+        response_status=response.status_code,
+        response_body=response.content,
+        content_type=response.get("Content-Type", ""),
+    )
+
+
+def purge_expired(batch_size=5000):
+    """Delete expired keys in batches, returns the number of rows deleted."""
+    deleted = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects
+            .filter(expires_at__lte=timezone.now())
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
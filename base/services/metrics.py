@@ -0,0 +1,278 @@
+"""
+In-process metrics registry with Prometheus text exposition.
+
+Metric families are declared once (counter() / histogram()) and updated
+with positional label values, e.g. observe("http_request_duration_seconds",
+0.012, "api/order-list/", "GET"). Updates are a dict lookup, a bisect and
+a few additions under one lock.
+
+MODE "local" exposes the current process only. MODE "multiprocess" (several
+gunicorn / uvicorn / celery processes) also writes every process's
+snapshot to MULTIPROC_DIR/<pid>.json, at most every FLUSH_INTERVAL seconds,
+and render() sums the snapshots of all processes, so any worker can answer
+/metrics. Snapshots of exited processes are kept (counters stay
+monotonic); clear the directory when the service is restarted.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+
+class Family:
+    def __init__(self, name, kind, documentation, labels, buckets=None, collect=None):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else None
+        # gauges: callable returning {label values: value}, read at scrape time
+        self.collect = collect
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        # (name, label values) -> value (counter) or [bucket counts..., sum, count]
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def declare(self, family):
+        self.families.setdefault(family.name, family)
+
+    def inc(self, name, amount, labels):
+        key = (name, labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def observe(self, name, value, labels):
+        with self.lock:
+            self._observe(name, value, labels)
+
+    def observe_many(self, values, labels):
+        with self.lock:
+            for name, value in values:
+                self._observe(name, value, labels)
+
+    def _observe(self, name, value, labels):
+        buckets = self.families[name].buckets
+        key = (name, labels)
+        sample = self.samples.get(key)
+        if sample is None:
+            sample = self.samples[key] = [0] * (len(buckets) + 3)
+        sample[bisect_left(buckets, value)] += 1
+        sample[-2] += value
+        sample[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [name, list(labels), list(sample) if isinstance(sample, list) else sample]
+                for (name, labels), sample in self.samples.items()
+            ]
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+
+_registry = Registry()
+_last_flush = 0.0
+# one snapshot write at a time per process
+_flush_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _config():
+    return getattr(settings, "TELEMETRY", {})
+
+
+def is_multiprocess():
+    return _config().get("MODE", "local") == "multiprocess"
+
+
+def get_registry():
+    return _registry
+
+
+def counter(name, documentation, labels=()):
+    _registry.declare(Family(name, "counter", documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=TIME_BUCKETS):
+    _registry.declare(Family(name, "histogram", documentation, labels, buckets))
+
+
+def gauge(name, documentation, labels=(), collect=None):
+    """A value computed when scraped (not stored, not summed across processes)."""
+    _registry.declare(Family(name, "gauge", documentation, labels, collect=collect))
+
+
+def read_gauge(name):
+    try:
+        return _registry.families[name].collect()
+    except Exception:
+        return {}
+
+
+def inc(name, *labels, amount=1):
+    _registry.inc(name, amount, labels)
+    _maybe_flush()
+
+
+def observe(name, value, *labels):
+    _registry.observe(name, value, labels)
+    _maybe_flush()
+
+
+def observe_many(values, *labels):
+    """observe() for several (name, value) pairs sharing the same labels."""
+    _registry.observe_many(values, labels)
+    _maybe_flush()
+
+
+def _maybe_flush():
+    if is_multiprocess() and time.monotonic() - _last_flush >= _config().get("FLUSH_INTERVAL", 5):
+        # called from request threads: skip when another thread is already writing
+        if _flush_lock.acquire(blocking=False):
+            try:
+                _flush()
+            finally:
+                _flush_lock.release()
+
+
+def _snapshot_path():
+    return os.path.join(str(_config()["MULTIPROC_DIR"]), f"{os.getpid()}.json")
+
+
+def flush():
+    """Write this process's snapshot to MULTIPROC_DIR (multiprocess mode)."""
+    with _flush_lock:
+        _flush()
+
+
+def _flush():
+    # errors are logged, never raised into the request / task that triggered the flush
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not is_multiprocess():
+        return
+
+    path = _snapshot_path()
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.getpid()}.", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(_registry.snapshot(), f)
+        os.replace(tmp, path)
+    except Exception as e:
+        logger.warning("Failed to write the metrics snapshot %s: %s", path, e)
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def collect():
+    """{(name, label values): sample}, summed over all processes in multiprocess mode."""
+    if not is_multiprocess():
+        return {(name, tuple(labels)): sample for name, labels, sample in _registry.snapshot()}
+
+    flush()
+    merged = {}
+    directory = str(_config()["MULTIPROC_DIR"])
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                samples = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, sample in samples:
+            key = (name, tuple(labels))
+            current = merged.get(key)
+            if current is None:
+                merged[key] = sample
+            elif isinstance(sample, list):
+                merged[key] = [a + b for a, b in zip(current, sample)]
+            else:
+                merged[key] = current + sample
+    return merged
+
+
+def quantile(name, sample, q):
+    """Estimate of the q-quantile of a histogram sample (linear within a bucket)."""
+    count = sample[-1]
+    if not count:
+        return None
+    buckets = _registry.families[name].buckets
+    rank = q * count
+    seen = 0
+    for i, bucket_count in enumerate(sample[:-2]):
+        if bucket_count and seen + bucket_count >= rank:
+            if i == len(buckets):
+                return buckets[-1]
+            lower = buckets[i - 1] if i else 0
+            return lower + (buckets[i] - lower) * (rank - seen) / bucket_count
+        seen += bucket_count
+    return buckets[-1]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (0.0.4)."""
+    samples = collect()
+    by_family = {}
+    for (name, labels), sample in sorted(samples.items()):
+        by_family.setdefault(name, []).append((labels, sample))
+
+    lines = []
+    for name, family in _registry.families.items():
+        lines.append(f"# HELP {name} {family.documentation}")
+        lines.append(f"# TYPE {name} {family.kind}")
+        if family.kind == "gauge":
+            for labels, value in sorted(read_gauge(name).items()):
+                lines.append(f"{name}{_labels(family.labels, labels)} {value}")
+            continue
+
+        for labels, sample in by_family.get(name, ()):
+            if family.kind == "counter":
+                lines.append(f"{name}{_labels(family.labels, labels)} {sample}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip((*family.buckets, "+Inf"), sample):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(family.labels, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(family.labels, labels)} {sample[-2]}")
+            lines.append(f"{name}_count{_labels(family.labels, labels)} {sample[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+@receiver(setting_changed)
+def _reset(setting, **kwargs):
+    if setting == "TELEMETRY":
+        _registry.clear()
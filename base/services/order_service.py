@@ -1,40 +1,255 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
 from django.db import transaction
 from django.utils import timezone
 
-from base.models import Order
-from base.services.stock_service import (
-    release_reserved_stock,
-    confirm_reserved_stock,
-)
+from base.models import Order, OrderItem, Product
+from base.services import rollup_service, stock_service
+from base.tasks import audit_log_bulk
+
+
+# The order state machine: status -> statuses it may move to. Shared by
+# change_order_status, bulk_change_order_status, OrderUpdateView and chaostest.py
+ORDER_TRANSITIONS = {
+    "PENDING": ("CONFIRMED", "CANCELLED"),
+    "CONFIRMED": ("PROCESSING", "CANCELLED"),
+    "PROCESSING": ("SHIPPED",),
+    "SHIPPED": ("DELIVERED",),
+    "DELIVERED": (),
+    "CANCELLED": (),
+}
+
+# precomputed inverse: status -> statuses allowed to move to it (the WHERE status IN of a bulk move)
+ALLOWED_SOURCES = {
+    status: tuple(old for old, targets in ORDER_TRANSITIONS.items() if status in targets)
+    for status in ORDER_TRANSITIONS
+}
+
+# stock movement of a transition, see stock_service.MOVEMENTS
+STOCK_MOVEMENTS = {
+    ("PENDING", "CONFIRMED"): "confirm",
+    ("PENDING", "CANCELLED"): "release",
+    ("CONFIRMED", "CANCELLED"): "restock",
+}
+
+
+def can_transition(old_status: str, new_status: str):
+    return new_status in ORDER_TRANSITIONS.get(old_status, ())
+
+
+class BulkOrderError(Exception):
+    """
+    Raised when a bulk order import is rejected.
+
+    `errors` holds one entry per failing order or item:
+    {"index": <order position>, "item": <item position or None>, "reason": <text>}
+    """
+
+    def __init__(self, errors):
+        super().__init__("Bulk order creation rejected")
+        self.errors = errors
 
 
 @transaction.atomic
 def change_order_status(order_id: int, new_status: str):
+    """
+    Move one order along ORDER_TRANSITIONS with its stock, rollups and audit.
+
+    Raises ValueError for a transition the table does not allow (a move to
+    the current status included) and when the stock movement cannot be
+    settled, e.g. confirming units that were never reserved.
+    """
 
     order = Order.objects.select_for_update().get(id=order_id)
     old_status = order.status
 
-    if old_status == new_status:
-        return order
+    if not can_transition(old_status, new_status):
+        raise ValueError(f"Invalid status transition {old_status} → {new_status}")
 
-    invalid_transitions = {
-        "CONFIRMED": ["CANCELLED", "EXPIRED"],
-        "CANCELLED": ["CONFIRMED"],
-        "EXPIRED": ["CONFIRMED"],
-    }
+    settlement = stock_service.Settlement()
+    _apply_transition([order.id], old_status, new_status, settlement)
+    settlement.apply()
 
-    if old_status in invalid_transitions and new_status in invalid_transitions[old_status]:
-        raise ValueError(f"Invalid status transition {old_status} → {new_status}")
+    order.refresh_from_db(fields=["status", "updated_at"])
+    order.reset_tracking()
+    return order
 
-    if new_status == "CONFIRMED":
-        confirm_reserved_stock(order)
 
-    elif new_status in ["CANCELLED", "EXPIRED"]:
-        release_reserved_stock(order)
+def bulk_change_order_status(new_status: str, order_ids=None, queryset=None, chunk_size: int = 1000):
+    """
+    Move many orders to `new_status`: the given `order_ids`, or every order
+    of `queryset` (e.g. OrderFilter(...).qs).
 
+    Returns {"changed": [ids], "rejected": [{"id", "status", "reason"}]}.
 
-    order.status = new_status
-    order.updated_at = timezone.now()
-    order.save()
+    Guarantees:
+    - orders are handled in id order, `chunk_size` per transaction; each
+      chunk is locked and moved with one
+      `UPDATE ... WHERE id IN (...) AND status IN (allowed sources)`
+    - orders in a status that may not move to `new_status` (and unknown
+      ids) are rejected, the others are still moved
+    - a chunk whose stock movement cannot be settled (e.g. confirming
+      units that are not reserved) is rejected as a whole
+    - stock, rollups and audit entries are written per chunk in bulk,
+      never per order, and no post_save signal is sent
+    """
 
-    return order
+    if new_status not in ALLOWED_SOURCES:
+        raise ValueError(f"Unknown status {new_status}")
+    sources = ALLOWED_SOURCES[new_status]
+
+    changed, rejected = [], []
+    for chunk in _id_chunks(order_ids, queryset, chunk_size):
+        chunk_changed, chunk_rejected = _bulk_change_chunk(chunk, new_status, sources)
+        changed.extend(chunk_changed)
+        rejected.extend(chunk_rejected)
+    return {"changed": changed, "rejected": rejected}
+
+
+def _id_chunks(order_ids, queryset, chunk_size):
+    if order_ids is not None:
+        order_ids = sorted(set(order_ids))
+        for start in range(0, len(order_ids), chunk_size):
+            yield order_ids[start:start + chunk_size]
+        return
+
+    # keyset walk over the filter, never one huge id list
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+@transaction.atomic
+def _bulk_change_chunk(order_ids, new_status, sources):
+    current = dict(Order.objects.select_for_update().filter(id__in=order_ids).order_by("id").values_list("id", "status"))
+
+    by_status = {}
+    rejected = []
+    for order_id in order_ids:
+        status = current.get(order_id)
+        if status is None:
+            rejected.append({"id": order_id, "status": None, "reason": "Order not found"})
+        elif status not in sources:
+            rejected.append({"id": order_id, "status": status, "reason": f"Invalid status transition {status} → {new_status}"})
+        else:
+            by_status.setdefault(status, []).append(order_id)
+
+    # one settlement for the whole chunk: all status groups share the product locks and UPDATEs;
+    # when it would leave a counter negative the chunk's moves roll back and are rejected
+    try:
+        with transaction.atomic():
+            settlement = stock_service.Settlement()
+            for old_status, ids in by_status.items():
+                _apply_transition(ids, old_status, new_status, settlement, sources)
+            settlement.apply()
+    except ValueError as e:
+        rejected.extend(
+            {"id": order_id, "status": old_status, "reason": str(e)}
+            for old_status, ids in by_status.items() for order_id in ids
+        )
+        rejected.sort(key=lambda row: row["id"])
+        return [], rejected
+
+    changed = sorted(order_id for ids in by_status.values() for order_id in ids)
+    return changed, rejected
+
+
+def _apply_transition(order_ids, old_status, new_status, settlement, sources=None):
+    """
+    Move `order_ids` (all currently in `old_status`, locked) with their
+    rollups and audit entries; the stock movement is added to `settlement`.
+    """
+    Order.objects.filter(id__in=order_ids, status__in=sources or (old_status,)).update(
+        status=new_status, updated_at=timezone.now(),
+    )
+
+    movement = STOCK_MOVEMENTS.get((old_status, new_status))
+    if movement:
+        settlement.add(order_ids, movement)
+
+    rollup_service.status_changed(order_ids, old_status, new_status)
+
+    audit_log_bulk([
+        {
+            "actor": "System",
+            "action": "Order Updated",
+            "obj_id": order_id,
+            "obj_type": "Order",
+            "old": {"status": old_status},
+            "new": {"status": new_status},
+        }
+        for order_id in order_ids
+    ])
+
+
+def create_orders_bulk(orders, chunk_size: int = 1000):
+    """
+    Create many orders with their items (all-or-nothing).
+
+    `orders` is a list of {"status": ..., "user": <id or None>,
+    "items": [{"product": <id>, "quantity": <int>}, ...]} dicts.
+
+    Guarantees:
+    - products and users are validated with one IN query each
+    - unit prices are snapshotted and Order.total_price computed in the
+      same pass, no per-item save()
+    - orders and items are written with bulk_create, `chunk_size` rows per
+      INSERT; rollups and audit entries are written in bulk as well
+    """
+
+    product_ids = {item["product"] for order in orders for item in order["items"]}
+    user_ids = {order["user"] for order in orders if order.get("user") is not None}
+
+    prices = dict(Product.objects.filter(id__in=product_ids).values_list("id", "price"))
+    users = set(User.objects.filter(id__in=user_ids).values_list("id", flat=True)) if user_ids else set()
+
+    errors = []
+    for index, order in enumerate(orders):
+        if order.get("user") is not None and order["user"] not in users:
+            errors.append({"index": index, "item": None, "reason": "User not found"})
+        for position, item in enumerate(order["items"]):
+            if item["product"] not in prices:
+                errors.append({"index": index, "item": position, "reason": "Product not found"})
+            elif item["quantity"] <= 0:
+                errors.append({"index": index, "item": position, "reason": "Quantity must be positive"})
+    if errors:
+        raise BulkOrderError(errors)
+
+    return _create_orders_bulk(orders, prices, chunk_size)
+
+
+@transaction.atomic
+def _create_orders_bulk(orders, prices, chunk_size):
+    instances = []
+    for order in orders:
+        total = sum((prices[item["product"]] * item["quantity"] for item in order["items"]), Decimal(0))
+        instances.append(Order(status=order.get("status", "PENDING"), user_id=order.get("user"), total_price=total))
+    Order.objects.bulk_create(instances, batch_size=chunk_size)
+
+    items = [
+        OrderItem(order_id=instance.id, product_id=item["product"], quantity=item["quantity"], unit_price=prices[item["product"]])
+        for instance, order in zip(instances, orders)
+        for item in order["items"]
+    ]
+    OrderItem.objects.bulk_create(items, batch_size=chunk_size)
+
+    rollup_service.orders_created(instances, items)
+
+    audit_log_bulk([
+        {
+            "actor": "System",
+            "action": "Order Created",
+            "obj_id": instance.id,
+            "obj_type": "Order",
+            "old": None,
+            "new": instance.tracked_values(),
+        }
+        for instance in instances
+    ])
+
+    return instances
@@ -1,34 +1,120 @@
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from datetime import timedelta
 
 from base.models import Product, Reservation
+from base.services import admission, catalog_cache, task_telemetry
+from base.services.shard_service import reserve_from_buckets, release_to_bucket
+from base.tasks import audit_log_bulk
+
+
+class BatchReservationError(Exception):
+    """
+    Raised when a batch reservation is rejected.
+
+    `errors` holds one entry per failing line:
+    {"index": <position in the request>, "product": <id>, "reason": <text>}
+    """
+
+    def __init__(self, errors):
+        super().__init__("Batch reservation rejected")
+        self.errors = errors
+
+
+# Engines reserve on the Product row of unsharded products and return True;
+# they return False for a sharded product, which is charged per bucket instead.
+
+def _reserve_locking(product_id: int, quantity: int):
+    # Row lock held while the new counters are computed in Python
+    product = Product.objects.select_for_update().filter(id=product_id, sharded=False).first()
+    if product is None:
+        return not _is_sharded(product_id)
+
+    if product.available_stock < quantity:
+        raise ValueError("Insufficient stock")
+
+    product.available_stock -= quantity
+    product.reserved_stock += quantity
+    product.save(update_fields=["available_stock", "reserved_stock"])
+    return True
+
+
+def _reserve_conditional(product_id: int, quantity: int):
+    # Single guarded UPDATE, the stock check happens inside the database
+    updated = Product.objects.filter(id=product_id, sharded=False, available_stock__gte=quantity).update(
+        available_stock=F("available_stock") - quantity,
+        reserved_stock=F("reserved_stock") + quantity,
+    )
+
+    if not updated:
+        if not _is_sharded(product_id):
+            raise ValueError("Insufficient stock")
+        return False
+
+    catalog_cache.stock_changed()
+    return True
+
+
+def _is_sharded(product_id: int):
+    # only looked up when the engine's row did not match
+    sharded = Product.objects.filter(id=product_id).values_list("sharded", flat=True).first()
+    if sharded is None:
+        raise Product.DoesNotExist("Product matching query does not exist.")
+    return sharded
+
+
+RESERVATION_ENGINES = {
+    "locking": _reserve_locking,
+    "conditional": _reserve_conditional,
+}
+
+
+def get_reservation_engine():
+    return RESERVATION_ENGINES[getattr(settings, "STOCK_RESERVATION_ENGINE", "locking")]
 
 
-@transaction.atomic
 def reserve_stock(product_id: int, quantity: int):
     """
     Reserve product stock safely under concurrency.
 
+    When settings.STOCK_ADMISSION is enabled the request first has to take
+    tokens from the admission counter, rejected requests never reach the
+    database. The stock update is done by the engine selected with
+    settings.STOCK_RESERVATION_ENGINE ("locking" or "conditional"),
+    sharded products are charged against one of their StockBuckets.
+
     Guarantees:
     - available_stock never goes negative
     - stock invariant is preserved
     - operation is atomic
     """
 
-    product = Product.objects.select_for_update().get(id=product_id)
-
     if quantity <= 0:
         raise ValueError("Quantity must be positive")
 
-    if product.available_stock < quantity:
+    if not admission.admit(product_id, quantity):
         raise ValueError("Insufficient stock")
 
-    product.available_stock -= quantity
-    product.reserved_stock += quantity
-    product.save()
+    try:
+        return _reserve_stock(product_id, quantity)
+    except Exception:
+        admission.refund(product_id, quantity)
+        raise
+
+
+@transaction.atomic
+def _reserve_stock(product_id: int, quantity: int):
+    bucket_id = None
+    if not get_reservation_engine()(product_id, quantity):
+        bucket_id = reserve_from_buckets(product_id, quantity)
+
     reservation = Reservation.objects.create(
-        product=product,
+        product_id=product_id,
+        bucket_id=bucket_id,
         quantity=quantity,
         expires_at=timezone.now() + timedelta(minutes=10),
         is_active=True,
@@ -36,3 +122,190 @@ def reserve_stock(product_id: int, quantity: int):
 
 
     return reservation
+
+
+def reserve_stock_batch(lines):
+    """
+    Reserve several products in one transaction (all-or-nothing).
+
+    `lines` is a list of {"product": <id>, "quantity": <int>} dicts.
+
+    Guarantees:
+    - every affected Product row is locked by a single query in primary
+      key order, so concurrent batches cannot deadlock on each other
+    - nothing is written unless every line can be satisfied
+    - all Reservation rows are written with one bulk_create
+    """
+
+    errors = []
+    requested = OrderedDict()
+
+    for index, line in enumerate(lines):
+        quantity = line["quantity"]
+        if quantity <= 0:
+            errors.append({"index": index, "product": line["product"], "reason": "Quantity must be positive"})
+            continue
+        requested[line["product"]] = requested.get(line["product"], 0) + quantity
+
+    # every product is checked, so only the refused ones are reported;
+    # the admitted tokens are refunded below when the batch fails
+    admitted, refused = {}, set()
+    for product_id, quantity in requested.items():
+        if admission.admit(product_id, quantity):
+            admitted[product_id] = quantity
+        else:
+            refused.add(product_id)
+
+    errors.extend(
+        {"index": index, "product": line["product"], "reason": "Insufficient stock"}
+        for index, line in enumerate(lines)
+        if line["product"] in refused
+    )
+
+    try:
+        if errors:
+            raise BatchReservationError(sorted(errors, key=lambda error: error["index"]))
+        return _reserve_stock_batch(lines, requested)
+    except Exception:
+        for product_id, quantity in admitted.items():
+            admission.refund(product_id, quantity)
+        raise
+
+
+@transaction.atomic
+def _reserve_stock_batch(lines, requested):
+    errors = []
+
+    products = {
+        product.id: product
+        for product in Product.objects.select_for_update().filter(id__in=requested).order_by("id")
+    }
+
+    for index, line in enumerate(lines):
+        product = products.get(line["product"])
+        if product is None:
+            errors.append({"index": index, "product": line["product"], "reason": "Product not found"})
+        elif line["quantity"] > 0 and not product.sharded and product.available_stock < requested[product.id]:
+            errors.append({"index": index, "product": product.id, "reason": "Insufficient stock"})
+
+    if errors:
+        raise BatchReservationError(sorted(errors, key=lambda error: error["index"]))
+
+    # Sharded products are charged per bucket, a failure here rolls back the whole batch
+    buckets = {}
+    for index, line in enumerate(lines):
+        if products[line["product"]].sharded:
+            try:
+                buckets[index] = reserve_from_buckets(line["product"], line["quantity"])
+            except ValueError as e:
+                errors.append({"index": index, "product": line["product"], "reason": str(e)})
+
+    if errors:
+        raise BatchReservationError(errors)
+
+    unsharded = [product_id for product_id in sorted(requested) if not products[product_id].sharded]
+    for product_id in unsharded:
+        product = products[product_id]
+        product.available_stock -= requested[product_id]
+        product.reserved_stock += requested[product_id]
+
+    Product.objects.bulk_update(
+        [products[product_id] for product_id in unsharded],
+        ["available_stock", "reserved_stock"],
+    )
+    if unsharded:
+        catalog_cache.stock_changed()
+
+    expires_at = timezone.now() + timedelta(minutes=10)
+    reservations = Reservation.objects.bulk_create([
+        Reservation(
+            product=products[line["product"]],
+            bucket_id=buckets.get(index),
+            quantity=line["quantity"],
+            expires_at=expires_at,
+            is_active=True,
+        )
+        for index, line in enumerate(lines)
+    ])
+
+    return reservations
+
+
+def sweep_expired_reservations(batch_size: int = 500):
+    """
+    Release every active reservation whose expires_at has passed.
+
+    Works in chunks of `batch_size` reservations, each chunk in its own
+    transaction:
+    - expired rows are found through the (is_active, expires_at) index
+      and locked with SKIP LOCKED so parallel sweepers never collide
+    - stock is returned with one UPDATE per product (or per bucket for
+      sharded products)
+    - reservations are deactivated and audited in bulk
+
+    Returns the number of reservations released.
+    """
+
+    released = 0
+    now = timezone.now()
+
+    while True:
+        count = _sweep_chunk(batch_size, now)
+        released += count
+        if count < batch_size:
+            return released
+
+
+@transaction.atomic
+def _sweep_chunk(batch_size: int, now):
+    rows = list(
+        Reservation.objects
+        .select_for_update(skip_locked=True)
+        .filter(is_active=True, expires_at__lte=now)
+        .order_by("expires_at")
+        .values_list("id", "product_id", "bucket_id", "quantity", "expires_at")[:batch_size]
+    )
+    if not rows:
+        return 0
+
+    per_product = defaultdict(int)
+    per_bucket = defaultdict(int)
+    for _, product_id, bucket_id, quantity, _ in rows:
+        per_product[product_id] += quantity
+        per_bucket[(product_id, bucket_id)] += quantity
+
+    sharded = set(Product.objects.filter(id__in=per_product, sharded=True).values_list("id", flat=True))
+
+    for product_id in sorted(per_product):
+        if product_id in sharded:
+            continue
+        Product.objects.filter(id=product_id).update(
+            available_stock=F("available_stock") + per_product[product_id],
+            reserved_stock=F("reserved_stock") - per_product[product_id],
+        )
+
+    for (product_id, bucket_id), quantity in per_bucket.items():
+        if product_id in sharded:
+            release_to_bucket(product_id, bucket_id, quantity)
+
+    Reservation.objects.filter(id__in=[row[0] for row in rows]).update(is_active=False, updated_at=timezone.now())
+    catalog_cache.stock_changed()
+
+    audit_log_bulk([
+        {
+            "actor": "System",
+            "action": "Reservation Expired",
+            "obj_id": reservation_id,
+            "obj_type": "Reservation",
+            "old": {"product": product_id, "quantity": quantity, "expires_at": expires_at.isoformat(), "is_active": True},
+            "new": {"product": product_id, "quantity": quantity, "expires_at": expires_at.isoformat(), "is_active": False},
+        }
+        for reservation_id, product_id, _, quantity, expires_at in rows
+    ])
+
+    transaction.on_commit(lambda: [
+        admission.refund(product_id, quantity) for product_id, quantity in per_product.items()
+    ])
+    task_telemetry.record_release_lag([row[4] for row in rows], "sweeper")
+
+    return len(rows)
@@ -0,0 +1,218 @@
+"""
+Incrementally maintained sales rollups.
+
+An order counts towards the rollup rows of its current status: revenue,
+order count and units per (day, status), per (product, status) and per
+(user, status). Creating an order, changing its items and changing its
+status apply small deltas with single-statement upserts, so the reporting endpoints
+read a handful of rows instead of aggregating Order x OrderItem.
+
+The deltas of one call are summed per rollup row and written once the
+caller's transaction has committed, in a short transaction of their own
+(rows in key order), so concurrent orders of the same day never wait on
+each other's daily row while they hold their order locks. A rolled back
+change writes nothing; a failed write is logged and the rows can be
+fixed with rebuild().
+
+rebuild() recomputes everything from the fact tables.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from functools import partial
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from base.models import DailySalesRollup, Order, OrderItem, ProductSalesRollup, UserSalesRollup
+
+
+class Deltas:
+    """Rollup deltas of one call, {(model, key items): [revenue, order_count, units]}."""
+
+    def __init__(self):
+        self.rows = defaultdict(lambda: [Decimal(0), 0, 0])
+
+    def add(self, model, keys, revenue=0, order_count=0, units=0):
+        totals = self.rows[(model, tuple(keys.items()))]
+        totals[0] += revenue
+        totals[1] += order_count
+        totals[2] += units
+
+    def add_order(self, day, status, user_id, revenue, order_count, units, sign=1):
+        self.add(DailySalesRollup, {"day": day, "status": status},
+                 sign * revenue, sign * order_count, sign * units)
+        if user_id is not None:
+            self.add(UserSalesRollup, {"user_id": user_id, "status": status},
+                     sign * revenue, sign * order_count, sign * units)
+
+    def write_on_commit(self):
+        rows = {key: totals for key, totals in self.rows.items() if any(totals)}
+        if rows:
+            transaction.on_commit(partial(_write, rows), robust=True)
+
+
+def _write(rows):
+    # same row order in every writer: concurrent flushes cannot deadlock
+    with transaction.atomic():
+        for (model, keys), totals in sorted(rows.items(), key=lambda row: (row[0][0]._meta.db_table, str(row[0][1]))):
+            _bump(model, dict(keys), *totals)
+
+
+def _bump(model, keys, revenue=0, order_count=0, units=0):
+    """Add the deltas to one rollup row, creating it if needed (single upsert)."""
+    if not (revenue or order_count or units):
+        return
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    key_columns = [model._meta.get_field(name).column for name in keys]
+    columns = ", ".join(connection.ops.quote_name(column) for column in key_columns + ["revenue", "order_count", "units"])
+    placeholders = ", ".join(["%s"] * (len(key_columns) + 3))
+    conflict = ", ".join(connection.ops.quote_name(column) for column in key_columns)
+    updates = ", ".join(
+        f"{column} = {table}.{column} + EXCLUDED.{column}"
+        for column in (connection.ops.quote_name(name) for name in ("revenue", "order_count", "units"))
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "
+            f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}",
+            [*keys.values(), revenue, order_count, units],
+        )
+
+
+def order_created(order):
+    deltas = Deltas()
+    deltas.add_order(timezone.localdate(order.created_at), order.status, order.user_id, 0, 1, 0)
+    deltas.write_on_commit()
+
+
+def item_changed(old_line, new_line):
+    """
+    Move one order line's contribution. Lines are the
+    (order_id, product_id, quantity, price) tuples of OrderItem._line(),
+    None when the item did not exist before / does not exist any more.
+    """
+    lines = [(line, sign) for line, sign in ((old_line, -1), (new_line, 1)) if line is not None]
+    orders = {
+        row["id"]: row
+        for row in Order.objects.filter(id__in={line[0] for line, _ in lines}).values("id", "created_at", "status", "user_id")
+    }
+
+    deltas = Deltas()
+    for (order_id, product_id, quantity, price), sign in lines:
+        order = orders.get(order_id)
+        if order is None:
+            continue
+        deltas.add_order(timezone.localdate(order["created_at"]), order["status"], order["user_id"], price, 0, quantity, sign)
+        deltas.add(ProductSalesRollup, {"product_id": product_id, "status": order["status"]},
+                   sign * price, sign, sign * quantity)
+    deltas.write_on_commit()
+
+
+def orders_created(orders, items):
+    """Count freshly bulk-created orders and their items, one upsert per rollup row."""
+    keys = {order.id: (timezone.localdate(order.created_at), order.status, order.user_id) for order in orders}
+    deltas = Deltas()
+
+    for order in orders:
+        deltas.add_order(*keys[order.id], order.total_price, 1, 0)
+
+    for item in items:
+        day, status, user_id = keys[item.order_id]
+        deltas.add_order(day, status, user_id, 0, 0, item.quantity)
+        deltas.add(ProductSalesRollup, {"product_id": item.product_id, "status": status},
+                   item.unit_price * item.quantity, 1, item.quantity)
+
+    deltas.write_on_commit()
+
+
+def status_changed(order_ids, old_status, new_status):
+    """Move whole orders (all with the same old status) to `new_status`."""
+    order_ids = list(order_ids)
+    if not order_ids or old_status == new_status:
+        return
+
+    orders = Order.objects.filter(id__in=order_ids).values_list("id", "created_at", "user_id", "total_price")
+    lines = list(
+        OrderItem.objects.filter(order__in=order_ids)
+        .values("order_id", "product_id")
+        .annotate(revenue=Sum(F("quantity") * F("unit_price")), lines=Count("id"), units=Sum("quantity"))
+    )
+
+    units_by_order = defaultdict(int)
+    per_product = defaultdict(lambda: [Decimal(0), 0, 0])
+    for row in lines:
+        units_by_order[row["order_id"]] += row["units"]
+        totals = per_product[row["product_id"]]
+        totals[0] += row["revenue"] or 0
+        totals[1] += row["lines"]
+        totals[2] += row["units"]
+
+    deltas = Deltas()
+    for order_id, created_at, user_id, total_price in orders:
+        day = timezone.localdate(created_at)
+        deltas.add_order(day, old_status, user_id, total_price, 1, units_by_order[order_id], -1)
+        deltas.add_order(day, new_status, user_id, total_price, 1, units_by_order[order_id])
+
+    for product_id, (revenue, count, units) in per_product.items():
+        deltas.add(ProductSalesRollup, {"product_id": product_id, "status": old_status}, -revenue, -count, -units)
+        deltas.add(ProductSalesRollup, {"product_id": product_id, "status": new_status}, revenue, count, units)
+
+    deltas.write_on_commit()
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute every rollup row from Order/OrderItem."""
+    DailySalesRollup.objects.all().delete()
+    ProductSalesRollup.objects.all().delete()
+    UserSalesRollup.objects.all().delete()
+
+    daily = defaultdict(lambda: [Decimal(0), 0, 0])
+    users = defaultdict(lambda: [Decimal(0), 0, 0])
+
+    orders = (
+        Order.objects.annotate(day=TruncDate("created_at"))
+        .values("day", "status", "user_id")
+        .annotate(revenue=Sum("total_price"), orders=Count("id"))
+    )
+    for row in orders:
+        daily[(row["day"], row["status"])][0] += row["revenue"] or 0
+        daily[(row["day"], row["status"])][1] += row["orders"]
+        if row["user_id"] is not None:
+            users[(row["user_id"], row["status"])][0] += row["revenue"] or 0
+            users[(row["user_id"], row["status"])][1] += row["orders"]
+
+    units = (
+        OrderItem.objects.annotate(day=TruncDate("order__created_at"))
+        .values("day", "order__status", "order__user_id")
+        .annotate(units=Sum("quantity"))
+    )
+    for row in units:
+        daily[(row["day"], row["order__status"])][2] += row["units"]
+        if row["order__user_id"] is not None:
+            users[(row["order__user_id"], row["order__status"])][2] += row["units"]
+
+    products = (
+        OrderItem.objects.values("product_id", "order__status")
+        .annotate(revenue=Sum(F("quantity") * F("unit_price")), lines=Count("id"), units=Sum("quantity"))
+    )
+
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(day=day, status=status, revenue=revenue, order_count=count, units=unit_count)
+        for (day, status), (revenue, count, unit_count) in daily.items()
+    ], batch_size=1000)
+    UserSalesRollup.objects.bulk_create([
+        UserSalesRollup(user_id=user_id, status=status, revenue=revenue, order_count=count, units=unit_count)
+        for (user_id, status), (revenue, count, unit_count) in users.items()
+    ], batch_size=1000)
+    ProductSalesRollup.objects.bulk_create([
+        ProductSalesRollup(
+            product_id=row["product_id"], status=row["order__status"],
+            revenue=row["revenue"] or 0, order_count=row["lines"], units=row["units"],
+        )
+        for row in products
+    ], batch_size=1000)
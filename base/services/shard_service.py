@@ -0,0 +1,172 @@
+import random
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from base.models import Product, StockBucket
+from base.services import catalog_cache
+
+
+def _split(amount: int, parts: int):
+    share, remainder = divmod(amount, parts)
+    return [share + (1 if i < remainder else 0) for i in range(parts)]
+
+
+@transaction.atomic
+def enable_sharding(product_id: int, buckets: int = 8):
+    """
+    Split a product's stock across `buckets` StockBucket rows.
+
+    Reservations made before sharding have no bucket, their reserved
+    units are parked in bucket 0 so releasing them keeps the totals right.
+    """
+
+    if buckets < 1:
+        raise ValueError("Bucket count must be positive")
+
+    product = Product.objects.select_for_update().get(id=product_id)
+
+    if product.sharded:
+        raise ValueError("Product is already sharded")
+
+    available = _split(product.available_stock, buckets)
+    StockBucket.objects.bulk_create([
+        StockBucket(
+            product=product,
+            index=i,
+            available_stock=available[i],
+            reserved_stock=product.reserved_stock if i == 0 else 0,
+        )
+        for i in range(buckets)
+    ])
+
+    product.sharded = True
+    product.save(update_fields=["sharded"])
+
+    return product
+
+
+def reserve_from_buckets(product_id: int, quantity: int):
+    """
+    Take `quantity` units from one bucket of a sharded product.
+
+    Buckets that still have enough stock are tried in random order with a
+    guarded UPDATE, so concurrent buyers spread over different rows. When
+    no bucket can cover `quantity` on its own, stock is gathered from the
+    other buckets first. Returns the id of the bucket that was charged.
+    """
+
+    return _take_from_buckets(product_id, quantity, reserved_stock=F("reserved_stock") + quantity)
+
+
+def sell_from_buckets(product_id: int, quantity: int):
+    """
+    Like reserve_from_buckets, but the units are sold right away: they
+    leave the bucket and are counted in the product's sold_stock.
+    """
+
+    with transaction.atomic():
+        bucket_id = _take_from_buckets(product_id, quantity)
+        Product.objects.filter(id=product_id).update(sold_stock=F("sold_stock") + quantity)
+    return bucket_id
+
+
+def _take_from_buckets(product_id, quantity, **changes):
+    candidates = list(
+        StockBucket.objects
+        .filter(product_id=product_id, available_stock__gte=quantity)
+        .values_list("id", flat=True)
+    )
+    random.shuffle(candidates)
+
+    for bucket_id in candidates:
+        updated = StockBucket.objects.filter(id=bucket_id, available_stock__gte=quantity).update(
+            available_stock=F("available_stock") - quantity,
+            **changes,
+        )
+        if updated:
+            catalog_cache.stock_changed()
+            return bucket_id
+
+    return _gather_and_take(product_id, quantity, **changes)
+
+
+@transaction.atomic
+def _gather_and_take(product_id, quantity, **changes):
+    """
+    Slow path of _take_from_buckets, for a quantity no single bucket can
+    cover: locks the product's buckets, moves stock from the others into
+    the fullest one, then charges that bucket so the units still come
+    back to a single bucket on release.
+    """
+
+    buckets = list(StockBucket.objects.select_for_update().filter(product_id=product_id).order_by("id"))
+    if sum(bucket.available_stock for bucket in buckets) < quantity:
+        raise ValueError("Insufficient stock")
+
+    target = max(buckets, key=lambda bucket: bucket.available_stock)
+    gathered = 0
+    for bucket in buckets:
+        missing = quantity - target.available_stock - gathered
+        if missing <= 0:
+            break
+        if bucket is target or bucket.available_stock <= 0:
+            continue
+        moved = min(bucket.available_stock, missing)
+        StockBucket.objects.filter(id=bucket.id).update(available_stock=F("available_stock") - moved)
+        gathered += moved
+
+    StockBucket.objects.filter(id=target.id).update(
+        available_stock=F("available_stock") + gathered - quantity,
+        **changes,
+    )
+    catalog_cache.stock_changed()
+    return target.id
+
+
+def release_to_bucket(product_id: int, bucket_id, quantity: int):
+    """Move `quantity` reserved units back to available in their bucket."""
+
+    buckets = StockBucket.objects.filter(product_id=product_id)
+    buckets = buckets.filter(id=bucket_id) if bucket_id else buckets.filter(index=0)
+    buckets.update(
+        available_stock=F("available_stock") + quantity,
+        reserved_stock=F("reserved_stock") - quantity,
+    )
+    catalog_cache.stock_changed()
+
+
+@transaction.atomic
+def rebalance_buckets(product_id: int):
+    """
+    Spread available stock evenly over the product's buckets and refresh
+    the aggregate counters on the Product row.
+
+    Reserved units stay where they are, they have to be released back to
+    the bucket they were taken from.
+    """
+
+    buckets = list(StockBucket.objects.select_for_update().filter(product_id=product_id).order_by("id"))
+    if not buckets:
+        return None
+
+    available = _split(sum(bucket.available_stock for bucket in buckets), len(buckets))
+    for bucket, share in zip(buckets, available):
+        bucket.available_stock = share
+    StockBucket.objects.bulk_update(buckets, ["available_stock"])
+
+    totals = {
+        "available_stock": sum(available),
+        "reserved_stock": sum(bucket.reserved_stock for bucket in buckets),
+    }
+    Product.objects.filter(id=product_id).update(**totals)
+    catalog_cache.stock_changed()
+
+    return totals
+
+
+def bucket_totals(product_id: int):
+    return StockBucket.objects.filter(product_id=product_id).aggregate(
+        available_stock=Sum("available_stock"),
+        reserved_stock=Sum("reserved_stock"),
+    )
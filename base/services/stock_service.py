@@ -1,14 +1,205 @@
+from collections import defaultdict
 
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
 
+from base.models import OrderItem, Product, Reservation, StockBucket
+from base.services import admission, catalog_cache
+from base.tasks import audit_log_bulk
+
+
+# counter deltas per unit for each stock movement of an order
+MOVEMENTS = {
+    # reserved units go back on sale (cancelled before confirmation)
+    "release": {"available_stock": 1, "reserved_stock": -1},
+    # reserved units are sold
+    "confirm": {"reserved_stock": -1, "sold_stock": 1},
+    # sold units come back on sale (cancelled after confirmation)
+    "restock": {"available_stock": 1, "sold_stock": -1},
+}
+
+# counters that live in the StockBucket rows of sharded products
+BUCKET_FIELDS = ("available_stock", "reserved_stock")
+
+
+class Settlement:
+    """
+    Stock movements of one or many orders, applied together by apply().
+
+    Orders are added with their movement (see MOVEMENTS), several
+    movements may be mixed: the quantities are netted per product, so a
+    bulk transition pays for one settlement whatever the number of orders.
+
+    Guarantees (apply, inside the caller's transaction):
+    - one aggregate query over the items of all added orders
+    - units leaving reserved_stock retire as many units of the product's
+      active reservations, so the sweeper cannot release them a second time
+    - reservations, then the touched products, are locked in primary key
+      order (the sweeper's lock order), so settlements never deadlock
+    - one guarded F() UPDATE per product (plus the buckets of sharded
+      products): a counter that would go negative raises ValueError and
+      the caller's transaction rolls back
+    - units put back on sale are refunded to the admission counter on commit
+    """
+
+    def __init__(self):
+        self.movements = defaultdict(list)
+
+    def add(self, order_ids, movement: str):
+        if movement not in MOVEMENTS:
+            raise ValueError(f"Unknown stock movement {movement}")
+        self.movements[movement].extend(order_ids)
+        return self
+
+    def deltas(self):
+        """{product id: {field: delta}} for everything added so far."""
+        movement_of = {order_id: movement for movement, ids in self.movements.items() for order_id in ids}
+        if not movement_of:
+            return {}
+
+        lines = (
+            OrderItem.objects.filter(order_id__in=movement_of)
+            .order_by()
+            .values("order_id", "product_id")
+            .annotate(units=Sum("quantity"))
+            .values_list("order_id", "product_id", "units")
+        )
+        deltas = defaultdict(lambda: defaultdict(int))
+        for order_id, product_id, units in lines:
+            for field, sign in MOVEMENTS[movement_of[order_id]].items():
+                deltas[product_id][field] += sign * units
+        return {product_id: {field: delta for field, delta in fields.items() if delta} for product_id, fields in deltas.items()}
+
+    def apply(self):
+        """Write the movements, returns the {product id: {field: delta}} applied."""
+        deltas = self.deltas()
+        if not deltas:
+            return {}
+
+        held = _consume_reservations({
+            product_id: -fields["reserved_stock"]
+            for product_id, fields in deltas.items() if fields.get("reserved_stock", 0) < 0
+        })
+
+        sharded = dict(
+            Product.objects.select_for_update().filter(id__in=deltas).order_by("id").values_list("id", "sharded")
+        )
+        for product_id in sorted(sharded):
+            fields = dict(deltas[product_id])
+            if sharded[product_id]:
+                bucket_fields = {field: fields.pop(field) for field in BUCKET_FIELDS if field in fields}
+                _settle_buckets(product_id, bucket_fields, held.get(product_id, {}))
+            if fields:
+                _guarded_update(Product.objects.filter(id=product_id), product_id, fields)
+        catalog_cache.stock_changed()
+
+        refunds = {
+            product_id: fields["available_stock"]
+            for product_id, fields in deltas.items() if fields.get("available_stock", 0) > 0
+        }
+        if refunds:
+            transaction.on_commit(lambda: [admission.refund(product_id, units) for product_id, units in refunds.items()])
+
+        self.movements.clear()
+        return deltas
+
+
+def _guarded_update(queryset, product_id, fields):
+    """Apply {field: delta} with F(), only if no counter goes negative."""
+    guards = {f"{field}__gte": -delta for field, delta in fields.items() if delta < 0}
+    changes = {field: F(field) + delta for field, delta in fields.items()}
+    if not queryset.filter(**guards).update(**changes):
+        raise ValueError(f"Insufficient stock for product {product_id}")
+
+
+def _settle_buckets(product_id, fields, held):
+    """
+    Bucket side of a sharded product: retired reservations give their units
+    back to the bucket they were taken from (`held`, {bucket id: units}),
+    everything else goes to bucket 0 like release_to_bucket does.
+    """
+    changes = defaultdict(lambda: defaultdict(int))
+    available, reserved = fields.get("available_stock", 0), fields.get("reserved_stock", 0)
+    if available:
+        changes[None]["available_stock"] += available
+    for bucket_id, units in held.items():
+        changes[bucket_id]["reserved_stock"] -= units
+        reserved += units
+    if reserved:
+        changes[None]["reserved_stock"] += reserved
+
+    buckets = StockBucket.objects.filter(product_id=product_id)
+    for bucket_id, bucket_fields in changes.items():
+        bucket_fields = {field: delta for field, delta in bucket_fields.items() if delta}
+        if bucket_fields:
+            queryset = buckets.filter(id=bucket_id) if bucket_id else buckets.filter(index=0)
+            _guarded_update(queryset, product_id, bucket_fields)
+
+
+def _consume_reservations(units):
+    """
+    Retire active reservations holding `units` ({product id: units}), the
+    earliest expiring first; the last one may only shrink.
+
+    Reservations are not tied to an order, so the units an order settles
+    are matched against any active reservation of the product.
+    Returns {product id: {bucket id: units}} of the retired units.
+    """
+    held = defaultdict(lambda: defaultdict(int))
+    touched, entries = [], []
+    now = timezone.now()
+
+    for product_id in sorted(units):
+        needed = units[product_id]
+        # every reservation holds at least one unit, `needed` rows are enough
+        reservations = (
+            Reservation.objects.select_for_update()
+            .filter(product_id=product_id, is_active=True)
+            .order_by("expires_at", "id")
+            .only("id", "product_id", "bucket_id", "quantity", "is_active")[:needed]
+        )
+        for reservation in reservations:
+            taken = min(reservation.quantity, needed)
+            needed -= taken
+            held[product_id][reservation.bucket_id] += taken
+
+            old = {"product": product_id, "quantity": reservation.quantity, "is_active": True}
+            if taken == reservation.quantity:
+                reservation.is_active = False
+            else:
+                reservation.quantity -= taken
+            reservation.updated_at = now
+            touched.append(reservation)
+            new = {"product": product_id, "quantity": reservation.quantity, "is_active": reservation.is_active}
+            entries.append({
+                "actor": "System",
+                "action": "Reservation Consumed",
+                "obj_id": reservation.id,
+                "obj_type": "Reservation",
+                "old": old,
+                "new": new,
+            })
+            if not needed:
+                break
+
+    if touched:
+        Reservation.objects.bulk_update(touched, ["is_active", "quantity", "updated_at"])
+        audit_log_bulk(entries)
+
+    return held
+
+
+def settle_orders(order_ids, movement: str):
+    """Apply one stock movement for all items of `order_ids`, see Settlement."""
+    return Settlement().add(order_ids, movement).apply()
+
+
+@transaction.atomic
 def confirm_reserved_stock(order):
-    for item in order.items.select_for_update():
-        product = item.product
-        product.reserved_stock -= item.quantity
-        product.sold_stock += item.quantity
-        product.save()
+    return settle_orders([order.id], "confirm")
+
+
+@transaction.atomic
 def release_reserved_stock(order):
-    for item in order.items.select_for_update():
-        product = item.product
-        product.reserved_stock -= item.quantity
-        product.available_stock += item.quantity
-        product.save()
+    return settle_orders([order.id], "release")
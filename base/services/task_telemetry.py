@@ -0,0 +1,167 @@
+"""
+Celery task telemetry, connected to the Celery signals by connect()
+(project/celery.py) and exported through the metrics registry, so the
+numbers show up on /metrics next to the web tier (MODE "multiprocess"
+with a MULTIPROC_DIR shared by web and worker).
+
+Per task name:
+- celery_task_queue_lag_seconds: publish time (or ETA, when later) to start
+- celery_task_runtime_seconds / celery_tasks_total: by final state
+- celery_task_retries_total
+- celery_task_lock_wait_seconds: time spent in SELECT ... FOR UPDATE
+  (the request timings of base.services.telemetry, opened per task)
+
+Plus reservation_release_lag_seconds (expires_at to the actual release,
+by update_reservation or the sweeper) and celery_queue_length, read from
+the broker at most every QUEUE_LENGTH_TTL seconds: scrapes in between
+(and scrapes while the broker is down) get the cached numbers.
+
+`python manage.py task_stats` prints a live summary of the same numbers.
+"""
+import threading
+import time
+from datetime import datetime
+
+from celery import signals
+from django.utils import timezone
+
+from base.services import metrics
+
+PUBLISHED_HEADER = "published_at"
+
+# celery_queue_length: seconds a broker reading is reused, broker connect timeout
+QUEUE_LENGTH_TTL = 15.0
+QUEUE_LENGTH_TIMEOUT = 1.0
+
+metrics.counter("celery_tasks_total", "Finished Celery tasks by final state.", ("task", "state"))
+metrics.counter("celery_task_retries_total", "Celery task retries.", ("task",))
+metrics.histogram(
+    "celery_task_queue_lag_seconds", "Time from publish (or ETA) to the start of the task.", ("task",),
+    buckets=metrics.LAG_BUCKETS,
+)
+metrics.histogram("celery_task_runtime_seconds", "Celery task runtime.", ("task", "state"))
+metrics.histogram("celery_task_lock_wait_seconds", "Time a task spent in SELECT ... FOR UPDATE.", ("task",))
+metrics.histogram(
+    "reservation_release_lag_seconds", "Time from a reservation's expires_at to its release.", ("source",),
+    buckets=metrics.LAG_BUCKETS,
+)
+
+# task id -> telemetry state of the running task
+_running = {}
+_running_lock = threading.Lock()
+
+
+# (monotonic time of the reading, {(queue,): length}), refreshed by one scrape at a time
+_queue_lengths = (None, {})
+_queue_lengths_lock = threading.Lock()
+
+
+def queue_lengths():
+    """{(queue,): messages waiting}, cached for QUEUE_LENGTH_TTL; {} when the broker is unreachable."""
+    global _queue_lengths
+
+    read_at, lengths = _queue_lengths
+    if read_at is not None and time.monotonic() - read_at < QUEUE_LENGTH_TTL:
+        return lengths
+    # another scrape is reading the broker: answer with the previous numbers
+    if not _queue_lengths_lock.acquire(blocking=False):
+        return lengths
+    try:
+        try:
+            lengths = _read_queue_lengths()
+        except Exception:
+            lengths = {}
+        _queue_lengths = (time.monotonic(), lengths)
+        return lengths
+    finally:
+        _queue_lengths_lock.release()
+
+
+def _read_queue_lengths():
+    from project.celery import app
+
+    queues = [queue.name for queue in app.conf.task_queues or ()] or [app.conf.task_default_queue]
+    lengths = {}
+    with app.connection_for_read(connect_timeout=QUEUE_LENGTH_TIMEOUT) as connection:
+        connection.ensure_connection(max_retries=1, timeout=QUEUE_LENGTH_TIMEOUT)
+        channel = connection.default_channel
+        for queue in queues:
+            lengths[(queue,)] = channel.queue_declare(queue=queue, passive=True).message_count
+    return lengths
+
+
+metrics.gauge("celery_queue_length", "Messages waiting in the broker queue.", ("queue",), collect=queue_lengths)
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def record_release_lag(expires_at_values, source):
+    """Observe now - expires_at for reservations released just now."""
+    now = timezone.now()
+    for expires_at in expires_at_values:
+        if expires_at is not None:
+            metrics.observe("reservation_release_lag_seconds", max((now - expires_at).total_seconds(), 0.0), source)
+
+
+def on_before_publish(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault(PUBLISHED_HEADER, time.time())
+
+
+def on_prerun(task_id=None, task=None, **kwargs):
+    from base.services import telemetry
+
+    if not telemetry.is_enabled():
+        return
+
+    request = task.request
+    # worker messages carry custom headers as request attributes, eager apply() in request.headers
+    published = getattr(request, PUBLISHED_HEADER, None) or (getattr(request, "headers", None) or {}).get(PUBLISHED_HEADER)
+    published = _timestamp(published)
+    eta = _timestamp(getattr(request, "eta", None))
+    intended = max(filter(None, (published, eta)), default=None)
+    if intended is not None:
+        metrics.observe("celery_task_queue_lag_seconds", max(time.time() - intended, 0.0), task.name)
+
+    with _running_lock:
+        _running[task_id] = telemetry.start()
+
+
+def on_postrun(task_id=None, task=None, state=None, **kwargs):
+    from base.services import telemetry
+
+    with _running_lock:
+        running = _running.pop(task_id, None)
+    if running is None:
+        return
+
+    timings, runtime = telemetry.stop(running)
+    state = state or "UNKNOWN"
+    metrics.inc("celery_tasks_total", task.name, state)
+    metrics.observe("celery_task_runtime_seconds", runtime, task.name, state)
+    metrics.observe("celery_task_lock_wait_seconds", timings.lock_wait, task.name)
+
+
+def on_retry(sender=None, request=None, **kwargs):
+    name = getattr(sender, "name", None) or getattr(request, "task", None) or "unknown"
+    metrics.inc("celery_task_retries_total", name)
+
+
+def on_process_shutdown(**kwargs):
+    metrics.flush()
+
+
+def connect():
+    signals.before_task_publish.connect(on_before_publish, weak=False, dispatch_uid="telemetry-publish")
+    signals.task_prerun.connect(on_prerun, weak=False, dispatch_uid="telemetry-prerun")
+    signals.task_postrun.connect(on_postrun, weak=False, dispatch_uid="telemetry-postrun")
+    signals.task_retry.connect(on_retry, weak=False, dispatch_uid="telemetry-retry")
+    signals.worker_process_shutdown.connect(on_process_shutdown, weak=False, dispatch_uid="telemetry-shutdown")
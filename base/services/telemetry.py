@@ -0,0 +1,152 @@
+"""
+Per-request timings: wall time, DB queries and DB time, serializer time
+and render time (and the time spent in SELECT ... FOR UPDATE, used by the
+task telemetry).
+
+RequestIDMiddleware opens a RequestTimings for every request (a context
+variable, so it follows the request into sync_to_async threads) and, when
+the response is ready, records it into the per-route histograms of the
+metrics registry and into a `Server-Timing` header.
+
+- DB: an execute wrapper installed on every connection (connection_created)
+- serialize: timed("serialize") where the views read serializer.data
+  (base.views.TimedSerializerMixin, the conditional mixins) and around
+  the fast path mappers
+- render: RequestIDJSONRenderer and the fast path encoder
+
+Outside a request (tasks, shell) all hooks are a context variable lookup.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from base.services import metrics
+
+_current = ContextVar("request_timings", default=None)
+
+metrics.counter("http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+metrics.histogram("http_request_duration_seconds", "Wall time of HTTP requests.", ("route", "method"))
+metrics.histogram("http_request_db_seconds", "Time spent in database queries per request.", ("route", "method"))
+metrics.histogram(
+    "http_request_db_queries", "Database queries per request.", ("route", "method"), buckets=metrics.COUNT_BUCKETS,
+)
+metrics.histogram("http_request_serialize_seconds", "Time spent serializing per request.", ("route", "method"))
+metrics.histogram("http_request_render_seconds", "Time spent rendering the response body per request.", ("route", "method"))
+
+
+class RequestTimings:
+    __slots__ = ("started", "db", "db_queries", "lock_wait", "serialize", "render", "active")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.db_queries = 0
+        # SELECT ... FOR UPDATE statements, i.e. mostly waiting for row locks
+        self.lock_wait = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.active = set()
+
+
+def _config():
+    return getattr(settings, "TELEMETRY", {})
+
+
+def is_enabled():
+    return _config().get("ENABLED", True)
+
+
+def current():
+    return _current.get()
+
+
+def start():
+    """Open the timings of a new request (or task), returns the state for finish() / stop()."""
+    for connection in connections.all(initialized_only=True):
+        instrument_connection(connection)
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def stop(state):
+    """Close the timings opened by start(), returns (timings, elapsed seconds)."""
+    timings, token = state
+    _current.reset(token)
+    return timings, time.perf_counter() - timings.started
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to `phase` of the current request (outermost block only)."""
+    timings = _current.get()
+    if timings is None or phase in timings.active:
+        yield
+        return
+
+    timings.active.add(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, phase, getattr(timings, phase) + time.perf_counter() - started)
+        timings.active.discard(phase)
+
+
+def _execute(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        timings.db += elapsed
+        timings.db_queries += 1
+        if " FOR UPDATE" in sql:
+            timings.lock_wait += elapsed
+
+
+def instrument_connection(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def route_of(request):
+    match = getattr(request, "resolver_match", None)
+    return match.route if match is not None else "unmatched"
+
+
+def finish(request, response, state):
+    """Record the request and set its Server-Timing header."""
+    timings, total = stop(state)
+
+    labels = (route_of(request), request.method)
+    metrics.inc("http_requests_total", *labels, str(response.status_code))
+    metrics.observe_many((
+        ("http_request_duration_seconds", total),
+        ("http_request_db_seconds", timings.db),
+        ("http_request_db_queries", timings.db_queries),
+        ("http_request_serialize_seconds", timings.serialize),
+        ("http_request_render_seconds", timings.render),
+    ), *labels)
+
+    if _config().get("SERVER_TIMING", True):
+        response["Server-Timing"] = (
+            f"total;dur={total * 1000:.2f}, "
+            f'db;dur={timings.db * 1000:.2f};desc="{timings.db_queries} queries", '
+            f"lock;dur={timings.lock_wait * 1000:.2f}, "
+            f"serialize;dur={timings.serialize * 1000:.2f}, "
+            f"render;dur={timings.render * 1000:.2f}"
+        )
+    return response
+
+
+def install():
+    """Hook DB connections (once, from AppConfig.ready)."""
+    connection_created.connect(instrument_connection, dispatch_uid="telemetry-instrument-connection")
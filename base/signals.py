@@ -1,20 +1,62 @@
-from .models import Order
-from django.db.models.signals import post_save
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .models import Order, Product
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .serializers import OrderSerializer
 
 from .tasks import audit_log
+from .services import catalog_cache, rollup_service
+
+_audit_disabled = ContextVar("order_audit_disabled", default=False)
+
+
+@contextmanager
+def order_audit_disabled():
+    """Skip the per-save Order audit entry, e.g. for bulk jobs that log in bulk themselves."""
+    token = _audit_disabled.set(True)
+    try:
+        yield
+    finally:
+        _audit_disabled.reset(token)
+
 
 @receiver(post_save, sender=Order)
-def update_order(sender, instance, **kwargs):
-    old_instance = Order.objects.get(id=instance.id)
-    old_instance = OrderSerializer(old_instance)
-    new_instance = OrderSerializer(instance)
+def update_order(sender, instance, created, update_fields=None, **kwargs):
+    # old/new come from the values the instance was loaded with, no re-query
+    changes = instance.get_changes()
+    if update_fields:
+        attnames = {Order._meta.get_field(name).attname for name in update_fields}
+        changes = {name: change for name, change in changes.items() if name in attnames}
+    instance.reset_tracking()
+
+    if created:
+        rollup_service.order_created(instance)
+    elif "status" in changes:
+        rollup_service.status_changed([instance.id], *changes["status"])
+
+    if _audit_disabled.get() or getattr(instance, "skip_audit", False) or not changes:
+        return
+
     audit_log(
         actor="System",
-        action="Order Updated",
+        action="Order Created" if created else "Order Updated",
         obj_id=instance.id,
         obj_type="Order",
-        old=old_instance.data,
-        new=new_instance.data
+        old=None if created else {name: old for name, (old, new) in changes.items()},
+        new={name: new for name, (old, new) in changes.items()}
     )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, update_fields=None, **kwargs):
+    # reservations save only the stock counters, which leaves the static part cached
+    if update_fields and set(update_fields) <= set(catalog_cache.STOCK_FIELDS):
+        catalog_cache.stock_changed()
+    else:
+        catalog_cache.catalog_changed()
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    catalog_cache.catalog_changed()
@@ -5,23 +5,52 @@ from django.db.models import F
 
 
 from .models import AuditLog
+from .services import audit_service
+
+def _audit_entry(actor, action, obj_id, obj_type, old=None, new=None):
+    return AuditLog(
+        actor=actor,
+        action=action,
+        object_type=obj_type,
+        object_id=obj_id,
+        old_value=old,
+        new_value=new
+    )
+
 
 def audit_log(actor, action, obj_id, obj_type, old=None, new=None):
+    # buffered mode: written in bulk by the flusher once the caller commits
+    if audit_service.is_buffered():
+        audit_service.enqueue([_audit_entry(actor, action, obj_id, obj_type, old, new)])
+        return
+
     try:
-        AuditLog.objects.create(
-            actor=actor,
-            action=action,
-            object_type=obj_type,
-            object_id=obj_id,
-            old_value=old,
-            new_value=new
-        )
+        _audit_entry(actor, action, obj_id, obj_type, old, new).save()
+    except Exception as e:
+        print(e)
+
+
+def audit_log_bulk(entries):
+    """Write many audit_log() entries (same keyword names) with one INSERT."""
+    rows = [
+        _audit_entry(entry["actor"], entry["action"], entry["obj_id"], entry["obj_type"], entry.get("old"), entry.get("new"))
+        for entry in entries
+    ]
+
+    if audit_service.is_buffered():
+        audit_service.enqueue(rows)
+        return
+
+    try:
+        AuditLog.objects.bulk_create(rows, batch_size=500)
     except Exception as e:
         print(e)
 
 from django.db import transaction
 from django.utils import timezone
 from .models import Reservation, Product
+from .services import admission, catalog_cache, task_telemetry
+from .services.shard_service import release_to_bucket, rebalance_buckets, sell_from_buckets
 
 @shared_task
 def update_reservation(reservation_id):
@@ -39,18 +68,30 @@ def update_reservation(reservation_id):
         if not reservation:
             return {"reservation_id": reservation_id, "status": "Reservation Not Found"}
 
+        # released by the sweeper or an earlier delivery: the stock is back already
+        if not reservation.is_active:
+            return {"reservation_id": reservation_id, "status": "Reservation Already Released"}
+
         old_data = ReservationSerializer(reservation).data
 
         product = reservation.product
 
-        # restore stock
-        product.available_stock += reservation.quantity
-        product.reserved_stock -= reservation.quantity
-        product.save()
+        # restore stock with F() deltas, like the sweeper, never a save() of the row read above
+        if product.sharded:
+            release_to_bucket(product.id, reservation.bucket_id, reservation.quantity)
+        else:
+            Product.objects.filter(id=product.id).update(
+                available_stock=F("available_stock") + reservation.quantity,
+                reserved_stock=F("reserved_stock") - reservation.quantity,
+            )
+            catalog_cache.stock_changed()
 
         reservation.is_active = False
         reservation.save()
 
+        transaction.on_commit(lambda: admission.refund(product.id, reservation.quantity))
+        task_telemetry.record_release_lag([reservation.expires_at], "task")
+
         new_data = ReservationSerializer(reservation).data
 
         audit_log(
@@ -67,24 +108,83 @@ def update_reservation(reservation_id):
 
 @shared_task
 def reservation_cleanup():
+    from .services.reservation_service import sweep_expired_reservations
 
-    reservations =Reservation.objects.filter(is_active=False)
+    released = sweep_expired_reservations()
 
-    for reservation in reservations:
-        update_reservation.delay(reservation.id)
-
-    return "Reservation Cleanup Completed"
+    return f"Reservation Cleanup Completed, {released} Released"
 
 
 @shared_task(bind=True)
 def attempt_purchase_task(self,product_id):
+    # Rejected by the admission counter: no database round trip at all
+    if not admission.admit(product_id, 1):
+        return "FAILURE"
+
+    # Sharded products: take the unit from a random bucket, no Product row lock
+    if Product.objects.filter(id=product_id, sharded=True).exists():
+        try:
+            sell_from_buckets(product_id, 1)
+            return "SUCCESS"
+        except ValueError:
+            admission.refund(product_id, 1)
+            return "FAILURE"
+
+    # a purchase sells one available unit: total_stock stays, so
+    # available + reserved + sold == total keeps holding
     with transaction.atomic():
         product = Product.objects.select_for_update().get(id=product_id)
-        if product.total_stock > 0:
-            product.total_stock = F('total_stock') - 1
+        if product.available_stock > 0:
             product.available_stock = F('available_stock') - 1
-            product.reserved_stock = F('reserved_stock') + 1
-            product.save(update_fields=["total_stock","available_stock","reserved_stock"])
+            product.sold_stock = F('sold_stock') + 1
+            product.save(update_fields=["available_stock", "sold_stock"])
             return "SUCCESS"
         else:
-            return "FAILURE"    
\ No newline at end of file
+            admission.refund(product_id, 1)
+            return "FAILURE"
+
+
+@shared_task
+def rebalance_stock_buckets():
+    product_ids = Product.objects.filter(sharded=True).values_list('id', flat=True)
+
+    for product_id in product_ids:
+        rebalance_buckets(product_id)
+
+    return "Stock Buckets Rebalanced"
+
+
+@shared_task
+def reconcile_admission_tokens():
+    if not admission.is_enabled():
+        return "Stock Admission Disabled"
+
+    count = admission.reconcile_tokens()
+
+    return f"Admission Tokens Reconciled for {count} Products"
+
+
+@shared_task
+def flush_audit_log():
+    audit_service.get_buffer().flush()
+
+    return audit_service.stats()
+
+
+@shared_task
+def maintain_audit_log():
+    from .services import audit_archive
+
+    audit_archive.ensure_partitions()
+    archived = audit_archive.archive_old_months()
+
+    return f"Audit Log Maintained, {len(archived)} Months Archived"
+
+
+@shared_task
+def purge_idempotency_keys():
+    from .services import idempotency
+
+    deleted = idempotency.purge_expired()
+
+    return f"Idempotency Keys Purged, {deleted} Deleted"
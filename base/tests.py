@@ -1,13 +1,38 @@
-from django.test import TestCase, TransactionTestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, skipUnlessDBFeature, override_settings
 from django.utils import timezone
 from django.db import connection
 from django.test.utils import CaptureQueriesContext
 from datetime import timedelta
 from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import StringIO
+import shutil
+import csv
+import json
+import os
+import re
+import tempfile
+import time
+from unittest import skipIf
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, sync_to_async
 
-from base.models import Product, Reservation, Order, AuditLog
-from base.services.reservation_service import reserve_stock
-from base.services.order_service import change_order_status
+from base.models import Product, Reservation, Order, OrderItem, AuditLog, StockBucket, DailySalesRollup, ProductSalesRollup, UserSalesRollup, IdempotencyKey
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from base.services.reservation_service import reserve_stock, reserve_stock_batch, BatchReservationError, sweep_expired_reservations
+from base.services.order_service import ALLOWED_SOURCES, ORDER_TRANSITIONS, bulk_change_order_status, change_order_status, create_orders_bulk
+from base.services.shard_service import enable_sharding, rebalance_buckets, bucket_totals
+from base.services.stock_service import Settlement, confirm_reserved_stock, release_reserved_stock
+from base.tasks import update_reservation, purge_idempotency_keys, attempt_purchase_task, reservation_cleanup
+from base.services import admission, audit_service, audit_archive, catalog_cache, idempotency, metrics, task_telemetry
+from base.tasks import audit_log
+from base.signals import order_audit_disabled
+from base.pagination import OrderKeysetPagination
+from base import fastpath
+from base.renderers import RequestIDJSONRenderer
+from base.serializers import AuditLogFilter, AuditLogSerializer, OrderFilter, OrderSerializer, ProductSerializer, ReservationSerializer
+from django.db import transaction
 # from base.state_machine import validate_transition
 
 
@@ -52,6 +77,342 @@ class ReservationTests(TestCase):
         )
 
 
+@override_settings(STOCK_RESERVATION_ENGINE="conditional")
+class ConditionalReservationEngineTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Hot", total_stock=5, available_stock=5, reserved_stock=0)
+
+    def test_guarded_update_reserves_stock(self):
+        reserve_stock(self.product.id, 5)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 0)
+        self.assertEqual(self.product.reserved_stock, 5)
+
+    def test_stock_is_taken_with_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            reserve_stock(self.product.id, 1)
+
+        product_queries = [query["sql"] for query in queries if '"base_product"' in query["sql"]]
+        self.assertEqual(len(product_queries), 1)
+        self.assertTrue(product_queries[0].startswith('UPDATE "base_product"'))
+
+    def test_sharded_product_falls_back_to_buckets(self):
+        enable_sharding(self.product.id, buckets=2)
+
+        reservation = reserve_stock(self.product.id, 2)
+
+        self.assertIsNotNone(reservation.bucket_id)
+        self.assertEqual(bucket_totals(self.product.id), {"available_stock": 3, "reserved_stock": 2})
+        with self.assertRaises(Product.DoesNotExist):
+            reserve_stock(999999, 1)
+
+    def test_guarded_update_rejects_oversell(self):
+        reserve_stock(self.product.id, 4)
+
+        with self.assertRaises(ValueError):
+            reserve_stock(self.product.id, 2)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 1)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_endpoint_uses_configured_engine(self):
+        response = self.client.post(
+            "/api/reservation/",
+            {"product": self.product.id, "quantity": 6},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchReservationTests(TestCase):
+
+    def setUp(self):
+        self.first = Product.objects.create(name="First", total_stock=10, available_stock=10, reserved_stock=0)
+        self.second = Product.objects.create(name="Second", total_stock=3, available_stock=3, reserved_stock=0)
+
+    def test_batch_reserves_every_line(self):
+        reservations = reserve_stock_batch([
+            {"product": self.second.id, "quantity": 2},
+            {"product": self.first.id, "quantity": 4},
+        ])
+
+        self.assertEqual(len(reservations), 2)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.available_stock, 6)
+        self.assertEqual(self.second.reserved_stock, 2)
+
+    def test_batch_is_all_or_nothing(self):
+        with self.assertRaises(BatchReservationError) as ctx:
+            reserve_stock_batch([
+                {"product": self.first.id, "quantity": 4},
+                {"product": self.second.id, "quantity": 5},
+                {"product": 999999, "quantity": 1},
+            ])
+
+        self.assertEqual(
+            [(error["index"], error["reason"]) for error in ctx.exception.errors],
+            [(1, "Insufficient stock"), (2, "Product not found")],
+        )
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.available_stock, 10)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_duplicate_lines_are_checked_together(self):
+        with self.assertRaises(BatchReservationError):
+            reserve_stock_batch([
+                {"product": self.second.id, "quantity": 2},
+                {"product": self.second.id, "quantity": 2},
+            ])
+
+    def test_batch_endpoint_reports_line_errors(self):
+        response = self.client.post(
+            "/api/reservation/",
+            [{"product": self.first.id, "quantity": 1}, {"product": self.second.id, "quantity": 50}],
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["index"], 1)
+
+
+class BatchReservationConcurrencyTests(TransactionTestCase):
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_opposite_line_order_does_not_deadlock(self):
+        products = [
+            Product.objects.create(name=f"Hot {i}", total_stock=50, available_stock=50, reserved_stock=0)
+            for i in range(4)
+        ]
+        forward = [{"product": p.id, "quantity": 1} for p in products]
+        backward = list(reversed(forward))
+
+        def attempt(lines):
+            try:
+                reserve_stock_batch(lines)
+                return True
+            except BatchReservationError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(attempt, [forward, backward] * 10))
+
+        self.assertTrue(all(results))
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.reserved_stock, 20)
+            self.assertEqual(product.available_stock + product.reserved_stock, product.total_stock)
+
+
+class ShardedStockTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Flash", total_stock=10, available_stock=10, reserved_stock=0)
+        enable_sharding(self.product.id, buckets=4)
+        self.product.refresh_from_db()
+
+    def test_stock_is_split_across_buckets(self):
+        self.assertEqual(
+            sorted(self.product.buckets.values_list("available_stock", flat=True)),
+            [2, 2, 3, 3],
+        )
+        self.product.clean()
+
+    def test_reservation_charges_one_bucket_and_expiry_returns_it(self):
+        reservation = reserve_stock(self.product.id, 2)
+
+        self.assertIsNotNone(reservation.bucket_id)
+        self.assertEqual(StockBucket.objects.get(id=reservation.bucket_id).reserved_stock, 2)
+
+        update_reservation(reservation.id)
+
+        self.assertEqual(bucket_totals(self.product.id), {"available_stock": 10, "reserved_stock": 0})
+
+    def test_rebalance_refreshes_aggregate_and_keeps_invariant(self):
+        reserve_stock(self.product.id, 3)
+        reserve_stock(self.product.id, 1)
+
+        rebalance_buckets(self.product.id)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock), (6, 4))
+        self.assertEqual(self.product.stock_levels(), (6, 4))
+        self.product.clean()
+
+    def test_reservation_larger_than_any_bucket_gathers_stock(self):
+        reservation = reserve_stock(self.product.id, 8)
+
+        self.assertEqual(StockBucket.objects.get(id=reservation.bucket_id).reserved_stock, 8)
+        self.assertEqual(bucket_totals(self.product.id), {"available_stock": 2, "reserved_stock": 8})
+
+        update_reservation(reservation.id)
+
+        self.assertEqual(bucket_totals(self.product.id), {"available_stock": 10, "reserved_stock": 0})
+
+    def test_stock_bookkeeping_fields_are_read_only(self):
+        response = self.client.post(
+            "/api/create-products/",
+            {"name": "Forged", "total_stock": 5, "available_stock": 5, "reserved_stock": 0, "sharded": True, "sold_stock": 3},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()["sharded"], response.json()["sold_stock"]), (False, 0))
+        self.assertTrue(ReservationSerializer().fields["bucket"].read_only)
+
+    def test_oversell_is_rejected(self):
+        with self.assertRaises(ValueError):
+            reserve_stock(self.product.id, 11)
+
+        self.assertEqual(bucket_totals(self.product.id), {"available_stock": 10, "reserved_stock": 0})
+
+
+@override_settings(STOCK_ADMISSION={"ENABLED": True, "BACKEND": "local"})
+class StockAdmissionTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Edge", total_stock=3, available_stock=3, reserved_stock=0)
+        admission.reconcile_tokens()
+
+    def test_rejected_request_never_reaches_database(self):
+        reserve_stock(self.product.id, 3)
+
+        with self.assertNumQueries(0):
+            with self.assertRaises(ValueError):
+                reserve_stock(self.product.id, 1)
+
+    def test_expiry_refunds_tokens(self):
+        reservation = reserve_stock(self.product.id, 2)
+        self.assertEqual(admission.get_store().get(self.product.id), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_reservation(reservation.id)
+
+        self.assertEqual(admission.get_store().get(self.product.id), 3)
+
+    def test_expiry_after_sweep_changes_nothing(self):
+        reservation = reserve_stock(self.product.id, 2)
+        Reservation.objects.filter(id=reservation.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_expired_reservations()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = update_reservation(reservation.id)
+
+        self.assertEqual(result["status"], "Reservation Already Released")
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock), (3, 0))
+        self.assertEqual(admission.get_store().get(self.product.id), 3)
+
+    def test_batch_reports_only_refused_products(self):
+        other = Product.objects.create(name="Edge 2", total_stock=1, available_stock=1, reserved_stock=0)
+        plenty = Product.objects.create(name="Edge 3", total_stock=9, available_stock=9, reserved_stock=0)
+        admission.reconcile_tokens()
+
+        with self.assertRaises(BatchReservationError) as ctx:
+            reserve_stock_batch([
+                {"product": self.product.id, "quantity": 5},
+                {"product": plenty.id, "quantity": 1},
+                {"product": other.id, "quantity": 2},
+            ])
+
+        self.assertEqual([(error["index"], error["reason"]) for error in ctx.exception.errors], [
+            (0, "Insufficient stock"), (2, "Insufficient stock"),
+        ])
+        self.assertEqual(admission.get_store().get(plenty.id), 9)
+
+    def test_redis_outage_backs_off(self):
+        store = admission.RedisTokenStore("redis://127.0.0.1:1/0")
+        calls = []
+
+        def unreachable(**kwargs):
+            calls.append(kwargs)
+            raise ConnectionError("unreachable")
+
+        store._take = unreachable
+        with patch.object(admission, "get_store", return_value=store):
+            self.assertTrue(admission.admit(self.product.id, 1))
+            self.assertTrue(admission.admit(self.product.id, 1))
+
+        self.assertEqual(len(calls), 1)
+
+    def test_reconciliation_corrects_drift(self):
+        admission.get_store().set({self.product.id: 0})
+
+        admission.reconcile_tokens()
+
+        self.assertEqual(admission.get_store().get(self.product.id), 3)
+        reserve_stock(self.product.id, 1)
+
+    def test_database_failure_refunds_tokens(self):
+        Product.objects.filter(id=self.product.id).update(available_stock=0, reserved_stock=3)
+
+        with self.assertRaises(ValueError):
+            reserve_stock(self.product.id, 2)
+
+        self.assertEqual(admission.get_store().get(self.product.id), 3)
+
+
+class CatalogCacheTests(TestCase):
+
+    def setUp(self):
+        self.enterContext(override_settings(CATALOG_CACHE={"ENABLED": True, "BACKEND": "local", "LOCAL_MAX_ENTRIES": 4}))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name="Mug", total_stock=10, available_stock=10, reserved_stock=0, price=Decimal("4.50"))
+
+    def test_catalog_matches_serializer_and_second_read_is_free(self):
+        response = self.client.get("/api/create-products/")
+        self.assertEqual(response.json()[0]["price"], "4.50")
+        self.assertEqual(response.json()[0]["available_stock"], 10)
+
+        with self.assertNumQueries(0):
+            self.client.get("/api/create-products/")
+        self.assertEqual(catalog_cache.stats()["local_hits"], 2)
+
+    def test_stock_write_bumps_only_stock_part(self):
+        catalog_cache.get_catalog()
+        bumps = catalog_cache.stats()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock(self.product.id, 3)
+
+        # static rows still cached, stock counters re-read
+        with self.assertNumQueries(2):
+            catalog = catalog_cache.get_catalog()
+        self.assertEqual((catalog[0]["available_stock"], catalog[0]["reserved_stock"]), (7, 3))
+        self.assertEqual(catalog_cache.stats()["stock_bumps"], bumps["stock_bumps"] + 1)
+        self.assertEqual(catalog_cache.stats()["static_bumps"], bumps["static_bumps"])
+
+    def test_sweeper_and_sharded_writes_invalidate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enable_sharding(self.product.id, buckets=2)
+        catalog_cache.get_catalog()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = reserve_stock(self.product.id, 4)
+        self.assertEqual(catalog_cache.get_catalog()[0]["available_stock"], 6)
+
+        Reservation.objects.filter(id=reservation.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_expired_reservations()
+        self.assertEqual(catalog_cache.get_catalog()[0]["available_stock"], 10)
+
+    def test_rename_refreshes_static_part_and_lru_evicts(self):
+        for i in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.name = f"Mug {i}"
+                self.product.save()
+            self.assertEqual(catalog_cache.get_catalog()[0]["name"], f"Mug {i}")
+
+        self.assertGreater(catalog_cache.stats()["evictions"], 0)
+
+
 class ReservationExpiryTests(TestCase):
 
     def test_expired_reservation_releases_stock(self):
@@ -83,29 +444,1450 @@ class ReservationExpiryTests(TestCase):
 
 
 
+@override_settings(AUDIT_LOG={"MODE": "sync"})
+class ExpirySweeperTests(TestCase):
+
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f"Sweep {i}", total_stock=20, available_stock=20, reserved_stock=0)
+            for i in range(2)
+        ]
+
+    def _reserve(self, product, quantity, expired=True):
+        reservation = reserve_stock(product.id, quantity)
+        if expired:
+            Reservation.objects.filter(id=reservation.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        return reservation
+
+    def test_sweeper_releases_only_expired_reservations(self):
+        for product in self.products:
+            self._reserve(product, 2)
+            self._reserve(product, 3)
+        live = self._reserve(self.products[0], 4, expired=False)
+
+        self.assertEqual(sweep_expired_reservations(), 4)
+
+        for product in self.products:
+            product.refresh_from_db()
+        self.assertEqual(self.products[0].reserved_stock, 4)
+        self.assertEqual(self.products[1].available_stock, 20)
+        self.assertTrue(Reservation.objects.get(id=live.id).is_active)
+        self.assertEqual(AuditLog.objects.filter(action="Reservation Expired").count(), 4)
+
+    def test_sweeper_works_in_chunks_with_constant_queries_per_chunk(self):
+        for _ in range(6):
+            self._reserve(self.products[0], 1)
+            self._reserve(self.products[1], 1)
+
+        with CaptureQueriesContext(connection) as small:
+            sweep_expired_reservations(batch_size=100)
+
+        for _ in range(15):
+            self._reserve(self.products[0], 1)
+            self._reserve(self.products[1], 1)
+
+        with CaptureQueriesContext(connection) as large:
+            sweep_expired_reservations(batch_size=100)
+
+        self.assertEqual(len(small), len(large))
+        self.assertFalse(Reservation.objects.filter(is_active=True).exists())
+
+    def test_sweeper_releases_sharded_stock_to_buckets(self):
+        enable_sharding(self.products[0].id, buckets=2)
+        self._reserve(self.products[0], 5)
+
+        sweep_expired_reservations()
+
+        self.assertEqual(bucket_totals(self.products[0].id), {"available_stock": 20, "reserved_stock": 0})
+
+
+class OrderTotalPriceTests(TestCase):
+
+    def setUp(self):
+        self.order = Order.objects.create(status="PENDING")
+        self.product = Product.objects.create(name="Priced", total_stock=10, available_stock=10, reserved_stock=0, price=Decimal("2.50"))
+
+    def test_total_follows_item_changes(self):
+        item = OrderItem.objects.create(order=self.order, product=self.product, quantity=4)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal("12.50"))
+
+        item = OrderItem.objects.get(id=item.id)
+        item.quantity = 2
+        item.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal("7.50"))
+
+        item.delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal("2.50"))
+
+    def test_price_is_snapshotted(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        Product.objects.filter(id=self.product.id).update(price="100.00")
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.get_total_price(), Decimal("5.00"))
+
+    def test_filter_and_sort_use_stored_total(self):
+        cheap = Order.objects.create(status="PENDING")
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=8)
+        OrderItem.objects.create(order=cheap, product=self.product, quantity=1)
+
+        response = self.client.get("/api/order-list/", {"min_total": 10, "ordering": "-total_price"})
+
+        self.assertEqual([row["id"] for row in response.json()["results"]], [self.order.id])
+
+    def test_backfill_command_repairs_totals(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        OrderItem.objects.update(unit_price=None)
+        Order.objects.update(total_price=0)
+        etag = self.client.get(f"/api/order/{self.order.id}/")["ETag"]
+
+        call_command("backfill_order_totals", stdout=StringIO())
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, Decimal("5.00"))
+        response = self.client.get(f"/api/order/{self.order.id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class BufferedAuditLogTests(TestCase):
+
+    def setUp(self):
+        # a fresh buffer per test, the flusher thread never wakes up on its own
+        self.enterContext(override_settings(
+            AUDIT_LOG={"MODE": "buffered", "BATCH_SIZE": 1000, "FLUSH_INTERVAL": 3600, "MAX_QUEUE": 2}
+        ))
+
+    def _log(self, n=1):
+        for i in range(n):
+            audit_log(actor="System", action="Test", obj_id=i, obj_type="Test")
+
+    def test_entries_are_written_in_bulk_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._log(2)
+            self.assertFalse(AuditLog.objects.exists())
+
+        self.assertEqual(audit_service.stats()["queue_depth"], 2)
+        with self.assertNumQueries(1):
+            audit_service.get_buffer().flush()
+        self.assertEqual(AuditLog.objects.count(), 2)
+
+    def test_rolled_back_work_is_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self._log()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(audit_service.stats()["queue_depth"], 0)
+
+    def test_overflow_is_dropped_and_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._log(3)
+
+        self.assertEqual(audit_service.stats()["queue_depth"], 2)
+        self.assertEqual(audit_service.stats()["dropped"], 1)
+
+
+@override_settings(AUDIT_LOG={"MODE": "sync"})
+class OrderChangeTrackingTests(TestCase):
+
+    def setUp(self):
+        self.order = Order.objects.create(status="PENDING")
+        self.order = Order.objects.get(id=self.order.id)
+
+    def test_only_changed_fields_are_logged_without_requery(self):
+        self.order.status = "CONFIRMED"
+
+        # the UPDATE, the audit INSERT and the rollup lookups (order + items);
+        # the rollup rows are written after commit - no re-read, no serializer
+        with self.assertNumQueries(4):
+            self.order.save(update_fields=["status"])
+
+        entry = AuditLog.objects.filter(action="Order Updated").get()
+        self.assertEqual(entry.old_value, {"status": "PENDING"})
+        self.assertEqual(entry.new_value, {"status": "CONFIRMED"})
+
+    def test_unchanged_save_is_not_logged(self):
+        with self.assertNumQueries(1):
+            self.order.save()
+
+        self.assertFalse(AuditLog.objects.filter(action="Order Updated").exists())
+
+    def test_bulk_opt_out(self):
+        self.order.status = "CANCELLED"
+
+        with order_audit_disabled():
+            self.order.save()
+
+        self.assertFalse(AuditLog.objects.filter(action="Order Updated").exists())
+
+
+class AuditLogApiTests(TestCase):
+
+    def setUp(self):
+        AuditLog.objects.bulk_create(
+            [AuditLog(actor="System", action="Order Updated", object_type="Order", object_id=str(i % 3)) for i in range(120)]
+        )
+        # identical timestamps: the id tie-breaker has to keep pages disjoint
+        AuditLog.objects.update(timestamp=timezone.now())
+
+    def _walk(self, url, params=None):
+        seen = []
+        response = self.client.get(url, params)
+        while True:
+            body = response.json()
+            seen.extend(row["id"] for row in body["results"])
+            if not body["next"]:
+                return seen
+            response = self.client.get(body["next"])
+
+    def test_keyset_pages_cover_everything_once(self):
+        seen = self._walk("/api/audit-log/")
+
+        self.assertEqual(len(seen), 120)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_filters(self):
+        self.assertEqual(len(self._walk("/api/audit-log/", {"object_type": "Order", "object_id": "1"})), 40)
+        self.assertEqual(len(self._walk("/api/audit-log/", {"actor": "Nobody"})), 0)
+
+    def test_object_history_endpoint(self):
+        seen = self._walk("/api/audit-log/Order/2/")
+
+        self.assertEqual(len(seen), 40)
+        self.assertEqual(set(AuditLog.objects.filter(id__in=seen).values_list("object_id", flat=True)), {"2"})
+
+    def test_deep_page_is_a_single_query(self):
+        first = self.client.get("/api/audit-log/").json()
+
+        with self.assertNumQueries(1):
+            self.client.get(first["next"])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        product = Product.objects.create(name="Paged", total_stock=100, available_stock=100, reserved_stock=0, price=Decimal("1.00"))
+        self.orders = [Order.objects.create(status="PENDING") for _ in range(7)]
+        # duplicate totals: (total_price, id) has to break the ties
+        for order, quantity in zip(self.orders, [3, 1, 3, 2, 3, 1, 2]):
+            OrderItem.objects.create(order=order, product=product, quantity=quantity)
+
+    def _walk(self, params):
+        pages = []
+        body = self.client.get("/api/order-list/", params).json()
+        while True:
+            pages.append(body)
+            if not body["next"]:
+                return pages
+            body = self.client.get(body["next"]).json()
+
+    def test_value_ordering_pages_forward_and_back(self):
+        pages = self._walk({"ordering": "-total_price", "page_size": 3})
+        seen = [row["id"] for page in pages for row in page["results"]]
+
+        expected = list(Order.objects.order_by("-total_price", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+        self.assertIsNone(pages[0]["previous"])
+
+        back = self.client.get(pages[-1]["previous"]).json()
+        self.assertEqual(back["results"], pages[-2]["results"])
+        self.assertEqual(self.client.get(back["previous"]).json()["results"], pages[0]["results"])
+
+    def test_default_ordering_is_created_at_then_id(self):
+        seen = [row["id"] for page in self._walk({}) for row in page["results"]]
+
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), 7)
+
+    def test_page_size_is_clamped_and_cursor_bound_to_ordering(self):
+        with patch.object(OrderKeysetPagination, "max_page_size", 5):
+            response = self.client.get("/api/order-list/", {"page_size": 10_000, "ordering": "total_price"}).json()
+        self.assertEqual(len(response["results"]), 5)
+
+        first = self.client.get("/api/order-list/", {"ordering": "total_price"}).json()
+        cursor = first["next"].split("cursor=")[1].split("&")[0]
+        response = self.client.get("/api/order-list/", {"ordering": "created_at", "cursor": cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_estimated_count_only_on_request(self):
+        self.assertNotIn("count_estimate", self.client.get("/api/order-list/").json())
+
+        body = self.client.get("/api/order-list/", {"count": "estimate"}).json()
+        if connection.vendor == "postgresql":
+            self.assertGreaterEqual(body["count_estimate"], 0)
+        else:
+            self.assertIsNone(body["count_estimate"])
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Tagged", total_stock=10, available_stock=10, reserved_stock=0, price=Decimal("2.00"))
+        self.order = Order.objects.create(status="PENDING")
+
+    def test_order_detail_304_is_one_query(self):
+        etag = self.client.get(f"/api/order/{self.order.id}/")["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/order/{self.order.id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_item_total_and_status_change_the_etag(self):
+        etags = [self.client.get(f"/api/order/{self.order.id}/")["ETag"]]
+
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+        etags.append(self.client.get(f"/api/order/{self.order.id}/", HTTP_IF_NONE_MATCH=etags[-1])["ETag"])
+
+        reserve_stock(self.product.id, 1)
+        change_order_status(self.order.id, "CONFIRMED")
+        response = self.client.get(f"/api/order/{self.order.id}/", HTTP_IF_NONE_MATCH=etags[-1])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len({*etags, response["ETag"]}), 3)
+
+    def test_reservation_etag_follows_expiry(self):
+        reservation = reserve_stock(self.product.id, 1)
+        etag = self.client.get(f"/api/reservation/{reservation.id}/")["ETag"]
+        self.assertEqual(self.client.get(f"/api/reservation/{reservation.id}/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Reservation.objects.filter(id=reservation.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        sweep_expired_reservations()
+
+        self.assertEqual(self.client.get(f"/api/reservation/{reservation.id}/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_list_page_etag(self):
+        etag = self.client.get("/api/order-list/")["ETag"]
+        self.assertEqual(self.client.get("/api/order-list/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Order.objects.create(status="PENDING")
+
+        self.assertEqual(self.client.get("/api/order-list/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_product_list_etag_uses_catalog_versions(self):
+        self.enterContext(override_settings(CATALOG_CACHE={"ENABLED": True, "BACKEND": "local"}))
+        etag = self.client.get("/api/create-products/")["ETag"]
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/create-products/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock(self.product.id, 2)
+        self.assertEqual(self.client.get("/api/create-products/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(AUDIT_LOG={"MODE": "sync"})
+class FastReadPathTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="fast")
+        product = Product.objects.create(name="Fast \u2028 caf\u00e9", total_stock=20, available_stock=20, reserved_stock=0, price=Decimal("3.10"))
+        self.orders = [Order.objects.create(status="PENDING", user=self.user if i % 2 else None) for i in range(3)]
+        OrderItem.objects.create(order=self.orders[0], product=product, quantity=3)
+        self.reservation = reserve_stock(product.id, 2)
+        audit_log(actor="System", action="Note", obj_id=1, obj_type="Order", old={"name": "caf\u00e9 \u2028"}, new={"total": 9.3})
+
+    def _bodies(self, url, params=None):
+        """(fast, serializer) bodies with the per-request request_id blanked."""
+        bodies = []
+        for enabled in (True, False):
+            with override_settings(FAST_READ_PATH=enabled):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            bodies.append(response.content.replace(response["X-Request-ID"].encode(), b"-"))
+        return bodies
+
+    def _assert_identical(self):
+        for url, params in [
+            ("/api/order-list/", None),
+            ("/api/order-list/", {"ordering": "-total_price", "page_size": 2}),
+            (f"/api/order/{self.orders[0].id}/", None),
+            (f"/api/reservation/{self.reservation.id}/", None),
+            ("/api/audit-log/", None),
+            ("/api/create-products/", None),
+        ]:
+            fast, serialized = self._bodies(url, params)
+            self.assertEqual(fast, serialized, url)
+
+    def test_output_is_byte_compatible(self):
+        self._assert_identical()
+
+    def test_stdlib_encoder_is_byte_compatible(self):
+        with patch.object(fastpath, "orjson", None):
+            self._assert_identical()
+
+    def test_missing_detail_is_404(self):
+        fast, serialized = [], []
+        for enabled, bodies in ((True, fast), (False, serialized)):
+            with override_settings(FAST_READ_PATH=enabled):
+                response = self.client.get("/api/order/999999/")
+            self.assertEqual(response.status_code, 404)
+            bodies.append(response.json()["detail"])
+        self.assertEqual(fast, serialized)
+
+    def test_list_skips_serializer_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get("/api/order-list/")
+
+    def test_browsable_api_uses_serializers(self):
+        response = self.client.get("/api/order-list/", HTTP_ACCEPT="text/html")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"<html", response.content)
+
+
+@override_settings(AUDIT_LOG={"MODE": "sync"}, CATALOG_CACHE={"ENABLED": True, "BACKEND": "local"})
+class AsyncReadEndpointTests(TestCase):
+
+    def setUp(self):
+        product = Product.objects.create(name="Async", total_stock=10, available_stock=10, reserved_stock=0, price=Decimal("2.25"))
+        self.orders = [Order.objects.create(status="PENDING") for _ in range(3)]
+        OrderItem.objects.create(order=self.orders[1], product=product, quantity=2)
+        self.reservation = reserve_stock(product.id, 1)
+        audit_log(actor="System", action="Note", obj_id=1, obj_type="Order", old=None, new={"a": 1})
+
+    async def _same_as_sync(self, path, params=None):
+        sync = await sync_to_async(self.client.get)(f"/api/{path}", params)
+        response = await self.async_client.get(f"/api/async/{path}", params)
+
+        self.assertEqual(response.status_code, sync.status_code)
+        self.assertEqual(
+            response.content.replace(response["X-Request-ID"].encode(), b"-").replace(b"/api/async/", b"/api/"),
+            sync.content.replace(sync["X-Request-ID"].encode(), b"-"),
+        )
+        # page ETags hash the next link, which carries the path
+        if "next" not in response.json():
+            self.assertEqual(response.get("ETag"), sync.get("ETag"))
+        return response
+
+    async def test_responses_match_sync_endpoints(self):
+        await self._same_as_sync("order-list/")
+        await self._same_as_sync("order-list/", {"ordering": "-total_price", "page_size": 1})
+        await self._same_as_sync(f"order/{self.orders[1].id}/")
+        await self._same_as_sync(f"reservation/{self.reservation.id}/")
+        await self._same_as_sync("audit-log/")
+        await self._same_as_sync("create-products/")
+
+    async def test_pages_and_conditional_get(self):
+        first = await self.async_client.get("/api/async/order-list/")
+        second = await self.async_client.get(first.json()["next"])
+        self.assertEqual(len(first.json()["results"]) + len(second.json()["results"]), 3)
+
+        response = await self.async_client.get(f"/api/async/order/{self.orders[0].id}/")
+        cached = await self.async_client.get(f"/api/async/order/{self.orders[0].id}/", headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(cached.status_code, 304)
+
+    async def test_filter_errors_match_sync_endpoints(self):
+        response = await self._same_as_sync("order-list/", {"status": "BOGUS"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["status"])
+
+    async def test_missing_rows_and_bad_cursor(self):
+        self.assertEqual((await self.async_client.get("/api/async/order/999999/")).status_code, 404)
+        self.assertEqual((await self.async_client.get("/api/async/order-list/", {"cursor": "garbage"})).status_code, 404)
+
+
+class AuditLogArchiveTests(TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        self.enterContext(override_settings(AUDIT_LOG_RETENTION={"MONTHS": 6, "ARCHIVE_DIR": self.archive_dir}))
+
+        old = AuditLog.objects.bulk_create(
+            [AuditLog(actor="System", action="Old", object_type="Order", object_id=str(i % 2)) for i in range(5)]
+        )
+        AuditLog.objects.filter(id__in=[row.id for row in old]).update(timestamp=timezone.now() - timedelta(days=400))
+        AuditLog.objects.create(actor="System", action="Recent", object_type="Order", object_id="1")
+
+    def test_old_months_are_exported_and_removed(self):
+        call_command("archive_audit_log", stdout=StringIO())
+
+        self.assertEqual(list(AuditLog.objects.values_list("action", flat=True)), ["Recent"])
+        (segment,) = audit_archive.list_segments()
+        year, month = (int(part) for part in segment.split("-"))
+        rows = list(audit_archive.iter_segment(year, month))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row["action"] for row in rows}, {"Old"})
+
+    def test_rows_in_the_default_partition_expire(self):
+        if not audit_archive.is_partitioned():
+            self.skipTest("needs the partitioned Postgres table")
+        # no partition exists 400 days back, so the old rows sit in the default partition
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {audit_archive.default_partition()} WHERE action = 'Old'")
+            self.assertEqual(cursor.fetchone()[0], 5)
+
+        archived = audit_archive.archive_old_months()
+
+        self.assertEqual([rows for _, _, _, rows in archived], [5])
+        self.assertFalse(AuditLog.objects.filter(action="Old").exists())
+
+    def test_archived_segment_streams_through_api(self):
+        call_command("archive_audit_log", stdout=StringIO())
+        (segment,) = self.client.get("/api/audit-log/archive/").json()["segments"]
+
+        response = self.client.get(f"/api/audit-log/archive/{segment}/", {"object_id": "0"})
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(self.client.get("/api/audit-log/archive/1999-01/").status_code, 404)
+
+    def test_dry_run_keeps_rows(self):
+        call_command("archive_audit_log", "--dry-run", stdout=StringIO())
+
+        self.assertEqual(AuditLog.objects.count(), 6)
+
+
+class OrderExportTests(TestCase):
+
+    def setUp(self):
+        product = Product.objects.create(name="Widget, large", total_stock=10, available_stock=10, reserved_stock=0, price=Decimal("3.00"))
+        for status in ("PENDING", "SHIPPED", "SHIPPED"):
+            order = Order.objects.create(status=status)
+            OrderItem.objects.create(order=order, product=product, quantity=2)
+
+    def _lines(self, params):
+        response = self.client.get("/api/order-export/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    def test_ndjson_export_honours_order_filters(self):
+        rows = [json.loads(line) for line in self._lines({"status": "SHIPPED"})]
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(set(rows[0]), {"id", "status", "created_at", "user", "total_price"})
+        self.assertEqual(rows[0]["total_price"], "6.00")
+
+    def test_csv_item_export(self):
+        lines = list(csv.reader(self._lines({"output": "csv", "kind": "items"})))
+
+        self.assertEqual(lines[0][:3], ["order", "product", "product_name"])
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[1][2], "Widget, large")
+
+    def test_invalid_output_is_rejected(self):
+        self.assertEqual(self.client.get("/api/order-export/", {"output": "xml"}).status_code, 400)
+
+
+@override_settings(AUDIT_LOG={"MODE": "sync"})
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="buyer")
+        self.product = Product.objects.create(name="Rolled", total_stock=50, available_stock=50, reserved_stock=0, price=Decimal("10.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orders = [Order.objects.create(status="PENDING", user=self.user) for _ in range(2)]
+            for order in self.orders:
+                OrderItem.objects.create(order=order, product=self.product, quantity=3)
+
+    def _rollups(self):
+        return {
+            "daily": sorted(DailySalesRollup.objects.values_list("status", "revenue", "order_count", "units")),
+            "product": sorted(ProductSalesRollup.objects.values_list("product_id", "status", "revenue", "order_count", "units")),
+            "user": sorted(UserSalesRollup.objects.values_list("user_id", "status", "revenue", "order_count", "units")),
+        }
+
+    def test_rollups_follow_items_and_status_changes(self):
+        order = Order.objects.get(id=self.orders[0].id)
+        order.status = "CONFIRMED"
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save(update_fields=["status"])
+
+        self.assertEqual(self._rollups()["daily"], [
+            ("CONFIRMED", Decimal("30.00"), 1, 3),
+            ("PENDING", Decimal("30.00"), 1, 3),
+        ])
+
+        response = self.client.get("/api/reports/products/", {"status": "CONFIRMED"})
+        self.assertEqual(response.json()["results"], [
+            {"product": self.product.id, "status": "CONFIRMED", "revenue": "30.00", "order_count": 1, "units": 3},
+        ])
+
+    def test_rollups_are_written_after_commit(self):
+        before = self._rollups()
+        order = Order.objects.get(id=self.orders[0].id)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                order.status = "CANCELLED"
+                order.save(update_fields=["status"])
+                raise RuntimeError
+            order = Order.objects.get(id=self.orders[0].id)
+            order.status = "CONFIRMED"
+            order.save(update_fields=["status"])
+            # nothing written inside the caller's transaction
+            self.assertEqual(self._rollups(), before)
+
+        # the rolled back move left no callback, the committed one writes its rows in one go
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(self._rollups()["daily"], [
+            ("CONFIRMED", Decimal("30.00"), 1, 3),
+            ("PENDING", Decimal("30.00"), 1, 3),
+        ])
+
+    def test_rebuild_matches_incremental_rollups(self):
+        item = OrderItem.objects.filter(order=self.orders[1]).get()
+        item.quantity = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+            reserve_stock(self.product.id, 1)
+            change_order_status(self.orders[1].id, "CANCELLED")
+        incremental = self._rollups()
+
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+
+        rebuilt = self._rollups()
+        for kind in rebuilt:
+            self.assertEqual(
+                [row for row in incremental[kind] if any(row[-3:])],
+                rebuilt[kind],
+            )
+
+
+@override_settings(AUDIT_LOG={"MODE": "sync"})
+class BulkOrderCreateTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="importer")
+        self.mug = Product.objects.create(name="Mug", total_stock=100, available_stock=100, reserved_stock=0, price=Decimal("4.00"))
+        self.pen = Product.objects.create(name="Pen", total_stock=100, available_stock=100, reserved_stock=0, price=Decimal("1.50"))
+
+    def _payload(self, count):
+        return {"orders": [
+            {
+                "user": self.user.id if i % 2 else None,
+                "items": [{"product": self.mug.id, "quantity": 2}, {"product": self.pen.id, "quantity": i + 1}],
+            }
+            for i in range(count)
+        ]}
+
+    def test_creates_orders_items_totals_rollups_and_audit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/create-order/bulk/", self._payload(3), content_type="application/json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["created"], 3)
+        self.assertEqual([order["total_price"] for order in response.json()["orders"]], ["9.50", "11.00", "12.50"])
+        self.assertEqual(OrderItem.objects.filter(unit_price__isnull=True).count(), 0)
+        self.assertEqual(AuditLog.objects.filter(action="Order Created").count(), 3)
+
+        incremental = sorted(DailySalesRollup.objects.values_list("status", "revenue", "order_count", "units"))
+        products = sorted(ProductSalesRollup.objects.values_list("product_id", "revenue", "order_count", "units"))
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+        self.assertEqual(incremental, sorted(DailySalesRollup.objects.values_list("status", "revenue", "order_count", "units")))
+        self.assertEqual(products, sorted(ProductSalesRollup.objects.values_list("product_id", "revenue", "order_count", "units")))
+
+    def test_query_count_does_not_grow_with_orders(self):
+        counts = []
+        for size in (2, 40):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post("/api/create-order/bulk/", self._payload(size), content_type="application/json")
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_unknown_product_rejects_everything(self):
+        payload = self._payload(2)
+        payload["orders"][1]["items"][0]["product"] = 999999
+
+        response = self.client.post("/api/create-order/bulk/", payload, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"], [{"index": 1, "item": 0, "reason": "Product not found"}])
+        self.assertFalse(Order.objects.exists())
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Retry", total_stock=10, available_stock=10, reserved_stock=0)
+        self.body = {"product": self.product.id, "quantity": 2}
+
+    def _post(self, key="k-1", body=None):
+        return self.client.post(
+            "/api/reservation/", body or self.body, content_type="application/json", headers={"Idempotency-Key": key},
+        )
+
+    def test_retry_replays_first_response_without_touching_product(self):
+        first = self._post()
+        with CaptureQueriesContext(connection) as queries:
+            retry = self._post()
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+        self.assertEqual(retry["X-Request-ID"], first["X-Request-ID"])
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertFalse([q for q in queries.captured_queries if "base_product" in q["sql"]])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 2)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_without_key_or_with_new_key_runs_again(self):
+        self._post("k-1")
+        self._post("k-2")
+        self.client.post("/api/reservation/", self.body, content_type="application/json")
+
+        self.assertEqual(Reservation.objects.count(), 3)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self._post()
+        response = self._post(body={"product": self.product.id, "quantity": 3})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_duplicate_waits_for_in_flight_request(self):
+        IdempotencyKey.objects.create(key="k-1", fingerprint=self._fingerprint(), request_id="first", expires_at=timezone.now() + timedelta(hours=1))
+
+        def first_request_finishes(seconds):
+            IdempotencyKey.objects.filter(key="k-1").update(response_status=201, response_body=b'{"done":true}', content_type="application/json")
+
+        with patch("base.services.idempotency.time.sleep", side_effect=first_request_finishes):
+            response = self._post()
+
+        self.assertEqual((response.status_code, response.content), (201, b'{"done":true}'))
+        self.assertEqual(response["X-Request-ID"], "first")
+        self.assertFalse(Reservation.objects.exists())
+
+    @override_settings(IDEMPOTENCY={"PATHS": ["/api/reservation/"], "WAIT_TIMEOUT": 0})
+    def test_duplicate_gives_up_after_wait_timeout_and_stale_keys_are_taken_over(self):
+        record = IdempotencyKey.objects.create(key="k-1", fingerprint=self._fingerprint(), request_id="first", expires_at=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(self._post().status_code, 409)
+
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self._post().status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get(key="k-1").response_status, 201)
+
+    def test_expired_keys_are_purged(self):
+        self._post("k-1")
+        self._post("k-2")
+        IdempotencyKey.objects.filter(key="k-1").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(purge_idempotency_keys(), "Idempotency Keys Purged, 1 Deleted")
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["k-2"])
+
+    def _fingerprint(self):
+        return idempotency.fingerprint(RequestFactory().post("/api/reservation/", self.body, content_type="application/json"))
+
+
+class TelemetryTests(TestCase):
+
+    def setUp(self):
+        # a fresh registry for every test
+        self.enterContext(override_settings(TELEMETRY={"ENABLED": True}))
+        self.orders = [Order.objects.create(status="PENDING") for _ in range(3)]
+
+    def _sample(self, name, *labels):
+        return metrics.collect().get((name, labels))
+
+    def test_server_timing_header_and_route_histograms(self):
+        response = self.client.get("/api/order-list/")
+
+        timing = dict(part.strip().split(";", 1) for part in response["Server-Timing"].split(","))
+        self.assertEqual(set(timing), {"total", "db", "lock", "serialize", "render"})
+        self.assertRegex(timing["db"], r'dur=[\d.]+;desc="[1-9]\d* queries"')
+
+        labels = ("api/order-list/", "GET")
+        self.assertEqual(self._sample("http_requests_total", *labels, "200"), 1)
+        self.assertEqual(self._sample("http_request_duration_seconds", *labels)[-1], 1)
+        self.assertGreater(self._sample("http_request_db_queries", *labels)[-2], 0)
+        self.assertGreater(self._sample("http_request_render_seconds", *labels)[-2], 0)
+
+    @override_settings(FAST_READ_PATH=False)
+    def test_serializer_time_is_recorded(self):
+        self.client.get(f"/api/order/{self.orders[0].id}/")
+        self.client.get("/api/reports/daily/")
+
+        self.assertGreater(self._sample("http_request_serialize_seconds", "api/order/<int:pk>/", "GET")[-2], 0)
+        self.assertGreater(self._sample("http_request_serialize_seconds", "api/reports/daily/", "GET")[-2], 0)
+        # timed in the views, DRF itself is left alone
+        from rest_framework.serializers import BaseSerializer
+        self.assertFalse(hasattr(BaseSerializer.data.fget, "telemetry"))
+
+    def test_metrics_endpoint_is_prometheus_text(self):
+        self.client.get("/api/order-list/")
+        self.client.get("/api/does-not-exist/")
+
+        body = self.client.get("/metrics").content.decode()
+
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        self.assertIn('http_request_duration_seconds_bucket{route="api/order-list/",method="GET",le="+Inf"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{route="api/order-list/",method="GET"} 1', body)
+        self.assertIn('http_requests_total{route="unmatched",method="GET",status="404"} 1', body)
+
+    @override_settings(
+        AUDIT_LOG={"MODE": "buffered", "BATCH_SIZE": 1000, "FLUSH_INTERVAL": 3600, "MAX_QUEUE": 2},
+        CATALOG_CACHE={"ENABLED": True, "BACKEND": "local"},
+    )
+    def test_audit_buffer_and_catalog_cache_are_exported(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                audit_log(actor="System", action="Test", obj_id=i, obj_type="Test")
+        self.client.get("/api/create-products/")
+        self.client.get("/api/create-products/")
+
+        body = self.client.get("/metrics").content.decode()
+
+        self.assertIn('audit_log_buffer_entries_total{outcome="enqueued"} 2', body)
+        self.assertIn('audit_log_buffer_entries_total{outcome="dropped"} 1', body)
+        self.assertIn("audit_log_buffer_queue_depth 2", body)
+        self.assertIn('catalog_cache_lookups_total{result="miss"} 2', body)
+        self.assertIn('catalog_cache_lookups_total{result="local_hit"} 2', body)
+        self.assertIn("catalog_cache_local_entries 2", body)
+
+    def test_multiprocess_mode_sums_worker_snapshots(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(TELEMETRY={"MODE": "multiprocess", "MULTIPROC_DIR": directory}))
+        with open(f"{directory}/999999.json", "w") as f:
+            json.dump([["http_requests_total", ["api/order-list/", "GET", "200"], 5]], f)
+
+        self.client.get("/api/order-list/")
+
+        self.assertEqual(self._sample("http_requests_total", "api/order-list/", "GET", "200"), 6)
+
+    def test_snapshot_flushes_are_serialized_and_never_raise(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(TELEMETRY={"MODE": "multiprocess", "MULTIPROC_DIR": directory, "FLUSH_INTERVAL": 0}))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda i: metrics.inc("http_requests_total", "api/order-list/", "GET", "200"), range(200)))
+        self.assertEqual(os.listdir(directory), [f"{os.getpid()}.json"])
+
+        with patch("base.services.metrics.os.replace", side_effect=FileNotFoundError):
+            self.assertEqual(self.client.get("/api/order-list/").status_code, 200)
+        self.assertEqual(os.listdir(directory), [f"{os.getpid()}.json"])
+
+    @override_settings(TELEMETRY={"ENABLED": False})
+    def test_disabled(self):
+        response = self.client.get("/api/order-list/")
+
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(metrics.collect(), {})
+
+
+class TaskTelemetryTests(TestCase):
+
+    def setUp(self):
+        self.enterContext(override_settings(TELEMETRY={"ENABLED": True}))
+        self.product = Product.objects.create(name="Task", total_stock=5, available_stock=5, reserved_stock=0)
+
+    def test_runtime_lag_and_lock_wait_per_task(self):
+        attempt_purchase_task.apply(args=[self.product.id], headers={"published_at": time.time() - 3})
+
+        task = "base.tasks.attempt_purchase_task"
+        samples = metrics.collect()
+        self.assertEqual(samples[("celery_tasks_total", (task, "SUCCESS"))], 1)
+        self.assertEqual(samples[("celery_task_runtime_seconds", (task, "SUCCESS"))][-1], 1)
+        self.assertEqual(samples[("celery_task_lock_wait_seconds", (task,))][-1], 1)
+        self.assertGreaterEqual(samples[("celery_task_queue_lag_seconds", (task,))][-2], 3)
+
+    def test_reservation_release_lag(self):
+        for source in ("sweeper", "task"):
+            reservation = reserve_stock(self.product.id, 1)
+            Reservation.objects.filter(id=reservation.id).update(expires_at=timezone.now() - timedelta(seconds=30))
+            if source == "sweeper":
+                sweep_expired_reservations()
+            else:
+                update_reservation(reservation.id)
+
+            lag = metrics.collect()[("reservation_release_lag_seconds", (source,))]
+            self.assertEqual(lag[-1], 1)
+            self.assertGreaterEqual(lag[-2], 30)
+            self.assertEqual(metrics.quantile("reservation_release_lag_seconds", lag, 0.5), 45)
+
+    def test_task_stats_summary(self):
+        reservation_cleanup.apply()
+        out = StringIO()
+
+        call_command("task_stats", "--once", stdout=out, stderr=StringIO())
+
+        self.assertRegex(out.getvalue(), r"base\.tasks\.reservation_cleanup +1 +0 +0 ")
+        self.assertIn("celery_task_runtime_seconds_count", self.client.get("/metrics").content.decode())
+
+    def test_queue_length_is_read_once_per_ttl(self):
+        self.enterContext(patch.object(task_telemetry, "_queue_lengths", (None, {})))
+        broker = self.enterContext(patch.object(task_telemetry, "_read_queue_lengths", side_effect=ConnectionError))
+
+        # a broker outage is cached like a reading: the next scrapes do not wait for it again
+        for _ in range(3):
+            self.assertEqual(metrics.read_gauge("celery_queue_length"), {})
+        self.assertEqual(broker.call_count, 1)
+
+        broker.side_effect, broker.return_value = None, {("celery",): 4}
+        with patch.object(task_telemetry.time, "monotonic", return_value=time.monotonic() + task_telemetry.QUEUE_LENGTH_TTL):
+            self.assertEqual(metrics.read_gauge("celery_queue_length"), {("celery",): 4})
+        self.assertEqual(broker.call_count, 2)
+
+
+class OrderBulkStatusTests(TestCase):
+
+    def setUp(self):
+        self.enterContext(override_settings(AUDIT_LOG={"MODE": "sync"}))
+        self.product = Product.objects.create(name="Bulk", total_stock=20, available_stock=10, reserved_stock=10, price=Decimal("4.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orders = [Order.objects.create(status=status) for status in ("PENDING", "PENDING", "PROCESSING", "DELIVERED")]
+            for order in self.orders:
+                OrderItem.objects.create(order=order, product=self.product, quantity=2)
+
+    def test_transition_table_is_shared(self):
+        self.assertEqual(ALLOWED_SOURCES["CANCELLED"], ("PENDING", "CONFIRMED"))
+        self.assertEqual(ALLOWED_SOURCES["PENDING"], ())
+        self.assertEqual(set(ORDER_TRANSITIONS), {status for status, _ in Order.STATUS})
+
+    def test_moves_allowed_orders_and_rejects_the_rest(self):
+        ids = [order.id for order in self.orders] + [999999]
+
+        result = bulk_change_order_status("CANCELLED", order_ids=ids, chunk_size=2)
+
+        self.assertEqual(result["changed"], [self.orders[0].id, self.orders[1].id])
+        self.assertEqual([(row["id"], row["status"]) for row in result["rejected"]], [
+            (self.orders[2].id, "PROCESSING"), (self.orders[3].id, "DELIVERED"), (999999, None),
+        ])
+        self.assertEqual(
+            list(Order.objects.order_by("id").values_list("status", flat=True)),
+            ["CANCELLED", "CANCELLED", "PROCESSING", "DELIVERED"],
+        )
+
+        # reserved units of both orders released with one UPDATE, audited in bulk
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock), (14, 6))
+        self.assertEqual(AuditLog.objects.filter(action="Order Updated", new_value={"status": "CANCELLED"}).count(), 2)
+
+    def test_confirming_sells_and_cancelling_restocks(self):
+        bulk_change_order_status("CONFIRMED", order_ids=[self.orders[0].id])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock, self.product.sold_stock), (10, 8, 2))
+
+        change_order_status(self.orders[0].id, "CANCELLED")
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock, self.product.sold_stock), (12, 8, 0))
+        self.product.clean()
+
+    def test_rollups_follow_bulk_moves(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_change_order_status("CONFIRMED", order_ids=[order.id for order in self.orders[:2]])
+
+        self.assertEqual(
+            sorted(DailySalesRollup.objects.filter(order_count__gt=0).values_list("status", "order_count", "units")),
+            [("CONFIRMED", 2, 4), ("DELIVERED", 1, 2), ("PROCESSING", 1, 2)],
+        )
+
+    def test_endpoint_with_filter(self):
+        response = self.client.post(
+            "/api/order/bulk-status/", {"status": "SHIPPED", "filter": {"status": "PROCESSING"}}, content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["changed"], 1)
+        self.assertEqual(response.json()["changed_ids"], [self.orders[2].id])
+        self.assertEqual(Order.objects.get(id=self.orders[2].id).status, "SHIPPED")
+
+    def test_endpoint_needs_ids_or_filter(self):
+        response = self.client.post("/api/order/bulk-status/", {"status": "SHIPPED"}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_single_order_update_uses_the_same_table(self):
+        response = self.client.patch(f"/api/order/{self.orders[0].id}/", {"status": "PROCESSING"}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            change_order_status(self.orders[0].id, "PROCESSING")
+
+
+class SettlementTests(TestCase):
+
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f"Settle {i}", total_stock=100, available_stock=50, reserved_stock=50)
+            for i in range(3)
+        ]
+
+    def _order(self, lines):
+        order = Order.objects.create(status="PENDING")
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity)
+        return order
+
+    def test_confirm_is_one_update_per_product(self):
+        counts = []
+        for lines in (2, 50):
+            order = self._order([(self.products[i % 2], 1) for i in range(lines)])
+            with CaptureQueriesContext(connection) as queries:
+                confirm_reserved_stock(order)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        for product in Product.objects.filter(id__in=[p.id for p in self.products[:2]]):
+            self.assertEqual((product.reserved_stock, product.sold_stock), (24, 26))
+            product.clean()
+
+    def test_multi_order_mode_nets_movements(self):
+        first = self._order([(self.products[0], 5), (self.products[1], 1)])
+        second = self._order([(self.products[0], 3), (self.products[2], 2)])
+        third = self._order([(self.products[1], 4)])
+        confirm_reserved_stock(third)
+
+        settlement = Settlement().add([first.id], "confirm").add([second.id], "release").add([third.id], "restock")
+        self.assertEqual(settlement.deltas(), {
+            self.products[0].id: {"available_stock": 3, "reserved_stock": -8, "sold_stock": 5},
+            self.products[1].id: {"available_stock": 4, "reserved_stock": -1, "sold_stock": -3},
+            self.products[2].id: {"available_stock": 2, "reserved_stock": -2},
+        })
+
+        with CaptureQueriesContext(connection) as queries:
+            settlement.apply()
+        product_updates = [query["sql"] for query in queries if query["sql"].startswith('UPDATE "base_product"')]
+        # one UPDATE per product, in primary key order
+        self.assertEqual(len(product_updates), 3)
+        self.assertEqual(
+            [int(re.search(r'"base_product"."id" = (\d+)', sql).group(1)) for sql in product_updates],
+            sorted(product.id for product in self.products),
+        )
+
+        for product in Product.objects.all():
+            product.clean()
+
+    def test_release_of_sharded_product_goes_to_bucket_zero(self):
+        enable_sharding(self.products[0].id, buckets=2)
+        order = self._order([(self.products[0], 4)])
+
+        release_reserved_stock(order)
+
+        self.assertEqual(bucket_totals(self.products[0].id), {"available_stock": 54, "reserved_stock": 46})
+        self.assertEqual(Product.objects.get(id=self.products[0].id).sold_stock, 0)
+
+    def test_unreserved_units_cannot_be_settled(self):
+        product = Product.objects.create(name="Settle empty", total_stock=10, available_stock=10, reserved_stock=0)
+        order = self._order([(self.products[0], 1), (product, 3)])
+
+        for settle in (confirm_reserved_stock, release_reserved_stock):
+            with self.assertRaises(ValueError):
+                settle(order)
+
+        # the guarded UPDATE of the second product failed, the first one rolled back with it
+        for product, levels in ((self.products[0], (50, 50, 0)), (product, (10, 0, 0))):
+            product.refresh_from_db()
+            self.assertEqual((product.available_stock, product.reserved_stock, product.sold_stock), levels)
+
+    def test_settled_units_retire_their_reservations(self):
+        product = Product.objects.create(name="Settle reserved", total_stock=10, available_stock=10, reserved_stock=0)
+        first, second = reserve_stock(product.id, 2), reserve_stock(product.id, 3)
+
+        confirm_reserved_stock(self._order([(product, 4)]))
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        sweep_expired_reservations()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.is_active, second.is_active, second.quantity), (False, False, 1))
+        product.refresh_from_db()
+        # only the unit of the shrunk reservation went back on sale
+        self.assertEqual((product.available_stock, product.reserved_stock, product.sold_stock), (6, 0, 4))
+        self.assertEqual(AuditLog.objects.filter(action="Reservation Consumed").count(), 2)
+
+    def test_sharded_reservation_is_settled_in_its_bucket(self):
+        product = Product.objects.create(name="Settle buckets", total_stock=8, available_stock=8, reserved_stock=0)
+        enable_sharding(product.id, buckets=4)
+        reservation = reserve_stock(product.id, 2)
+
+        release_reserved_stock(self._order([(product, 2)]))
+
+        self.assertEqual(StockBucket.objects.get(id=reservation.bucket_id).reserved_stock, 0)
+        self.assertEqual(bucket_totals(product.id), {"available_stock": 8, "reserved_stock": 0})
+        self.assertFalse(Reservation.objects.get(id=reservation.id).is_active)
+
+    def test_purchase_sells_a_unit(self):
+        sharded = Product.objects.create(name="Settle sharded", total_stock=3, available_stock=3, reserved_stock=0)
+        enable_sharding(sharded.id, buckets=2)
+
+        for product in (self.products[0], sharded):
+            self.assertEqual(attempt_purchase_task.apply(args=[product.id]).get(), "SUCCESS")
+
+        product = Product.objects.prefetch_related("buckets").get(id=self.products[0].id)
+        self.assertEqual((product.total_stock, product.available_stock, product.reserved_stock, product.sold_stock), (100, 49, 50, 1))
+        product.clean()
+        sharded = Product.objects.prefetch_related("buckets").get(id=sharded.id)
+        self.assertEqual(sharded.sold_stock, 1)
+        sharded.clean()
+
+
+# Query budgets: upper bounds that must hold whatever the number of rows
+# (inside the request / call: the rollup rows written after commit are not counted)
+ENDPOINT_QUERY_BUDGETS = {
+    "create-products": 4,
+    "reservation-create": 10,
+    "reservation-retrieve": 1,
+    "create-order": 2,
+    "create-order-bulk": 6,
+    "order-item-create": 7,
+    "order-update": 1,
+    "order-list": 1,
+    "order-export": 1,
+    "report-daily": 1,
+    "report-products": 1,
+    "report-users": 1,
+    "audit-log": 1,
+    "audit-log-archive-list": 0,
+    "audit-log-archive": 0,
+    "audit-log-history": 1,
+    "async-products": 4,
+    "async-reservation-retrieve": 1,
+    "async-order-detail": 1,
+    "async-order-list": 1,
+    "async-audit-log": 1,
+    "order-bulk-status": 19,
+}
+
+SERVICE_QUERY_BUDGETS = {
+    "reserve_stock": 5,
+    "reserve_stock_sharded": 7,
+    "reserve_stock_batch": 5,
+    "sweep_expired_reservations": 14,
+    "create_orders_bulk": 6,
+    "change_order_status": 16,
+    "bulk_change_order_status": 17,
+    "get_catalog": 4,
+    "load_stock": 2,
+    "rebalance_buckets": 5,
+}
+
+
+@override_settings(AUDIT_LOG={"MODE": "sync"}, CATALOG_CACHE={"ENABLED": False}, IDEMPOTENCY={"ENABLED": False})
+class QueryBudgetTests(TestCase):
+    """
+    Queries per request / service call, measured with a small data set and
+    again after it has grown: the count must not change with the number of
+    rows and must stay within the budget. Every route of base/urls.py needs
+    an entry in ENDPOINT_QUERY_BUDGETS.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username="budget")
+        self.products = [
+            Product.objects.create(name=f"Budget {i}", total_stock=1000, available_stock=1000, reserved_stock=0, price=Decimal("3.00"))
+            for i in range(2)
+        ]
+        self.sharded = Product.objects.create(name="Budget sharded", total_stock=100, available_stock=100, reserved_stock=0)
+        enable_sharding(self.sharded.id, buckets=4)
+        self._grow(2)
+        self.order = Order.objects.earliest("id")
+        self.reservation = Reservation.objects.earliest("created_at")
+
+    def _grow(self, count):
+        for i in range(count):
+            order = Order.objects.create(status="PENDING", user=self.user if i % 2 else None)
+            for product in self.products:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+            reserve_stock(self.products[i % 2].id, 1)
+            reserve_stock(self.sharded.id, 1)
+
+    def _queries(self, call):
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+            if getattr(response, "streaming", False):
+                b"".join(response.streaming_content)
+        if hasattr(response, "status_code"):
+            self.assertLess(response.status_code, 400, response)
+        return len(queries)
+
+    def _check(self, cases, budgets):
+        small = {name: self._queries(call) for name, call in cases.items()}
+        self._grow(20)
+        large = {name: self._queries(call) for name, call in cases.items()}
+
+        for name in cases:
+            with self.subTest(name):
+                self.assertEqual(large[name], small[name], f"{name}: {small[name]} queries with few rows, {large[name]} with more")
+                self.assertLessEqual(small[name], budgets[name], f"{name}: {small[name]} queries, budget {budgets[name]}")
+
+    def _endpoint_cases(self):
+        get, post, patch = self.client.get, self.client.post, self.client.patch
+        json_body = {"content_type": "application/json"}
+        order = self.order.id
+
+        def async_get(path):
+            return lambda: async_to_sync(self.async_client.get)(path)
+
+        return {
+            "create-products": lambda: get("/api/create-products/"),
+            "reservation-create": lambda: post("/api/reservation/", {"product": self.products[0].id, "quantity": 1}, **json_body),
+            "reservation-retrieve": lambda: get(f"/api/reservation/{self.reservation.id}/"),
+            "create-order": lambda: post("/api/create-order/", {"status": "PENDING"}, **json_body),
+            "create-order-bulk": lambda: post("/api/create-order/bulk/", {"orders": [
+                {"items": [{"product": self.products[0].id, "quantity": 1}]} for _ in range(3)
+            ]}, **json_body),
+            "order-item-create": lambda: post("/api/order-item/", {"order": order, "product": self.products[1].id, "quantity": 2}, **json_body),
+            "order-update": lambda: get(f"/api/order/{order}/"),
+            "order-bulk-status": lambda: post("/api/order/bulk-status/", {"status": "CONFIRMED", "filter": {"status": "PENDING"}}, **json_body),
+            "order-list": lambda: get("/api/order-list/", {"ordering": "-total_price", "page_size": 10}),
+            "order-export": lambda: get("/api/order-export/", {"kind": "items"}),
+            "report-daily": lambda: get("/api/reports/daily/"),
+            "report-products": lambda: get("/api/reports/products/"),
+            "report-users": lambda: get("/api/reports/users/"),
+            "audit-log": lambda: get("/api/audit-log/", {"page_size": 10}),
+            "audit-log-archive-list": lambda: get("/api/audit-log/archive/"),
+            "audit-log-archive": lambda: get("/api/audit-log/archive/2000-01/"),
+            "audit-log-history": lambda: get(f"/api/audit-log/Order/{order}/"),
+            "async-products": async_get("/api/async/create-products/"),
+            "async-reservation-retrieve": async_get(f"/api/async/reservation/{self.reservation.id}/"),
+            "async-order-detail": async_get(f"/api/async/order/{order}/"),
+            "async-order-list": async_get("/api/async/order-list/?page_size=10"),
+            "async-audit-log": async_get("/api/async/audit-log/?page_size=10"),
+        }
+
+    def test_every_route_has_a_budget(self):
+        from base.urls import urlpatterns
+
+        self.assertEqual({pattern.name for pattern in urlpatterns}, set(ENDPOINT_QUERY_BUDGETS))
+
+    def test_endpoint_query_budgets(self):
+        cases = self._endpoint_cases()
+        # the archive segment does not exist: a 404 without queries is the expected answer
+        archive = cases.pop("audit-log-archive")
+        self.assertEqual(archive().status_code, 404)
+
+        self._check(cases, ENDPOINT_QUERY_BUDGETS)
+
+    def test_service_query_budgets(self):
+        cases = {
+            "reserve_stock": lambda: reserve_stock(self.products[0].id, 1),
+            "reserve_stock_sharded": lambda: reserve_stock(self.sharded.id, 1),
+            "reserve_stock_batch": lambda: reserve_stock_batch([{"product": p.id, "quantity": 1} for p in self.products]),
+            "sweep_expired_reservations": lambda: (
+                Reservation.objects.filter(id=reserve_stock(self.products[1].id, 1).id).update(expires_at=timezone.now() - timedelta(minutes=1)),
+                sweep_expired_reservations(),
+            ),
+            "create_orders_bulk": lambda: create_orders_bulk([{"status": "PENDING", "user": None, "items": [{"product": self.products[0].id, "quantity": 1}]}] * 3),
+            "get_catalog": catalog_cache.get_catalog,
+            "load_stock": catalog_cache.load_stock,
+            "rebalance_buckets": lambda: rebalance_buckets(self.sharded.id),
+        }
+        self._check(cases, SERVICE_QUERY_BUDGETS)
+
+        # status changes need fresh orders: more items, more orders, a bigger table
+        def pending_orders(count, items):
+            orders = [Order.objects.create(status="PENDING") for _ in range(count)]
+            for order in orders:
+                for i in range(items):
+                    OrderItem.objects.create(order=order, product=self.products[i % 2], quantity=1)
+            for i, product in enumerate(self.products):
+                reserve_stock(product.id, count * len(range(i, items, 2)))
+            return [order.id for order in orders]
+
+        status_cases = {
+            "change_order_status": (lambda size: pending_orders(1, size), lambda ids: change_order_status(ids[0], "CANCELLED")),
+            "bulk_change_order_status": (lambda size: pending_orders(size, size), lambda ids: bulk_change_order_status("CONFIRMED", order_ids=ids)),
+        }
+        for name, (prepare, call) in status_cases.items():
+            counts = []
+            for size in (2, 10):
+                self._grow(size)
+                ids = prepare(size)
+                with CaptureQueriesContext(connection) as queries:
+                    call(ids)
+                counts.append(len(queries))
+            with self.subTest(name):
+                self.assertEqual(counts[0], counts[1])
+                self.assertLessEqual(counts[0], SERVICE_QUERY_BUDGETS[name])
+
+
+PERF_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf_baseline.json")
+
+
+def _calibration():
+    # fixed pure-Python workload: timings are stored relative to it, so the
+    # baseline survives a faster or slower machine
+    total = 0
+    for i in range(20000):
+        total += len(str(i * 7))
+    return total
+
+
+@skipIf(os.environ.get("PERF_SKIP"), "PERF_SKIP is set")
+class PerfRegressionTests(SimpleTestCase):
+    """
+    Microbenchmarks of the serializers, the filters and RequestIDJSONRenderer
+    on in-memory rows (no database), compared with base/perf_baseline.json.
+
+    Each case is the best of a few repeats divided by the calibration loop;
+    a case fails when it is more than PERF_TOLERANCE (default 2.0) times its
+    baseline. PERF_UPDATE_BASELINE=1 rewrites the baseline, PERF_SKIP=1 skips.
+    """
+
+    ROWS = 200
+    REPEATS = 7
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        created = timezone.now()
+        cls.products = [
+            Product(id=i, name=f"Product {i}", total_stock=100, available_stock=90, reserved_stock=10, price=Decimal("9.99"))
+            for i in range(cls.ROWS)
+        ]
+        cls.orders = [Order(id=i, status="PENDING", created_at=created, total_price=Decimal("19.98")) for i in range(cls.ROWS)]
+        cls.reservations = [
+            Reservation(product_id=i, quantity=1, is_active=True, created_at=created, expires_at=created) for i in range(cls.ROWS)
+        ]
+        cls.audit_rows = [
+            AuditLog(id=i, object_type="Order", object_id=str(i), action="Order Created", actor="system", timestamp=created, new_value={"status": "PENDING"})
+            for i in range(cls.ROWS)
+        ]
+
+    def _cases(self):
+        factory = RequestFactory()
+        request = factory.get("/api/order-list/")
+        request.request_id = "perf"
+        renderer = RequestIDJSONRenderer()
+        rows = OrderSerializer(self.orders, many=True).data
+        params = {"status": "PENDING", "start_date": "2024-01-01T00:00:00Z", "end_date": "2024-12-31T00:00:00Z", "min_total": "10", "max_total": "100"}
+
+        return {
+            "ProductSerializer": lambda: ProductSerializer(self.products, many=True).data,
+            "OrderSerializer": lambda: OrderSerializer(self.orders, many=True).data,
+            "ReservationSerializer": lambda: ReservationSerializer(self.reservations, many=True).data,
+            "AuditLogSerializer": lambda: AuditLogSerializer(self.audit_rows, many=True).data,
+            "OrderFilter": lambda: [str(OrderFilter(params, queryset=Order.objects.all()).qs.query) for _ in range(20)],
+            "AuditLogFilter": lambda: [
+                str(AuditLogFilter({"object_type": "Order", "action": "Order Created", "start": "2024-01-01T00:00:00Z"}, queryset=AuditLog.objects.all()).qs.query)
+                for _ in range(20)
+            ],
+            "RequestIDJSONRenderer": lambda: renderer.render(
+                {"results": rows, "next": None}, renderer_context={"request": request, "response": None},
+            ),
+        }
+
+    def _measure(self, call):
+        best = float("inf")
+        for _ in range(self.REPEATS):
+            started = time.perf_counter()
+            call()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def test_against_baseline(self):
+        calibration = self._measure(_calibration)
+        results = {name: round(self._measure(call) / calibration, 3) for name, call in self._cases().items()}
+
+        if os.environ.get("PERF_UPDATE_BASELINE"):
+            with open(PERF_BASELINE, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+            return
+
+        with open(PERF_BASELINE) as f:
+            baseline = json.load(f)
+        tolerance = float(os.environ.get("PERF_TOLERANCE", "2.0"))
+
+        self.assertEqual(set(results), set(baseline), "cases changed: run with PERF_UPDATE_BASELINE=1")
+        for name, value in results.items():
+            with self.subTest(name):
+                self.assertLessEqual(
+                    value, baseline[name] * tolerance,
+                    f"{name}: {value:.3f} x calibration, baseline {baseline[name]:.3f} (tolerance {tolerance}x)",
+                )
+
+
 class OrderStateMachineTests(TestCase):
 
     def test_valid_transition(self):
-        order = Order.objects.create(status="pending")
-        change_order_status(order.id, "confirmed")
-        self.assertEqual(order.status, "confirmed")
+        order = Order.objects.create(status="PENDING")
+        change_order_status(order.id, "CONFIRMED")
+        order.refresh_from_db()
+        self.assertEqual(order.status, "CONFIRMED")
 
     def test_invalid_transition_raises_error(self):
-        order = Order.objects.create(status="pending")
+        order = Order.objects.create(status="PENDING")
 
         with self.assertRaises(ValueError):
-            change_order_status(order.id, "shipped")
+            change_order_status(order.id, "SHIPPED")
+        order.refresh_from_db()
+        self.assertEqual(order.status, "PENDING")
 
     def test_cannot_cancel_after_shipped(self):
-        order = Order.objects.create(status="shipped")
+        order = Order.objects.create(status="SHIPPED")
 
         with self.assertRaises(ValueError):
-            change_order_status(order.id, "cancelled")
+            change_order_status(order.id, "CANCELLED")
+        order.refresh_from_db()
+        self.assertEqual(order.status, "SHIPPED")
 
     def test_delivered_is_immutable(self):
-        order = Order.objects.create(status="delivered")
+        order = Order.objects.create(status="DELIVERED")
+
+        with self.assertRaises(ValueError):
+            change_order_status(order.id, "PROCESSING")
+        order.refresh_from_db()
+        self.assertEqual(order.status, "DELIVERED")
+
+    def test_patch_settles_stock(self):
+        product = Product.objects.create(name="Patched", total_stock=10, available_stock=7, reserved_stock=3, price=Decimal("1.00"))
+        order = Order.objects.create(status="PENDING")
+        OrderItem.objects.create(order=order, product=product, quantity=3)
+
+        response = self.client.patch(f"/api/order/{order.id}/", {"status": "CONFIRMED"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual((product.available_stock, product.reserved_stock, product.sold_stock), (7, 0, 3))
+
+        response = self.client.patch(f"/api/order/{order.id}/", {"status": "CANCELLED"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual((product.available_stock, product.reserved_stock, product.sold_stock), (10, 0, 0))
+        order.refresh_from_db()
+        self.assertEqual(order.status, "CANCELLED")
+
+    def test_patch_to_the_same_status_is_refused(self):
+        order = Order.objects.create(status="PENDING")
 
+        response = self.client.patch(f"/api/order/{order.id}/", {"status": "PENDING"}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
         with self.assertRaises(ValueError):
-            change_order_status(order.id, "processing")
+            change_order_status(order.id, "PENDING")
+
+    def test_patch_confirm_without_reservation_is_refused(self):
+        product = Product.objects.create(name="Unreserved", total_stock=10, available_stock=10, reserved_stock=0, price=Decimal("1.00"))
+        order = Order.objects.create(status="PENDING")
+        OrderItem.objects.create(order=order, product=product, quantity=3)
+
+        response = self.client.patch(f"/api/order/{order.id}/", {"status": "CONFIRMED"}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        product.refresh_from_db()
+        self.assertEqual((product.available_stock, product.reserved_stock, product.sold_stock), (10, 0, 0))
+        order.refresh_from_db()
+        self.assertEqual(order.status, "PENDING")
+
+    def test_confirmed_units_survive_the_sweeper(self):
+        product = Product.objects.create(name="Swept", total_stock=10, available_stock=10, reserved_stock=0, price=Decimal("1.00"))
+        reservation = reserve_stock(product.id, 3)
+        order = Order.objects.create(status="PENDING")
+        OrderItem.objects.create(order=order, product=product, quantity=3)
+
+        response = self.client.patch(f"/api/order/{order.id}/", {"status": "CONFIRMED"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+        Reservation.objects.filter(id=reservation.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(sweep_expired_reservations(), 0)
+        self.assertEqual(update_reservation(reservation.id)["status"], "Reservation Already Released")
+
+        product.refresh_from_db()
+        self.assertEqual((product.available_stock, product.reserved_stock, product.sold_stock), (7, 0, 3))
 
 
@@ -1,13 +1,29 @@
 from django.urls import path
-from .views import ReservationCreateView, OrderUpdateView, OrderListView, CreateProductsView, OrderCreateView, OrderItemCreateView, RetrieveReservationView, AuditLogView
+from .async_views import AsyncOrderListView, AsyncOrderDetailView, AsyncReservationDetailView, AsyncProductListView, AsyncAuditLogView
+from .views import ReservationCreateView, OrderUpdateView, OrderBulkCreateView, OrderBulkStatusView, OrderListView, OrderExportView, CreateProductsView, OrderCreateView, OrderItemCreateView, RetrieveReservationView, AuditLogView, AuditLogHistoryView, AuditLogArchiveListView, AuditLogArchiveView, DailySalesReportView, ProductSalesReportView, UserSalesReportView
 
 urlpatterns = [
     path('create-products/', CreateProductsView.as_view(), name='create-products'),
     path('reservation/', ReservationCreateView.as_view(), name='reservation-create'),
     path('reservation/<uuid:pk>/', RetrieveReservationView.as_view(), name='reservation-retrieve'),
     path('create-order/', OrderCreateView.as_view(), name='create-order'),
+    path('create-order/bulk/', OrderBulkCreateView.as_view(), name='create-order-bulk'),
     path('order-item/', OrderItemCreateView.as_view(), name='order-item-create'),
     path('order/<int:pk>/', OrderUpdateView.as_view(), name='order-update'),
+    path('order/bulk-status/', OrderBulkStatusView.as_view(), name='order-bulk-status'),
     path('order-list/', OrderListView.as_view(), name='order-list'),
+    path('order-export/', OrderExportView.as_view(), name='order-export'),
+    path('reports/daily/', DailySalesReportView.as_view(), name='report-daily'),
+    path('reports/products/', ProductSalesReportView.as_view(), name='report-products'),
+    path('reports/users/', UserSalesReportView.as_view(), name='report-users'),
     path('audit-log/', AuditLogView.as_view(), name='audit-log'),
+    path('audit-log/archive/', AuditLogArchiveListView.as_view(), name='audit-log-archive-list'),
+    path('audit-log/archive/<str:month>/', AuditLogArchiveView.as_view(), name='audit-log-archive'),
+    path('audit-log/<str:object_type>/<str:object_id>/', AuditLogHistoryView.as_view(), name='audit-log-history'),
+    # native async read endpoints (ASGI), same responses as their sync counterparts
+    path('async/create-products/', AsyncProductListView.as_view(), name='async-products'),
+    path('async/reservation/<uuid:pk>/', AsyncReservationDetailView.as_view(), name='async-reservation-retrieve'),
+    path('async/order/<int:pk>/', AsyncOrderDetailView.as_view(), name='async-order-detail'),
+    path('async/order-list/', AsyncOrderListView.as_view(), name='async-order-list'),
+    path('async/audit-log/', AsyncAuditLogView.as_view(), name='async-audit-log'),
 ]
\ No newline at end of file
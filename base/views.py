@@ -1,84 +1,173 @@
 from rest_framework.views import APIView
 from rest_framework import generics
-from .tasks import audit_log
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Product, Reservation, Order, OrderItem
-from .serializers import ProductSerializer, ReservationSerializer, OrderSerializer, OrderItemSerializer
+from .serializers import ProductSerializer, ReservationSerializer, ReservationBatchSerializer, OrderSerializer, OrderItemSerializer, OrderBulkCreateSerializer, OrderBulkStatusSerializer
+from .services.reservation_service import BatchReservationError
+from .services.order_service import BulkOrderError, bulk_change_order_status, change_order_status
+from .services import catalog_cache
+from .conditional import ConditionalListMixin, ConditionalRetrieveMixin, etag_matches, make_etag, not_modified
+from .fastpath import FastReadMixin
+from . import fastpath
+from .services.telemetry import timed
+
+# fast path projections, in OrderSerializer / ReservationSerializer / AuditLogSerializer field order
+ORDER_FAST_FIELDS = ['id', 'status', 'created_at', 'user', ('get_total_price', 'total_price', float), 'total_price']
+RESERVATION_FAST_FIELDS = ['id', 'quantity', 'expires_at', 'created_at', 'updated_at', 'is_active', 'product', 'bucket']
+AUDIT_LOG_FAST_FIELDS = ['id', 'actor', 'action', 'object_type', 'object_id', 'old_value', 'new_value', 'timestamp']
+from django.http import HttpResponse, StreamingHttpResponse
+
+
+class TimedSerializerMixin:
+    """
+    DRF's list() / create() with the serializer output read under
+    timed('serialize'), so it shows up as the request's serialize time.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        with timed('serialize'):
+            data = self.get_serializer(rows, many=True).data
+        return self.get_paginated_response(data) if page is not None else Response(data)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        with timed('serialize'):
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
 
 # Create your views here.
-class CreateProductsView(generics.ListCreateAPIView):
-    queryset = Product.objects.all()
+class CreateProductsView(TimedSerializerMixin, generics.ListCreateAPIView):
+    queryset = Product.objects.prefetch_related('buckets')
     serializer_class = ProductSerializer    
 
-class ReservationCreateView(generics.ListCreateAPIView):
+    # served from the versioned catalog cache, see services/catalog_cache.py;
+    # the cache versions double as the ETag
+    def list(self, request, *args, **kwargs):
+        versions = catalog_cache.get_versions()
+        if versions is None:
+            return self.catalog_response(request, catalog_cache.get_catalog())
+
+        etag = make_etag('catalog', *versions)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = self.catalog_response(request, catalog_cache.get_catalog(versions))
+        response['ETag'] = etag
+        return response
+
+    def catalog_response(self, request, catalog):
+        # the cached rows are already plain dicts, only the encoder differs
+        if fastpath.is_enabled(request):
+            return fastpath.json_response(request, catalog)
+        return Response(catalog)
+
+class ReservationCreateView(TimedSerializerMixin, generics.ListCreateAPIView):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
 
-class RetrieveReservationView(generics.RetrieveAPIView):
+    # A list body (or {"items": [...]}) reserves a whole cart in one call
+    def create(self, request, *args, **kwargs):
+        if isinstance(request.data, list) or 'items' in request.data:
+            items = request.data if isinstance(request.data, list) else request.data['items']
+            serializer = ReservationBatchSerializer(data={'items': items})
+            serializer.is_valid(raise_exception=True)
+            try:
+                serializer.save()
+            except BatchReservationError as e:
+                return Response({"errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+            with timed('serialize'):
+                data = serializer.data
+            return Response(data, status=status.HTTP_201_CREATED)
+
+        return super().create(request, *args, **kwargs)
+
+class RetrieveReservationView(FastReadMixin, ConditionalRetrieveMixin, generics.RetrieveAPIView):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
+    fast_fields = RESERVATION_FAST_FIELDS
 
-class OrderCreateView(generics.ListCreateAPIView):
+class OrderCreateView(TimedSerializerMixin, generics.ListCreateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
 
-class OrderItemCreateView(generics.ListCreateAPIView):
+# Many orders with nested items in one request (imports)
+class OrderBulkCreateView(APIView):
+    def post(self, request):
+        serializer = OrderBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            serializer.save()
+        except BulkOrderError as e:
+            return Response({"errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        with timed('serialize'):
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+class OrderBulkStatusView(APIView):
+    # set-based transitions: chunked UPDATE ... WHERE status IN (allowed sources), see order_service
+    def post(self, request):
+        serializer = OrderBulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if 'filter' in data:
+            filterset = OrderFilter(data['filter'], queryset=Order.objects.all())
+            if not filterset.is_valid():
+                return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+            result = bulk_change_order_status(data['status'], queryset=filterset.qs)
+        else:
+            result = bulk_change_order_status(data['status'], order_ids=data['ids'])
+
+        return Response({
+            "status": data['status'],
+            "changed": len(result["changed"]),
+            "changed_ids": result["changed"],
+            "rejected": result["rejected"],
+        })
+
+class OrderItemCreateView(TimedSerializerMixin, generics.ListCreateAPIView):
     queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
 
-class OrderUpdateView(generics.RetrieveUpdateAPIView):
+class OrderUpdateView(FastReadMixin, ConditionalRetrieveMixin, generics.RetrieveUpdateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    fast_fields = ORDER_FAST_FIELDS
 
     lookup_field = 'pk'
 
 
+    # stock settlement, rollups and audit entries all happen in change_order_status
     def update(self, request, *args, **kwargs):
-
-        ALLOWED_TRANSITIONS = {
-            "PENDING": {"CONFIRMED", "CANCELLED"},
-            "CONFIRMED": {"PROCESSING", "CANCELLED"},
-            "PROCESSING": {"SHIPPED"},
-            "SHIPPED": {"DELIVERED"},
-            "DELIVERED": set(),
-            "CANCELLED": set(),
-        }
-
         instance = self.get_object()
         current_status = instance.status
-
         new_status = request.data.get('status', current_status)
 
-        if new_status in ALLOWED_TRANSITIONS[current_status]:
-
-            instance.status = new_status
-            instance.save()
-
-
-
-            audit_log(
-                actor="System",
-                action="Order Status Updated",
-                obj_id= instance.id,
-                obj_type=instance.__class__.__name__,
-                old= current_status ,
-                new=new_status
-            )
-
+        try:
+            instance = change_order_status(instance.pk, new_status)
+        except ValueError:
             return Response(
                 {
-                    'order':OrderSerializer(instance).data,
-                    'new_status': new_status,
-                    'current_status': current_status
-                }
+                    "error": "Invalid status transition",
+                },
+                status=status.HTTP_400_BAD_REQUEST
             )
 
+        with timed('serialize'):
+            data = OrderSerializer(instance).data
         return Response(
             {
-                "error": "Invalid status transition", 
-            }, 
-            status=status.HTTP_400_BAD_REQUEST
+                'order': data,
+                'new_status': new_status,
+                'current_status': current_status
+            }
         )
 
 
@@ -88,28 +177,134 @@ from rest_framework.filters import OrderingFilter
 from .serializers import OrderFilter
 from django.db.models import Sum, F
 
-from rest_framework.pagination import CursorPagination
-
-class OrderCursorPagination(CursorPagination):
-    page_size = 2
-    cursor_query_param = 'cursor'
-    ordering = '-created_at'
+from .pagination import OrderKeysetPagination, DailySalesKeysetPagination, ProductSalesKeysetPagination, UserSalesKeysetPagination
 
 
-class OrderListView(generics.ListAPIView):
+class OrderListView(FastReadMixin, ConditionalListMixin, generics.ListAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
-    pagination_class = OrderCursorPagination
+    fast_fields = ORDER_FAST_FIELDS
+    # keyset pages on (created_at, id) or (total_price, id), either direction
+    pagination_class = OrderKeysetPagination
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_class = OrderFilter
     ordering_fields = ['created_at', 'total_price']
     ordering = ['-created_at']
 
     def get_queryset(self):
-      return Order.objects.select_related('user').prefetch_related('items__product').all()
+      return Order.objects.select_related('user').all()
+
+from .services import export_service
+
+
+# Full order history as NDJSON or CSV, same filters as the order list
+class OrderExportView(APIView):
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        kind = request.query_params.get('kind', 'orders')
+        if output not in ('ndjson', 'csv') or kind not in ('orders', 'items'):
+            return Response({"error": "output must be ndjson or csv, kind orders or items"}, status=status.HTTP_400_BAD_REQUEST)
+
+        filterset = OrderFilter(request.query_params, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        columns, rows = export_service.export_rows(filterset.qs, kind=kind)
+        if output == 'csv':
+            response = StreamingHttpResponse(export_service.iter_csv(columns, rows), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(export_service.iter_ndjson(columns, rows), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{output}"'
+        return response
+
+from .models import DailySalesRollup, ProductSalesRollup, UserSalesRollup
+from .serializers import DailySalesRollupSerializer, ProductSalesRollupSerializer, UserSalesRollupSerializer, DailySalesRollupFilter
+
+
+# Reporting endpoints, read from the rollup tables only
+class DailySalesReportView(TimedSerializerMixin, generics.ListAPIView):
+    queryset = DailySalesRollup.objects.all()
+    serializer_class = DailySalesRollupSerializer
+    pagination_class = DailySalesKeysetPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = DailySalesRollupFilter
+
+
+class ProductSalesReportView(TimedSerializerMixin, generics.ListAPIView):
+    queryset = ProductSalesRollup.objects.all()
+    serializer_class = ProductSalesRollupSerializer
+    pagination_class = ProductSalesKeysetPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['status', 'product']
+
+
+class UserSalesReportView(TimedSerializerMixin, generics.ListAPIView):
+    queryset = UserSalesRollup.objects.all()
+    serializer_class = UserSalesRollupSerializer
+    pagination_class = UserSalesKeysetPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['status', 'user']
 
 from .models import AuditLog
-from .serializers import AuditLogSerializer
-class AuditLogView(generics.ListAPIView):
+from .serializers import AuditLogSerializer, AuditLogFilter
+from .pagination import AuditLogKeysetPagination
+class AuditLogView(FastReadMixin, TimedSerializerMixin, generics.ListAPIView):
     queryset = AuditLog.objects.all()
     serializer_class = AuditLogSerializer
+    fast_fields = AUDIT_LOG_FAST_FIELDS
+    pagination_class = AuditLogKeysetPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = AuditLogFilter
+
+
+# History of one object, served by the (object_type, object_id, timestamp, id) index
+class AuditLogHistoryView(FastReadMixin, TimedSerializerMixin, generics.ListAPIView):
+    serializer_class = AuditLogSerializer
+    fast_fields = AUDIT_LOG_FAST_FIELDS
+    pagination_class = AuditLogKeysetPagination
+
+    def get_queryset(self):
+        return AuditLog.objects.filter(
+            object_type=self.kwargs['object_type'],
+            object_id=self.kwargs['object_id'],
+        )
+
+
+
+import json
+import re
+from django.core.serializers.json import DjangoJSONEncoder
+from .services import audit_archive
+
+
+class AuditLogArchiveListView(APIView):
+    def get(self, request):
+        return Response({"segments": audit_archive.list_segments()})
+
+
+# Streams an archived month back as NDJSON, optionally narrowed to one object
+class AuditLogArchiveView(APIView):
+    def get(self, request, month):
+        if not re.fullmatch(r"\d{4}-\d{2}", month) or month not in audit_archive.list_segments():
+            return Response({"error": "Archive segment not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        year, month = (int(part) for part in month.split("-"))
+        filters = {
+            key: request.query_params[key]
+            for key in ("object_type", "object_id", "action", "actor")
+            if key in request.query_params
+        }
+
+        def lines():
+            for row in audit_archive.iter_segment(year, month):
+                if all(row[key] == value for key, value in filters.items()):
+                    yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+        return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+
+
+# Prometheus scrape endpoint, all processes' numbers in multiprocess mode
+def metrics_view(request):
+    from .services import metrics
+
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,92 @@
+"""
+Concurrent load on the read endpoints: WSGI (gunicorn) vs ASGI (uvicorn).
+
+    SERVER=wsgi WEB_WORKERS=4 ./entrypoint.sh            # on :8000
+    SERVER=asgi WEB_WORKERS=4 PORT=8001 ./entrypoint.sh  # on :8001
+    python benchmarks/async_load.py --wsgi http://127.0.0.1:8000 --asgi http://127.0.0.1:8001 \\
+        --concurrency 500 --requests 20000
+
+The sync paths (/api/order-list/, ...) are hit on the WSGI server and the
+/api/async/ paths on the ASGI server. Each of --concurrency clients sends
+requests back to back on its own connection until --requests are done;
+req/s and p50/p95/p99 latency are printed per server.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from urllib.parse import urlsplit
+
+PATHS = ["order-list/", "create-products/", "audit-log/"]
+
+
+async def fetch(url):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    target = parts.path + (f"?{parts.query}" if parts.query else "")
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    status = (await reader.readline()).split()[1]
+    await reader.read()
+    writer.close()
+    return int(status)
+
+
+async def client(urls, remaining, latencies, errors):
+    while remaining:
+        remaining.pop()
+        started = time.perf_counter()
+        try:
+            status = await fetch(next(urls))
+        except (OSError, IndexError, ValueError):
+            status = None
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            errors.append(status)
+
+
+async def run(base, prefix, paths, concurrency, requests):
+    urls = itertools.cycle([f"{base.rstrip('/')}/api/{prefix}{path}" for path in paths])
+    remaining = list(range(requests))
+    latencies, errors = [], []
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(urls, remaining, latencies, errors) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0
+
+
+def report(label, latencies, errors, elapsed):
+    latencies.sort()
+    print(f"{label}")
+    print(f"  Requests             : {len(latencies)} ({len(errors)} errors)")
+    print(f"  Throughput           : {len(latencies) / elapsed if elapsed else 0:,.0f} req/s")
+    print(f"  Latency p50/p95/p99  : {percentile(latencies, 0.50):.1f} / "
+          f"{percentile(latencies, 0.95):.1f} / {percentile(latencies, 0.99):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wsgi", default="http://127.0.0.1:8000")
+    parser.add_argument("--asgi", default="http://127.0.0.1:8001")
+    parser.add_argument("--path", action="append", help=f"endpoint under /api/ (default: {', '.join(PATHS)})")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    paths = args.path or PATHS
+    print("========== ASYNC READ LOAD ==========")
+    print(f"Concurrency            : {args.concurrency}")
+    print(f"Paths                  : {', '.join(paths)}")
+    for label, base, prefix in (("WSGI (sync views)", args.wsgi, ""), ("ASGI (async views)", args.asgi, "async/")):
+        if base:
+            report(label, *asyncio.run(run(base, prefix, paths, args.concurrency, args.requests)))
+    print("=====================================")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Rows/sec of the order list payload: ModelSerializer + RequestIDJSONRenderer
+against the fast path (.values() + field mapper + orjson / stdlib json).
+
+    python benchmarks/fast_read_path.py --seed 100000 --rows 5000
+
+--seed inserts that many extra orders first (bulk_create, no items).
+Each variant builds the same page body --repeat times from the same
+--rows orders; the bytes are checked to be identical.
+"""
+import argparse
+import os
+import sys
+import time
+from unittest import mock
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+django.setup()
+
+from base import fastpath
+from base.models import Order
+from base.renderers import RequestIDJSONRenderer
+from base.serializers import OrderSerializer
+from base.views import ORDER_FAST_FIELDS
+
+
+def seed(count, batch_size=10000):
+    for start in range(0, count, batch_size):
+        Order.objects.bulk_create(
+            [Order(status="DELIVERED", total_price=(i % 500) + 0.99) for i in range(min(batch_size, count - start))]
+        )
+
+
+class FakeRequest:
+    request_id = "benchmark"
+
+
+def serializer_path(rows):
+    orders = Order.objects.order_by("-created_at", "-id")[:rows]
+    data = {"next": None, "previous": None, "results": OrderSerializer(orders, many=True).data}
+    return RequestIDJSONRenderer().render(data, renderer_context={"request": FakeRequest(), "response": None})
+
+
+def fast_path(rows, mapper):
+    orders = Order.objects.order_by("-created_at", "-id").values(*mapper.values)[:rows]
+    data = {"next": None, "previous": None, "results": [mapper(row) for row in orders]}
+    return fastpath.json_response(FakeRequest(), data).content
+
+
+def measure(label, build, rows, repeat):
+    body = build()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        build()
+    elapsed = time.perf_counter() - started
+    rate = rows * repeat / elapsed if elapsed else 0
+    print(f"{label:<22}: {rate:>12,.0f} rows/sec  ({elapsed / repeat * 1000:.1f} ms/page)")
+    return body, rate
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+
+    rows = min(args.rows, Order.objects.count())
+    mapper = fastpath.FieldMapper(Order, ORDER_FAST_FIELDS, ["created_at", "id"])
+
+    print("========== FAST READ PATH ==========")
+    print(f"Rows per page          : {rows}")
+    reference, slow = measure("Serializer path", lambda: serializer_path(rows), rows, args.repeat)
+
+    variants = [("Fast path (stdlib)", None)]
+    if fastpath.orjson is not None:
+        variants.append(("Fast path (orjson)", fastpath.orjson))
+
+    for label, encoder in variants:
+        with mock.patch.object(fastpath, "orjson", encoder):
+            body, rate = measure(label, lambda: fast_path(rows, mapper), rows, args.repeat)
+        print(f"  speed-up             : {rate / slow if slow else 0:.1f}x, identical bytes: {body == reference}")
+    print("====================================")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Rows/sec and peak RSS of the streaming order export.
+
+    python benchmarks/order_export.py --seed 1000000
+    python benchmarks/order_export.py --output csv --kind items
+
+--seed inserts that many extra orders first (bulk_create, no items).
+Peak RSS should stay flat when the number of exported rows grows.
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+django.setup()
+
+from django.test import RequestFactory
+
+from base.models import Order
+from base.views import OrderExportView
+
+
+def seed(count, batch_size=10000):
+    for start in range(0, count, batch_size):
+        Order.objects.bulk_create(
+            [Order(status="DELIVERED", total_price=(i % 500) + 0.99) for i in range(min(batch_size, count - start))]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--kind", choices=["orders", "items"], default="orders")
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    request = RequestFactory().get("/api/order-export/", {"output": args.output, "kind": args.kind})
+
+    started = time.perf_counter()
+    response = OrderExportView.as_view()(request)
+    rows = 0
+    size = 0
+    for chunk in response.streaming_content:
+        rows += chunk.count(b"\n")
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.output == "csv":
+        rows -= 1
+
+    print("========== ORDER EXPORT ==========")
+    print(f"Rows            : {rows}")
+    print(f"Bytes           : {size}")
+    print(f"Seconds         : {elapsed:.2f}")
+    print(f"Rows/sec        : {rows / elapsed if elapsed else 0:.0f}")
+    print(f"Peak RSS        : {rss_after / 1024:.1f} MiB (+{(rss_after - rss_before) / 1024:.1f} MiB during export)")
+    print("==================================")
+
+
+if __name__ == "__main__":
+    main()
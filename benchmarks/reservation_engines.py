@@ -0,0 +1,86 @@
+"""
+Throughput of the two reservation engines on a single hot product.
+
+Run inside the web container (needs the Postgres database, SQLite
+serializes writers and hides the difference):
+
+    python benchmarks/reservation_engines.py --workers 32 --attempts 2000
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+
+from base.models import Product, Reservation
+from base.services.reservation_service import reserve_stock, RESERVATION_ENGINES
+
+
+def run(engine, workers, attempts, stock):
+    settings.STOCK_RESERVATION_ENGINE = engine
+    product = Product.objects.create(
+        name=f"Bench {engine}",
+        total_stock=stock,
+        available_stock=stock,
+        reserved_stock=0,
+        price=1,
+    )
+
+    def attempt(_):
+        try:
+            reserve_stock(product.id, 1)
+            return True
+        except ValueError:
+            return False
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(attempt, range(attempts)))
+    elapsed = time.perf_counter() - started
+
+    product.refresh_from_db()
+    assert product.available_stock + product.reserved_stock == product.total_stock
+    assert product.reserved_stock == outcomes.count(True)
+
+    Reservation.objects.filter(product=product).delete()
+    product.delete()
+
+    return {
+        "engine": engine,
+        "succeeded": outcomes.count(True),
+        "failed": outcomes.count(False),
+        "seconds": elapsed,
+        "ops_per_sec": attempts / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--attempts", type=int, default=2000)
+    parser.add_argument("--stock", type=int, default=1500)
+    args = parser.parse_args()
+
+    print("========== RESERVATION ENGINES ==========")
+    for engine in RESERVATION_ENGINES:
+        result = run(engine, args.workers, args.attempts, args.stock)
+        print(
+            f"{result['engine']:<12} {result['ops_per_sec']:>9.1f} ops/s  "
+            f"ok={result['succeeded']} rejected={result['failed']} ({result['seconds']:.2f}s)"
+        )
+    print("=========================================")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,465 @@
+"""
+Load and chaos harness for the stock and order paths.
+
+    python chaostest.py --products 20 --stock 50 --operations 5000 --concurrency 32 \\
+        --skew zipf --mix reserve=50,purchase=30,expire=10,transition=10
+
+Every operation is drawn for a product picked uniformly or from a Zipf
+distribution (--skew zipf, --zipf-s), so a few hot SKUs take most of the
+traffic:
+- reserve     POST /api/reservation/                                  (HTTP)
+- purchase    attempt_purchase_task                                   (Celery)
+- expire      update_reservation on a reservation made during the run (Celery)
+- transition  PATCH /api/order/<id>/ to one of the allowed next states (HTTP),
+              settling the one reserved unit each order holds
+
+HTTP goes to --base-url, or through django.test.Client inside this process
+when no URL is given. Celery goes through the configured broker (start a
+worker), or runs inline when CELERY_TASK_ALWAYS_EAGER is set.
+
+Running locally:
+- local Postgres and Redis: POSTGRES_HOST=localhost REDIS_HOST=localhost
+  python chaostest.py ...  (plus `celery -A project worker`)
+- no services at all: python chaostest.py --local [chaos.sqlite3] ...
+  (SQLite file, eager Celery; SQLite serializes writers, keep --concurrency low)
+
+After the run every product is checked against the stock invariant
+(Product.clean()). The report (throughput, p50/p95/p99 latency per
+operation, lock wait, deadlocks, retries, invariant) is printed and saved
+as JSON (--output, default benchmarks/results/) so runs can be diffed
+between commits; --compare old.json prints the change. The exit status
+is 1 when the invariant does not hold.
+"""
+import argparse
+import json
+import logging
 import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 import django
 
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+OPERATIONS = ("reserve", "purchase", "expire", "transition")
+TRANSPORTS = {"reserve": "http", "purchase": "celery", "expire": "celery", "transition": "http"}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load / chaos benchmark for reservations, purchases and orders")
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--stock", type=int, default=100, help="Initial stock of every product")
+    parser.add_argument("--buckets", type=int, default=0, help="Shard every product over this many stock buckets")
+    parser.add_argument("--orders", type=int, default=None, help="Orders for the transition operation (default 2 x products)")
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--skew", choices=("uniform", "zipf"), default="uniform")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent, higher = hotter top SKUs")
+    parser.add_argument("--mix", default="reserve=50,purchase=30,expire=10,transition=10",
+                        help="Operation weights, e.g. reserve=70,purchase=30")
+    parser.add_argument("--quantity", type=int, default=1, help="Units per reserve operation")
+    parser.add_argument("--retries", type=int, default=3, help="Retries of an operation that hit a deadlock / busy database")
+    parser.add_argument("--task-timeout", type=float, default=30.0)
+    parser.add_argument("--base-url", default=None, help="HTTP server (default: in-process test client)")
+    parser.add_argument("--local", nargs="?", const="chaos.sqlite3", default=None, metavar="SQLITE_PATH",
+                        help="Run without Postgres / Redis / worker: SQLite file and eager Celery")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Report path (default benchmarks/results/chaos-<commit>-<time>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier report to compare against")
+    args = parser.parse_args()
+
+    mix = {}
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            parser.error(f"unknown operation {name!r} in --mix (choose from {', '.join(OPERATIONS)})")
+        mix[name.strip()] = float(weight or 1)
+    args.mix = mix
+    args.orders = args.products * 2 if args.orders is None else args.orders
+    return args
+
+
+def setup_django(args):
+    sys.path.insert(0, ROOT)
+    if args.local:
+        os.environ["SQLITE_PATH"] = os.path.abspath(args.local)
+        os.environ["CELERY_EAGER"] = "1"
+        os.environ["CATALOG_CACHE_BACKEND"] = "local"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+    django.setup()
+    # rejected reservations / transitions are expected, only log server errors
+    logging.getLogger("django.request").setLevel(logging.ERROR)
+
+    if args.local:
+        from django.core.management import call_command
+
+        call_command("migrate", verbosity=0)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] * 1000, 2)
+
+
+def is_retryable(error):
+    text = str(error).lower()
+    return "deadlock" in text or "database is locked" in text
+
+
+class Run:
+    """Shared state of one benchmark run (all threads)."""
+
+    def __init__(self, args, product_ids, order_ids):
+        from django.test import Client
+
+        self.args = args
+        self.product_ids = product_ids
+        self.order_status = {order_id: "PENDING" for order_id in order_ids}
+        self.reservations = deque()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.client_class = Client
+
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(list)
+        self.deadlocks = 0
+        self.retries = 0
+        self.http_lock_wait = 0.0
+
+    # -- transports --------------------------------------------------------
+
+    def http(self, method, path, body):
+        data = json.dumps(body).encode()
+        if self.args.base_url is None:
+            client = getattr(self.local, "client", None)
+            if client is None:
+                client = self.local.client = self.client_class(HTTP_HOST="localhost", raise_request_exception=False)
+            response = getattr(client, method.lower())(path, data, content_type="application/json")
+            status, content, timing = response.status_code, response.content, response.get("Server-Timing", "")
+        else:
+            request = urllib.request.Request(
+                self.args.base_url.rstrip("/") + path, data=data, method=method,
+                headers={"Content-Type": "application/json"},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    status, content, timing = response.status, response.read(), response.headers.get("Server-Timing", "")
+            except urllib.error.HTTPError as e:
+                status, content, timing = e.code, e.read(), e.headers.get("Server-Timing", "")
+
+        for part in timing.split(","):
+            name, _, params = part.strip().partition(";")
+            if name == "lock" and params.startswith("dur="):
+                with self.lock:
+                    self.http_lock_wait += float(params[4:]) / 1000
+
+        outcome = "ok" if status < 400 else "rejected" if status < 500 else "error"
+        try:
+            payload = json.loads(content) if content else None
+        except ValueError:
+            payload = None
+        return outcome, payload
+
+    def task(self, task, *task_args):
+        result = task.apply_async(args=task_args)
+        # eager results run inside the caller; this thread is never a worker task itself
+        value = result.get(timeout=self.args.task_timeout, propagate=False, disable_sync_subtasks=False)
+        if result.failed():
+            raise value if isinstance(value, BaseException) else RuntimeError(str(value))
+        return value
+
+    # -- operations --------------------------------------------------------
+
+    def reserve(self, product_id):
+        outcome, payload = self.http("POST", "/api/reservation/", {"product": product_id, "quantity": self.args.quantity})
+        if outcome == "ok" and isinstance(payload, dict) and "id" in payload:
+            with self.lock:
+                self.reservations.append(payload["id"])
+        return outcome
+
+    def purchase(self, product_id):
+        from base.tasks import attempt_purchase_task
+
+        return "ok" if self.task(attempt_purchase_task, product_id) == "SUCCESS" else "rejected"
 
+    def expire(self, product_id):
+        from base.tasks import update_reservation
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
-django.setup()
+        with self.lock:
+            if not self.reservations:
+                return "skipped"
+            reservation_id = self.reservations.popleft()
+        result = self.task(update_reservation, reservation_id)
+        return "ok" if result.get("status") == "Reservation Updated" else "rejected"
+
+    def transition(self, product_id):
+        from base.services.order_service import ORDER_TRANSITIONS
+
+        with self.lock:
+            open_orders = [order_id for order_id, status in self.order_status.items() if ORDER_TRANSITIONS.get(status)]
+            if not open_orders:
+                return "skipped"
+            order_id = random.choice(open_orders)
+            new_status = random.choice(ORDER_TRANSITIONS[self.order_status[order_id]])
+
+        outcome, payload = self.http("PATCH", f"/api/order/{order_id}/", {"status": new_status})
+        if outcome == "ok":
+            with self.lock:
+                self.order_status[order_id] = new_status
+        return outcome
+
+    def execute(self, job):
+        operation, product_id = job
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                outcome = getattr(self, operation)(product_id)
+                break
+            except Exception as e:
+                if is_retryable(e):
+                    with self.lock:
+                        self.deadlocks += "deadlock" in str(e).lower()
+                        if attempt < self.args.retries:
+                            self.retries += 1
+                    if attempt < self.args.retries:
+                        attempt += 1
+                        time.sleep(0.01 * attempt)
+                        continue
+                outcome = "error"
+                with self.lock:
+                    if len(self.errors[operation]) < 5:
+                        self.errors[operation].append(f"{type(e).__name__}: {e}")
+                break
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.outcomes[operation][outcome] += 1
+            if outcome != "skipped":
+                self.latencies[operation].append(elapsed)
+
+
+def create_fixtures(args, run_id):
+    from base.models import Order, OrderItem, Product
+    from base.services.shard_service import enable_sharding
+
+    # every order holds one reserved unit of a product (round robin), so the
+    # transitions release, confirm and restock real stock
+    held = [len(range(i, args.orders, args.products)) for i in range(args.products)]
+    if max(held, default=0) > args.stock:
+        raise SystemExit("--orders needs at most --stock orders per product")
+
+    products = Product.objects.bulk_create([
+        Product(
+            name=f"Chaos {run_id} #{i}", total_stock=args.stock,
+            available_stock=args.stock - held[i], reserved_stock=held[i], price=10,
+        )
+        for i in range(args.products)
+    ])
+    if args.buckets:
+        for product in products:
+            enable_sharding(product.id, buckets=args.buckets)
+    orders = Order.objects.bulk_create([Order(status="PENDING", total_price=10) for _ in range(args.orders)])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=products[i % len(products)], quantity=1, unit_price=10)
+        for i, order in enumerate(orders)
+    ])
+    return [product.id for product in products], [order.id for order in orders]
+
+
+def schedule(args, product_ids):
+    rng = random.Random(args.seed)
+    if args.skew == "zipf":
+        weights = [1 / (rank ** args.zipf_s) for rank in range(1, len(product_ids) + 1)]
+    else:
+        weights = [1] * len(product_ids)
+    operations = list(args.mix)
+    return [
+        (rng.choices(operations, weights=[args.mix[name] for name in operations])[0], rng.choices(product_ids, weights=weights)[0])
+        for _ in range(args.operations)
+    ]
+
+
+def check_invariant(product_ids):
+    from base.models import Product
+
+    violations = []
+    for product in Product.objects.filter(id__in=product_ids).prefetch_related("buckets").order_by("id"):
+        available, reserved = product.stock_levels()
+        try:
+            product.clean()
+            holds = available >= 0 and reserved >= 0 and product.sold_stock >= 0
+        except AssertionError:
+            holds = False
+        if not holds:
+            violations.append({
+                "product": product.id, "total_stock": product.total_stock,
+                "available_stock": available, "reserved_stock": reserved, "sold_stock": product.sold_stock,
+            })
+    return {"holds": not violations, "products_checked": len(product_ids), "violations": violations}
+
+
+def task_metric_sum(name):
+    from base.services import metrics
+
+    total = 0.0
+    for (sample_name, _), sample in metrics.collect().items():
+        if sample_name == name:
+            total += sample[-2] if isinstance(sample, list) else sample
+    return total
+
+
+def build_report(args, run, elapsed, invariant, celery_lock_wait, celery_retries):
+    from django.conf import settings
+    from django.db import connection
+
+    all_latencies = sorted(value for values in run.latencies.values() for value in values)
+    operations = {}
+    for name in args.mix:
+        latencies = sorted(run.latencies[name])
+        operations[name] = {
+            "transport": TRANSPORTS[name],
+            "count": len(latencies),
+            **{outcome: run.outcomes[name][outcome] for outcome in ("ok", "rejected", "error", "skipped")},
+            "throughput_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "error_samples": run.errors[name],
+        }
+
+    return {
+        "commit": git_commit(),
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            key: getattr(args, key)
+            for key in ("products", "stock", "buckets", "orders", "operations", "concurrency", "skew", "zipf_s",
+                        "mix", "quantity", "retries", "seed")
+        },
+        "environment": {
+            "database": connection.vendor,
+            "celery": "eager" if settings.CELERY_TASK_ALWAYS_EAGER else "broker",
+            "http": args.base_url or "in-process",
+            "stock_engine": getattr(settings, "STOCK_RESERVATION_ENGINE", None),
+        },
+        "duration_s": round(elapsed, 3),
+        "throughput_per_s": round(len(all_latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(all_latencies, 0.50),
+            "p95": percentile(all_latencies, 0.95),
+            "p99": percentile(all_latencies, 0.99),
+        },
+        "operations": operations,
+        "lock_wait_ms": {
+            # Server-Timing of the HTTP responses; Celery from the task telemetry when this
+            # process can see it (eager, or a METRICS_MULTIPROC_DIR shared with the worker)
+            "http": round(run.http_lock_wait * 1000, 2),
+            "celery": None if celery_lock_wait is None else round(celery_lock_wait * 1000, 2),
+        },
+        "deadlocks": run.deadlocks,
+        "retries": run.retries,
+        "celery_retries": celery_retries,
+        "invariant": invariant,
+    }
+
+
+def print_report(report):
+    print("========== CHAOS / LOAD RUN ==========")
+    print(f"Commit                 : {report['commit']}")
+    print(f"Environment            : {report['environment']['database']}, celery {report['environment']['celery']}, "
+          f"http {report['environment']['http']}")
+    print(f"Duration               : {report['duration_s']} s")
+    print(f"Throughput             : {report['throughput_per_s']} ops/s")
+    latency = report["latency_ms"]
+    print(f"Latency p50/p95/p99    : {latency['p50']} / {latency['p95']} / {latency['p99']} ms")
+    for name, stats in report["operations"].items():
+        print(f"  {name:<11} ({stats['transport']:<6}): {stats['count']:>6} done, {stats['ok']} ok, "
+              f"{stats['rejected']} rejected, {stats['error']} errors, {stats['skipped']} skipped, "
+              f"p95 {stats['p95_ms']} ms")
+    print(f"Lock wait              : http {report['lock_wait_ms']['http']} ms, celery {report['lock_wait_ms']['celery']} ms")
+    print(f"Deadlocks / retries    : {report['deadlocks']} / {report['retries']} (celery retries {report['celery_retries']})")
+    invariant = report["invariant"]
+    print(f"Invariant holds        : {invariant['holds']} ({len(invariant['violations'])} of "
+          f"{invariant['products_checked']} products violate it)")
+    print("======================================")
+
+
+def print_comparison(report, path):
+    with open(path) as f:
+        old = json.load(f)
+
+    def line(label, before, after):
+        if before is None or after is None:
+            change = ""
+        else:
+            change = f" ({(after - before) / before * 100:+.1f}%)" if before else ""
+        print(f"{label:<23}: {before} -> {after}{change}")
+
+    print(f"========== COMPARED WITH {old.get('commit')} ==========")
+    line("Throughput (ops/s)", old.get("throughput_per_s"), report["throughput_per_s"])
+    for key in ("p50", "p95", "p99"):
+        line(f"Latency {key} (ms)", old.get("latency_ms", {}).get(key), report["latency_ms"][key])
+    for name, stats in report["operations"].items():
+        line(f"{name} p95 (ms)", old.get("operations", {}).get(name, {}).get("p95_ms"), stats["p95_ms"])
+    line("Deadlocks", old.get("deadlocks"), report["deadlocks"])
 
-from celery import group
-from base.models import Product
-from base.tasks import attempt_purchase_task
 
 def main():
-    product = Product.objects.create(
-        name="Chaos Product 1",
-        total_stock=5,
-        available_stock=5,
-        reserved_stock=0,
-        price=100
+    args = parse_args()
+    setup_django(args)
+
+    from django.conf import settings
+    from base.services import metrics
+
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+    product_ids, order_ids = create_fixtures(args, run_id)
+    jobs = schedule(args, product_ids)
+    run = Run(args, product_ids, order_ids)
+
+    # Celery numbers are visible here when tasks run inline or share the metrics directory
+    celery_visible = settings.CELERY_TASK_ALWAYS_EAGER or metrics.is_multiprocess()
+    lock_before = task_metric_sum("celery_task_lock_wait_seconds")
+    retries_before = task_metric_sum("celery_task_retries_total")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run.execute, jobs))
+    elapsed = time.perf_counter() - started
+
+    report = build_report(
+        args, run, elapsed, check_invariant(product_ids),
+        task_metric_sum("celery_task_lock_wait_seconds") - lock_before if celery_visible else None,
+        int(task_metric_sum("celery_task_retries_total") - retries_before) if celery_visible else None,
     )
+    print_report(report)
 
-    job = group(attempt_purchase_task.s(product.id) for _ in range(50))
-    result = job.apply_async()
-    outputs = result.get()
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"chaos-{report['commit'] or 'local'}-{run_id}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Report                 : {output}")
 
-    succeeded = outputs.count("SUCCESS")
-    failed = outputs.count("FAILURE")
+    if args.compare:
+        print_comparison(report, args.compare)
 
-    product.refresh_from_db()
+    sys.exit(0 if report["invariant"]["holds"] else 1)
 
-    print("========== CHAOS TEST RESULT ==========")
-    print(f"Succeeded count : {succeeded}")
-    print(f"Failed count    : {failed}")
-    print(f"Final stock     : {product.total_stock}")
-    print("=======================================")
 
 if __name__ == "__main__":
     main()
@@ -4,5 +4,31 @@ set -e
 echo "Running migrations..."
 python manage.py migrate --noinput
 
+# SERVER=asgi (uvicorn, serves the /api/async/ endpoints natively),
+# SERVER=wsgi (gunicorn), anything else: the development server
+WEB_WORKERS=${WEB_WORKERS:-4}
+# PORT lets a second server run next to the first (benchmarks/async_load.py)
+PORT=${PORT:-8000}
+
+# several worker processes: /metrics merges their snapshot files (TELEMETRY MODE "multiprocess");
+# a directory given from outside may be shared with the celery worker, so it is not wiped
+if [ -z "$METRICS_MULTIPROC_DIR" ] && { [ "$SERVER" = "asgi" ] || [ "$SERVER" = "wsgi" ]; }; then
+    export METRICS_MULTIPROC_DIR=/tmp/metrics
+    rm -rf "$METRICS_MULTIPROC_DIR"
+fi
+if [ -n "$METRICS_MULTIPROC_DIR" ]; then
+    mkdir -p "$METRICS_MULTIPROC_DIR"
+fi
+
 echo "Starting server..."
-exec python manage.py runserver 0.0.0.0:8000
+case "$SERVER" in
+    asgi)
+        exec uvicorn project.asgi:application --host 0.0.0.0 --port "$PORT" --workers "$WEB_WORKERS"
+        ;;
+    wsgi)
+        exec gunicorn project.wsgi:application --bind "0.0.0.0:$PORT" --workers "$WEB_WORKERS"
+        ;;
+    *)
+        exec python manage.py runserver "0.0.0.0:$PORT"
+        ;;
+esac
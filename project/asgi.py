@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_asgi_application()
+
+# fill the product catalog cache before the first request
+from base.services import catalog_cache  # noqa: E402
+
+catalog_cache.warm_on_start()
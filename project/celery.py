@@ -5,4 +5,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 app = Celery('project')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+# queue lag, runtime, retries and lock wait per task, exported on /metrics;
+# imported after DJANGO_SETTINGS_MODULE is set, base.services reads settings
+from base.services import task_telemetry  # noqa: E402
+
+task_telemetry.connect()
\ No newline at end of file
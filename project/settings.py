@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'base.middleware.request_id.RequestIDMiddleware',
+    'base.middleware.idempotency.IdempotencyMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -85,31 +88,139 @@ WSGI_APPLICATION = 'project.wsgi.application'
 #     }
 # }
 
+# Outside compose (e.g. chaostest.py on a laptop): POSTGRES_HOST / REDIS_HOST point at
+# local services, SQLITE_PATH swaps Postgres for a SQLite file, CELERY_EAGER=1 runs
+# tasks inline instead of through the broker and CATALOG_CACHE_BACKEND=local keeps the
+# catalog cache in process
+POSTGRES_HOST = os.environ.get('POSTGRES_HOST', 'db')
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': 'postgres',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
-        'HOST': 'db',
+        'HOST': POSTGRES_HOST,
         'PORT': 5432,
     }
 }
 
+if os.environ.get('SQLITE_PATH'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ['SQLITE_PATH'],
+            # IMMEDIATE: writers queue on the lock instead of failing with "database is locked"
+            'OPTIONS': {'timeout': 30, 'transaction_mode': 'IMMEDIATE'},
+        }
+    }
+
 
-CELERY_BROKER_URL = 'redis://redis:6379/0'
-CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
+CELERY_BROKER_URL = f'redis://{REDIS_HOST}:6379/0'
+CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:6379/0'
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_EAGER') == '1'
+
+# `manage.py test`
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
 
 from celery.schedules import crontab
 
-#every 10 minutes
+#every minute: sweeps expired reservations in bulk (replaces the per-reservation ETA tasks)
 CELERY_BEAT_SCHEDULE = {
     'reservation-cleanup': {
         'task': 'base.tasks.reservation_cleanup',
-        'schedule': crontab(minute='*/10'),
+        'schedule': crontab(minute='*'),
+    },
+    'reconcile-admission-tokens': {
+        'task': 'base.tasks.reconcile_admission_tokens',
+        'schedule': crontab(minute='*'),
+    },
+    'maintain-audit-log': {
+        'task': 'base.tasks.maintain_audit_log',
+        'schedule': crontab(minute=0, hour=3),
     },
+    'rebalance-stock-buckets': {
+        'task': 'base.tasks.rebalance_stock_buckets',
+        'schedule': crontab(minute='*'),
+    },
+    'purge-idempotency-keys': {
+        'task': 'base.tasks.purge_idempotency_keys',
+        'schedule': crontab(minute=30),
+    },
+}
+
+# "locking": select_for_update + save, "conditional": one guarded UPDATE (no row lock held in Python)
+STOCK_RESERVATION_ENGINE = 'locking'
+
+# Redis token counter that rejects oversold requests before they reach Postgres.
+# BACKEND "redis" (Lua DECRBY on URL) or "local" (in-process, tests / single process)
+STOCK_ADMISSION = {
+    'ENABLED': False,
+    'BACKEND': 'redis',
+    'URL': f'redis://{REDIS_HOST}:6379/2',
 }
 
+# "buffered": audit entries are queued on commit and written in bulk by a background
+# flusher (BATCH_SIZE rows / FLUSH_INTERVAL seconds, at most MAX_QUEUE pending),
+# "sync": one INSERT per entry inside the caller's transaction (used by the test
+# suite, where a background flusher would race the test database and drop entries)
+AUDIT_LOG = {
+    'MODE': 'sync' if TESTING else 'buffered',
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_QUEUE': 50000,
+}
+
+# Monthly audit partitions (Postgres): keep MONTHS months online, create MONTHS_AHEAD
+# partitions in advance, older months are exported to ARCHIVE_DIR as .ndjson.gz and dropped
+AUDIT_LOG_RETENTION = {
+    'MONTHS': 12,
+    'MONTHS_AHEAD': 3,
+    'ARCHIVE_DIR': BASE_DIR / 'archive' / 'auditlog',
+}
+
+# Product catalog cache: in-process LRU (LOCAL_MAX_ENTRIES) in front of Redis (URL),
+# keys are versioned and bumped on every product / stock write. The static rows and
+# the stock counters expire after STATIC_TTL / STOCK_TTL seconds.
+# BACKEND "redis" or "local" (in-process only, tests / single process)
+CATALOG_CACHE = {
+    'ENABLED': True,
+    'BACKEND': os.environ.get('CATALOG_CACHE_BACKEND', 'redis'),
+    'URL': f'redis://{REDIS_HOST}:6379/3',
+    'STATIC_TTL': 300,
+    'STOCK_TTL': 5,
+    'LOCAL_MAX_ENTRIES': 64,
+    'WARM_ON_START': True,
+}
+
+# POSTs to PATHS with an Idempotency-Key header run once per key; the first response
+# is kept for TTL seconds and replayed. Duplicates wait up to WAIT_TIMEOUT seconds for
+# the first request, an unfinished key older than LOCK_TIMEOUT seconds is taken over.
+IDEMPOTENCY = {
+    'ENABLED': True,
+    'PATHS': ['/api/reservation/', '/api/create-order/', '/api/create-order/bulk/', '/api/order/bulk-status/'],
+    'TTL': 86400,
+    'WAIT_TIMEOUT': 10,
+    'LOCK_TIMEOUT': 60,
+    'POLL_INTERVAL': 0.05,
+}
+
+# Per-request timings (wall, DB, serializer, render) as Server-Timing headers and
+# histograms on /metrics. MODE "multiprocess" merges all worker processes through
+# snapshot files in MULTIPROC_DIR (set METRICS_MULTIPROC_DIR, see entrypoint.sh)
+TELEMETRY = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'MODE': 'multiprocess' if os.environ.get('METRICS_MULTIPROC_DIR') else 'local',
+    'MULTIPROC_DIR': os.environ.get('METRICS_MULTIPROC_DIR', ''),
+    'FLUSH_INTERVAL': 5,
+}
+
+# Read-only list/detail endpoints with `fast_fields` skip the serializers: .values()
+# rows, precompiled field mappers and orjson (when installed), same JSON bytes
+FAST_READ_PATH = True
+
 REST_FRAMEWORK = {
     "DEFAULT_RENDERER_CLASSES": (
         "base.renderers.RequestIDJSONRenderer",
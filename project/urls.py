@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path,include
 from django.shortcuts import render
+from base.views import metrics_view
 
 def home(request):
 
@@ -25,5 +26,6 @@ def home(request):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/',include('base.urls')),
+    path('metrics', metrics_view),
     path("",home)
 ]
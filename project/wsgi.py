@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_wsgi_application()
+
+# fill the product catalog cache before the first request
+from base.services import catalog_cache  # noqa: E402
+
+catalog_cache.warm_on_start()